@@ -2,22 +2,40 @@
 Sleep Mode Benchmarks - Measures wake latency and memory savings.
 
 Uses vLLM's server-side metrics for accurate timing measurements.
+
+With --sweep, measures sleep/wake cost across sleep levels and idle times,
+compares against a cold start (container restart), and writes a fitted
+cost model (see cost_model.py) for residency policies to use.
 """
 
 import argparse
-import statistics
+import subprocess
 import sys
 import time
 
+import requests
+
 # Add project root to path for shared imports
 sys.path.insert(0, "../..")
-from shared import get_gpu_memory_mb, get_vllm_metrics, timer
+from shared import GPUMemorySampler, StreamTimeline, get_vllm_metrics, timer
+from shared.histogram import LatencyHistogram, print_latency_summary
+from shared.results import record_run
 
+from cost_model import SleepCostModel, print_cost_model, save_cost_model
 from router import SleepModeRouter
 
+TTFT_PROMPT = "The weather today is"
+
 
-def run_benchmark(router: SleepModeRouter, iterations: int = 3):
-    """Run the sleep mode benchmark suite."""
+def run_benchmark(router: SleepModeRouter, iterations: int = 3, memory_backend: str = "auto"):
+    """
+    Run the sleep mode benchmark suite.
+
+    Args:
+        router: Router for the sleep-mode server
+        iterations: Wake latency samples to take
+        memory_backend: GPU memory source (see shared.gpu_memory.make_backend)
+    """
 
     print("=" * 70)
     print("Sleep Mode Benchmark")
@@ -36,20 +54,22 @@ def run_benchmark(router: SleepModeRouter, iterations: int = 3):
     baseline_metrics = get_vllm_metrics(router.base_url)
     print(f"\nBaseline vLLM metrics: {baseline_metrics}")
 
-    # Initial memory
-    mem_awake = get_gpu_memory_mb()
+    # Initial memory (sampled continuously from here on)
+    mem = GPUMemorySampler(memory_backend).start()
+    mem_awake = mem.wait_stable()
     print(f"\nGPU Memory (awake): {mem_awake['used_mb']}MB used / {mem_awake['total_mb']}MB total")
 
-    # Measure memory while sleeping
+    # Measure memory while sleeping; wait for readings to settle instead of a fixed sleep
     print("\nMeasuring sleep memory...")
     if router.sleep():
-        time.sleep(1)
-        mem_sleeping = get_gpu_memory_mb()
+        with mem.phase("sleep"):
+            mem_sleeping = mem.wait_stable()
         print(f"GPU Memory (sleeping): {mem_sleeping['used_mb']}MB used")
         mem_freed = mem_awake['used_mb'] - mem_sleeping['used_mb']
         print(f"Memory freed: {mem_freed}MB ({mem_freed / mem_awake['used_mb'] * 100:.1f}%)")
-        router.wake()
-        time.sleep(1)
+        with mem.phase("wake"):
+            router.wake()
+            mem.wait_stable()
     else:
         print("Failed to sleep for memory measurement")
         mem_sleeping = None
@@ -57,7 +77,8 @@ def run_benchmark(router: SleepModeRouter, iterations: int = 3):
 
     # Benchmark wake latency
     print(f"\nBenchmarking wake latency ({iterations} iterations)...")
-    wake_latencies = []
+    wake_hist = LatencyHistogram()
+    wake_ms = []
 
     for i in range(iterations):
         print(f"  Iteration {i + 1}/{iterations}...", end=" ", flush=True)
@@ -74,7 +95,8 @@ def run_benchmark(router: SleepModeRouter, iterations: int = 3):
             success = router.wake()
 
         if success:
-            wake_latencies.append(t.elapsed_seconds)
+            wake_hist.record(t.elapsed_ms)
+            wake_ms.append(t.elapsed_ms)
             print(f"wake: {t.elapsed_ms:.0f}ms")
         else:
             print("wake failed")
@@ -83,25 +105,24 @@ def run_benchmark(router: SleepModeRouter, iterations: int = 3):
 
     # Get final metrics from vLLM
     final_metrics = get_vllm_metrics(router.base_url)
+    wake_peak_mb = mem.peak_mb("wake", gpu=0) if "wake" in mem.phases else None
+    mem.stop()
 
     # Print results
     print("\n" + "=" * 70)
     print("Results")
     print("=" * 70)
 
-    if wake_latencies:
-        print(f"\nWake Latency (client-measured):")
-        print(f"  Min:    {min(wake_latencies) * 1000:.0f}ms")
-        print(f"  Max:    {max(wake_latencies) * 1000:.0f}ms")
-        print(f"  Mean:   {statistics.mean(wake_latencies) * 1000:.0f}ms")
-        if len(wake_latencies) > 1:
-            print(f"  Stdev:  {statistics.stdev(wake_latencies) * 1000:.0f}ms")
+    if wake_hist.count:
+        print_latency_summary("Wake Latency (client-measured)", wake_hist)
 
     print(f"\nMemory:")
     print(f"  Awake:    {mem_awake['used_mb']}MB")
     if mem_sleeping:
         print(f"  Sleeping: {mem_sleeping['used_mb']}MB")
         print(f"  Freed:    {mem_freed}MB ({mem_freed / mem_awake['used_mb'] * 100:.1f}%)")
+    if wake_peak_mb is not None:
+        print(f"  Peak during wake: {wake_peak_mb:.0f}MB")
 
     if final_metrics:
         print(f"\nvLLM Server Metrics:")
@@ -113,21 +134,244 @@ def run_benchmark(router: SleepModeRouter, iterations: int = 3):
     print("\n" + "=" * 70)
 
     return {
-        "wake_latency_ms": statistics.mean(wake_latencies) * 1000 if wake_latencies else None,
+        "wake_latency_ms": wake_hist.mean,
+        "wake_latency_p99_ms": wake_hist.percentile(99),
         "memory_freed_mb": mem_freed,
         "memory_awake_mb": mem_awake['used_mb'],
         "memory_sleeping_mb": mem_sleeping['used_mb'] if mem_sleeping else None,
+        "memory_wake_peak_mb": wake_peak_mb,
+        "samples": {"wake_latency_ms": wake_ms},
     }
 
 
+def measure_ttft(router: SleepModeRouter) -> float | None:
+    """TTFT of one short streaming request, in ms."""
+    timeline = StreamTimeline()
+    for _ in router.client.complete_stream(TTFT_PROMPT, max_tokens=8, temperature=0.0, timeline=timeline):
+        pass
+    return timeline.ttft_ms
+
+
+def format_ms(ms: float | None) -> str:
+    """`ms` with one decimal, or "-" when there is no measurement."""
+    return f"{ms:.1f}ms" if ms is not None else "-"
+
+
+def reload_weights(router: SleepModeRouter) -> float | None:
+    """
+    Reload weights after a level-2 wake.
+
+    Level 2 discards the weights, so /wake_up alone leaves the model
+    unusable; newer vLLM versions reload them through /collective_rpc.
+
+    Returns:
+        Reload time in ms, or None if the server does not support it.
+    """
+    try:
+        with timer() as t:
+            resp = requests.post(
+                f"{router.base_url}/collective_rpc", json={"method": "reload_weights"}, timeout=300
+            )
+    except requests.RequestException:
+        return None
+    return t.elapsed_ms if resp.status_code == 200 else None
+
+
+def measure_cold_start(
+    router: SleepModeRouter,
+    compose_file: str,
+    env_file: str,
+    timeout_s: float = 600.0,
+) -> float | None:
+    """
+    Restart the vLLM container and time it until /health succeeds.
+
+    Returns:
+        Restart-to-healthy time in ms, or None on failure or timeout.
+    """
+    cmd = ["docker", "compose", "--env-file", env_file, "-f", compose_file, "restart"]
+    start = time.perf_counter()
+    try:
+        subprocess.run(cmd, check=True, capture_output=True, timeout=timeout_s)
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"Container restart failed: {e}")
+        return None
+    while time.perf_counter() - start < timeout_s:
+        if router.health_check():
+            return (time.perf_counter() - start) * 1000
+        time.sleep(0.25)
+    return None
+
+
+def run_sweep(
+    router: SleepModeRouter,
+    levels: list[int],
+    idle_times: list[float],
+    iterations: int = 3,
+    cold_starts: int = 1,
+    compose_file: str = "docker-compose.yml",
+    env_file: str = "../../.env",
+    output: str | None = "sleep_costs.json",
+    memory_backend: str = "auto",
+) -> SleepCostModel | None:
+    """
+    Sweep sleep level x idle time, measure cold start, and fit a cost model.
+
+    Each sample sleeps the model, idles, wakes it, and then measures TTFT
+    of the first request after the wake and of a second (warm) request.
+
+    Args:
+        router: Router for the sleep-mode server
+        levels: Sleep levels to test (1 and/or 2)
+        idle_times: Seconds to stay asleep before waking
+        iterations: Samples per (level, idle time)
+        cold_starts: Container restarts to time (0 to skip)
+        compose_file: Compose file of the running server
+        env_file: Env file passed to docker compose
+        output: JSON file to add this model's cost model to (None to skip)
+        memory_backend: GPU memory source (see shared.gpu_memory.make_backend)
+    """
+    print("=" * 70)
+    print("Sleep Mode Cost Sweep")
+    print("=" * 70)
+
+    if not router.health_check():
+        print("ERROR: Server not healthy")
+        return None
+
+    model = router.client.model
+    print(f"\nModel: {model}")
+    print(f"Levels: {levels}, idle times: {idle_times}s, {iterations} iterations each")
+
+    router.complete("Hello", max_tokens=10)
+    mem = GPUMemorySampler(memory_backend).start()
+    mem_awake = mem.wait_stable()
+    warned_reload = False
+    samples = []
+
+    for level in levels:
+        for idle_s in idle_times:
+            print(f"\nLevel {level}, idle {idle_s}s:")
+            for i in range(iterations):
+                with timer() as t_sleep:
+                    if not router.sleep(level=level):
+                        print(f"  {i + 1}: sleep failed")
+                        continue
+                phase = f"L{level}-idle{idle_s:g}-{i}"
+                with mem.phase(phase):
+                    time.sleep(idle_s)
+                sleeping_mb = mem.min_mb(phase, gpu=0)
+
+                with timer() as t_wake:
+                    woke = router.wake()
+                if not woke:
+                    print(f"  {i + 1}: wake failed")
+                    continue
+                wake_ms, reload_ms = t_wake.elapsed_ms, None
+                if level == 2:
+                    reload_ms = reload_weights(router)
+                    if reload_ms is None and not warned_reload:
+                        print("  WARNING: weight reload unsupported; level-2 TTFT is not meaningful")
+                        warned_reload = True
+                    wake_ms += reload_ms or 0.0
+
+                first_ttft = measure_ttft(router)
+                warm_ttft = measure_ttft(router)
+                freed = (
+                    mem_awake["used_mb"] - sleeping_mb
+                    if mem_awake and sleeping_mb is not None
+                    else None
+                )
+                samples.append(
+                    {
+                        "level": level,
+                        "idle_s": idle_s,
+                        "iteration": i,
+                        "sleep_ms": t_sleep.elapsed_ms,
+                        "wake_ms": wake_ms,
+                        "reload_ms": reload_ms,
+                        "first_ttft_ms": first_ttft,
+                        "warm_ttft_ms": warm_ttft,
+                        "memory_sleeping_mb": sleeping_mb,
+                        "memory_freed_mb": freed,
+                    }
+                )
+                print(
+                    f"  {i + 1}: sleep {t_sleep.elapsed_ms:.0f}ms, wake {wake_ms:.0f}ms, "
+                    f"first TTFT {format_ms(first_ttft)}, warm TTFT {format_ms(warm_ttft)}"
+                )
+
+    mem.stop()
+
+    cold_ms, cold_ttft = [], []
+    for i in range(cold_starts):
+        print(f"\nCold start {i + 1}/{cold_starts} (restarting container)...")
+        elapsed = measure_cold_start(router, compose_file, env_file)
+        if elapsed is None:
+            print("  cold start failed")
+            continue
+        cold_ms.append(elapsed)
+        ttft = measure_ttft(router)
+        if ttft is not None:  # No chunks streamed; nothing to average
+            cold_ttft.append(ttft)
+        print(f"  healthy after {elapsed:.0f}ms, first TTFT {format_ms(ttft)}")
+
+    cost = SleepCostModel.fit(
+        model,
+        samples,
+        memory_awake_mb=mem_awake["used_mb"] if mem_awake else None,
+        cold_start_ms=sum(cold_ms) / len(cold_ms) if cold_ms else None,
+        cold_start_ttft_ms=sum(cold_ttft) / len(cold_ttft) if cold_ttft else None,
+    )
+
+    print("\n" + "=" * 70)
+    print("Results")
+    print("=" * 70)
+    print_cost_model(cost)
+    if output:
+        save_cost_model(output, cost, samples)
+        print(f"\nCost model written to {output}")
+    print("\n" + "=" * 70)
+
+    return cost
+
+
 def main():
     parser = argparse.ArgumentParser(description="Sleep Mode Benchmark")
     parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
     parser.add_argument("--iterations", type=int, default=3, help="Number of iterations")
+    parser.add_argument("--sweep", action="store_true", help="Sweep levels/idle times and fit a cost model")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 2], choices=[1, 2], help="Sleep levels to sweep")
+    parser.add_argument(
+        "--idle-times", type=float, nargs="+", default=[0.5, 5.0, 30.0], help="Idle seconds before wake"
+    )
+    parser.add_argument("--cold-starts", type=int, default=1, help="Container restarts to time (0 = skip)")
+    parser.add_argument("--compose-file", default="docker-compose.yml", help="Compose file of the server")
+    parser.add_argument("--env-file", default="../../.env", help="Env file for docker compose")
+    parser.add_argument("--output", default="sleep_costs.json", help="Cost model JSON file")
+    parser.add_argument(
+        "--memory-backend", default="auto", help="GPU memory source: auto, nvml, nvidia-smi or fake:PATH"
+    )
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
     args = parser.parse_args()
 
     router = SleepModeRouter(base_url=args.url)
-    run_benchmark(router, iterations=args.iterations)
+    if args.sweep:
+        run_sweep(
+            router,
+            levels=args.levels,
+            idle_times=args.idle_times,
+            iterations=args.iterations,
+            cold_starts=args.cold_starts,
+            compose_file=args.compose_file,
+            env_file=args.env_file,
+            output=args.output,
+            memory_backend=args.memory_backend,
+        )
+    else:
+        results = run_benchmark(router, iterations=args.iterations, memory_backend=args.memory_backend)
+        if not args.no_save:
+            record_run("sleep_mode", "wake", vars(args), results, args.url, args.compose_file)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,190 @@
+"""
+Sleep/wake cost model - Fitted latency and memory costs per sleep level.
+
+benchmark.py --sweep measures sleep, wake and first-request TTFT for each
+sleep level and idle time, plus cold start by restarting the container.
+This module turns those samples into a small model per served model:
+
+    wake_ms(level, idle_s) = wake_base_ms + wake_ms_per_idle_s * idle_s
+    switch_cost_ms         = wake_ms + first_ttft_penalty_ms
+
+Results are stored as JSON keyed by model name, so sweeps of different
+model sizes accumulate in one file. Residency policies (scheduler.py) read
+the file instead of guessing wake latency.
+"""
+
+import json
+import os
+import statistics
+from dataclasses import asdict, dataclass, field
+
+
+def fit_line(xs: list[float], ys: list[float]) -> tuple[float, float]:
+    """
+    Least-squares fit of y = intercept + slope * x.
+
+    Returns:
+        (intercept, slope); slope is 0.0 when all x are equal.
+    """
+    if not xs:
+        raise ValueError("Cannot fit a line to no points")
+    mean_x, mean_y = statistics.fmean(xs), statistics.fmean(ys)
+    var_x = sum((x - mean_x) ** 2 for x in xs)
+    if var_x == 0:
+        return mean_y, 0.0
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+    return mean_y - slope * mean_x, slope
+
+
+@dataclass
+class LevelCosts:
+    """Fitted costs of one sleep level."""
+
+    level: int
+    samples: int
+    sleep_ms: float
+    wake_base_ms: float
+    wake_ms_per_idle_s: float
+    first_ttft_penalty_ms: float  # First-request TTFT after wake minus warm TTFT
+    memory_freed_mb: float | None
+    wake_p99_ms: float | None = None
+
+
+@dataclass
+class SleepCostModel:
+    """Sleep/wake/cold-start costs of one served model."""
+
+    model: str
+    memory_awake_mb: float | None = None
+    cold_start_ms: float | None = None
+    cold_start_ttft_ms: float | None = None
+    warm_ttft_ms: float | None = None
+    levels: dict[int, LevelCosts] = field(default_factory=dict)
+
+    @classmethod
+    def fit(cls, model: str, samples: list[dict], **extra) -> "SleepCostModel":
+        """
+        Fit per-level costs from sweep samples.
+
+        Args:
+            model: Served model name
+            samples: Dicts with level, idle_s, sleep_ms, wake_ms,
+                first_ttft_ms, warm_ttft_ms and (optional) memory_freed_mb
+            **extra: memory_awake_mb, cold_start_ms, cold_start_ttft_ms
+        """
+        cost = cls(model=model, **extra)
+        warm = [s["warm_ttft_ms"] for s in samples if s.get("warm_ttft_ms") is not None]
+        cost.warm_ttft_ms = statistics.fmean(warm) if warm else None
+
+        for level in sorted({s["level"] for s in samples}):
+            rows = [s for s in samples if s["level"] == level and s.get("wake_ms") is not None]
+            if not rows:
+                continue
+            base, per_idle = fit_line([r["idle_s"] for r in rows], [r["wake_ms"] for r in rows])
+            penalties = [
+                r["first_ttft_ms"] - r["warm_ttft_ms"]
+                for r in rows
+                if r.get("first_ttft_ms") is not None and r.get("warm_ttft_ms") is not None
+            ]
+            freed = [r["memory_freed_mb"] for r in rows if r.get("memory_freed_mb") is not None]
+            wakes = sorted(r["wake_ms"] for r in rows)
+            cost.levels[level] = LevelCosts(
+                level=level,
+                samples=len(rows),
+                sleep_ms=statistics.fmean(r["sleep_ms"] for r in rows),
+                wake_base_ms=base,
+                wake_ms_per_idle_s=per_idle,
+                first_ttft_penalty_ms=statistics.fmean(penalties) if penalties else 0.0,
+                memory_freed_mb=statistics.fmean(freed) if freed else None,
+                wake_p99_ms=wakes[max(0, round(0.99 * len(wakes)) - 1)],
+            )
+        return cost
+
+    def wake_ms(self, level: int, idle_s: float = 0.0) -> float:
+        """Predicted wake latency after sleeping `idle_s` seconds at `level`."""
+        costs = self.levels[level]
+        return max(costs.wake_base_ms + costs.wake_ms_per_idle_s * idle_s, 0.0)
+
+    def switch_cost_ms(self, level: int, idle_s: float = 0.0) -> float:
+        """Latency added to the first request after a wake (wake + slower first TTFT)."""
+        return self.wake_ms(level, idle_s) + max(self.levels[level].first_ttft_penalty_ms, 0.0)
+
+    def recommended_lead_s(self, level: int, idle_s: float = 0.0, margin: float = 1.5) -> float:
+        """Pre-wake lead time that covers the predicted switch cost with a safety margin."""
+        return self.switch_cost_ms(level, idle_s) * margin / 1000
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["levels"] = {str(level): asdict(c) for level, c in self.levels.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SleepCostModel":
+        levels = {int(k): LevelCosts(**v) for k, v in data.get("levels", {}).items()}
+        fields = {k: v for k, v in data.items() if k in cls.__dataclass_fields__}
+        return cls(**{**fields, "levels": levels})
+
+
+def load_cost_models(path: str) -> dict[str, SleepCostModel]:
+    """Read every model's costs from a JSON file written by save_cost_model()."""
+    with open(path) as f:
+        data = json.load(f)
+    return {name: SleepCostModel.from_dict(entry) for name, entry in data.get("models", {}).items()}
+
+
+def save_cost_model(path: str, cost: SleepCostModel, samples: list[dict] | None = None) -> None:
+    """Add or replace one model's entry in the JSON file at `path`."""
+    data = {"models": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            data = json.load(f)
+    entry = cost.to_dict()
+    if samples is not None:
+        entry["samples"] = samples
+    data.setdefault("models", {})[cost.model] = entry
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def wake_cost_per_mb(models: dict[str, SleepCostModel], level: int) -> tuple[float, float] | None:
+    """
+    Fit wake_ms = intercept + slope * memory_awake_mb across model sizes.
+
+    Lets a policy estimate wake cost for a model that has not been swept.
+    Returns None with fewer than two models measured at `level`.
+    """
+    points = [
+        (m.memory_awake_mb, m.wake_ms(level))
+        for m in models.values()
+        if level in m.levels and m.memory_awake_mb is not None
+    ]
+    if len({mb for mb, _ in points}) < 2:
+        return None
+    return fit_line([mb for mb, _ in points], [ms for _, ms in points])
+
+
+def print_cost_model(cost: SleepCostModel) -> None:
+    """Print a fitted cost model as a table."""
+    print(f"\nCost model: {cost.model}")
+    if cost.memory_awake_mb is not None:
+        print(f"  GPU memory awake: {cost.memory_awake_mb:.0f}MB")
+    if cost.cold_start_ms is not None:
+        print(f"  Cold start:       {cost.cold_start_ms:.0f}ms (container restart to healthy)")
+    if cost.cold_start_ttft_ms is not None:
+        print(f"  TTFT after cold:  {cost.cold_start_ttft_ms:.1f}ms")
+    if cost.warm_ttft_ms is not None:
+        print(f"  Warm TTFT:        {cost.warm_ttft_ms:.1f}ms")
+    print(
+        f"\n  {'Level':<6} {'Sleep':>9} {'Wake@0s':>9} {'per idle s':>10} "
+        f"{'TTFT pen':>9} {'Switch':>9} {'Freed':>8}"
+    )
+    for level, c in cost.levels.items():
+        freed = f"{c.memory_freed_mb:.0f}MB" if c.memory_freed_mb is not None else "-"
+        print(
+            f"  {level:<6} {c.sleep_ms:>7.0f}ms {c.wake_base_ms:>7.0f}ms {c.wake_ms_per_idle_s:>8.2f}ms "
+            f"{c.first_ttft_penalty_ms:>7.1f}ms {cost.switch_cost_ms(level):>7.0f}ms {freed:>8}"
+        )
+    if cost.cold_start_ms is not None:
+        for level in cost.levels:
+            speedup = cost.cold_start_ms / max(cost.switch_cost_ms(level), 1e-3)
+            print(f"  Level {level} switch is {speedup:.0f}x faster than a cold start")
@@ -5,11 +5,14 @@ This script shows how to:
 1. Put a model to sleep (free GPU memory)
 2. Wake a model (restore to GPU)
 3. Monitor memory changes during sleep/wake cycles
+4. Coordinate sleep/wake across concurrent callers (ResidencyController)
 """
 
 import argparse
 import sys
+import threading
 import time
+from contextlib import contextmanager
 
 import requests
 
@@ -84,6 +87,204 @@ class SleepModeRouter:
         return self.client.complete(prompt, max_tokens=max_tokens)
 
 
+class ResidencyController:
+    """
+    Thread-safe sleep/wake coordination for one SleepModeRouter.
+
+    - Concurrent callers that find the model asleep share one /wake_up call
+      and all resume when it finishes (single-flight)
+    - sleep() stops admitting new requests and waits for in-flight ones to
+      drain (up to a timeout) before sending /sleep
+    - is_sleeping() is answered from a cached state. Sleeps and wakes sent
+      through the controller update the cache directly; the backend is only
+      polled when the cache is older than `state_ttl_s` (to notice changes
+      made by someone else)
+    """
+
+    def __init__(
+        self,
+        router: SleepModeRouter,
+        state_ttl_s: float = 5.0,
+        drain_timeout_s: float = 30.0,
+    ):
+        """
+        Args:
+            router: Router for the backend to control
+            state_ttl_s: Max age of the cached sleep state before re-polling
+            drain_timeout_s: Default time sleep() waits for in-flight requests
+        """
+        self.router = router
+        self.state_ttl_s = state_ttl_s
+        self.drain_timeout_s = drain_timeout_s
+        self._cond = threading.Condition()
+        self._sleeping: bool | None = None  # None = unknown, poll on next use
+        self._checked_at = 0.0
+        self._waking = False
+        self._wake_ok = False
+        self._draining = False
+        self._in_flight = 0
+        self._awake_since: float | None = None
+        self._awake_total = 0.0
+        self.last_wake_ms = 0.0
+        self.stats = {
+            "wakes_sent": 0,
+            "wakes_coalesced": 0,
+            "sleeps_sent": 0,
+            "drain_timeouts": 0,
+            "state_polls": 0,
+            "state_cache_hits": 0,
+        }
+
+    def _set_state(self, sleeping: bool) -> None:
+        """Record a known sleep state (caller holds the lock)."""
+        now = time.monotonic()
+        if sleeping and self._awake_since is not None:
+            self._awake_total += now - self._awake_since
+            self._awake_since = None
+        elif not sleeping and self._awake_since is None:
+            self._awake_since = now
+        self._sleeping = sleeping
+        self._checked_at = now
+
+    def invalidate(self) -> None:
+        """Forget the cached state so the next check polls the backend."""
+        with self._cond:
+            self._sleeping = None
+
+    def is_sleeping(self, refresh: bool = False) -> bool:
+        """Cached sleep state; polls /is_sleeping when stale or refresh=True."""
+        with self._cond:
+            fresh = time.monotonic() - self._checked_at < self.state_ttl_s
+            if self._sleeping is not None and fresh and not refresh:
+                self.stats["state_cache_hits"] += 1
+                return self._sleeping
+            if self._waking or self._draining:
+                # A transition is in progress and will set the state itself
+                return bool(self._sleeping)
+        sleeping = self.router.is_sleeping()
+        with self._cond:
+            self.stats["state_polls"] += 1
+            if not (self._waking or self._draining):
+                self._set_state(sleeping)
+            return bool(self._sleeping) if self._sleeping is not None else sleeping
+
+    def ensure_awake(self) -> float:
+        """
+        Block until the model is awake, waking it if needed.
+
+        Returns:
+            Milliseconds spent waiting on a drain or wake (0.0 if already awake).
+
+        Raises:
+            RuntimeError: If the wake failed.
+        """
+        if self._sleeping is None or time.monotonic() - self._checked_at >= self.state_ttl_s:
+            self.is_sleeping()
+        start = time.perf_counter()
+        with self._cond:
+            while self._draining:
+                self._cond.wait()
+            if self._waking:
+                self.stats["wakes_coalesced"] += 1
+                while self._waking:
+                    self._cond.wait()
+                if not self._wake_ok:
+                    raise RuntimeError(f"Wake of {self.router.base_url} failed")
+                return (time.perf_counter() - start) * 1000
+            if not self._sleeping:
+                waited = time.perf_counter() - start
+                return waited * 1000 if waited > 0.001 else 0.0
+            self._waking = True
+            self.stats["wakes_sent"] += 1
+
+        wake_start = time.perf_counter()
+        ok = self.router.wake()
+        with self._cond:
+            self.last_wake_ms = (time.perf_counter() - wake_start) * 1000
+            self._waking = False
+            self._wake_ok = ok
+            if ok:
+                self._set_state(False)
+            else:
+                self._sleeping = None
+            self._cond.notify_all()
+        if not ok:
+            raise RuntimeError(f"Wake of {self.router.base_url} failed")
+        return (time.perf_counter() - start) * 1000
+
+    @contextmanager
+    def request(self):
+        """
+        Hold the model awake for the duration of one request.
+
+        Yields the milliseconds the request waited for a wake.
+        """
+        while True:
+            waited_ms = self.ensure_awake()
+            with self._cond:
+                # A sleep may have slipped in between waking and admission
+                if not self._draining and self._sleeping is False:
+                    self._in_flight += 1
+                    break
+        try:
+            yield waited_ms
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def complete(self, prompt: str, max_tokens: int = 50) -> str:
+        """Generate a completion, waking the model first if needed."""
+        with self.request():
+            return self.router.complete(prompt, max_tokens=max_tokens)
+
+    def sleep(self, level: int = 1, drain_timeout_s: float | None = None) -> bool:
+        """
+        Drain in-flight requests, then put the model to sleep.
+
+        New requests wait while draining. If in-flight requests do not finish
+        within the timeout the sleep is abandoned and they keep running.
+
+        Returns:
+            True if the model was put to sleep (or already was asleep).
+        """
+        timeout = self.drain_timeout_s if drain_timeout_s is None else drain_timeout_s
+        with self._cond:
+            while self._waking or self._draining:
+                self._cond.wait()
+            if self._sleeping:
+                return True
+            self._draining = True
+            drained = self._cond.wait_for(lambda: self._in_flight == 0, timeout=timeout)
+            if not drained:
+                self.stats["drain_timeouts"] += 1
+                self._draining = False
+                self._cond.notify_all()
+                return False
+            self.stats["sleeps_sent"] += 1
+
+        ok = self.router.sleep(level=level)
+        with self._cond:
+            self._draining = False
+            if ok:
+                self._set_state(True)
+            else:
+                self._sleeping = None
+            self._cond.notify_all()
+        return ok
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def awake_seconds(self) -> float:
+        """Total time the model was known to be awake (holding GPU memory)."""
+        with self._cond:
+            current = time.monotonic() - self._awake_since if self._awake_since is not None else 0.0
+            return self._awake_total + current
+
+
 def demo_sleep_wake_cycle(router: SleepModeRouter):
     """Demonstrate a full sleep/wake cycle with memory monitoring."""
 
@@ -0,0 +1,329 @@
+"""
+Sleep Scheduler - Predictive pre-wake and idle sleep for SleepModeRouter.
+
+Waking a model costs hundreds of milliseconds to seconds, and without a
+scheduler that cost always lands on the first request after a switch.
+The scheduler:
+1. Learns each model's arrival pattern from its request history
+2. Wakes a model shortly before its next burst of traffic is expected
+3. Puts a model to sleep after a configurable idle window
+4. Reports how much wake latency was hidden (pre-woken) vs exposed
+   (paid by a waiting request), and how long each model held GPU memory
+
+Arrival prediction works on "sessions": requests closer together than
+`session_gap_s` belong to one burst. The gap between session starts is
+tracked with exponentially weighted mean and deviation (the same estimator
+TCP uses for retransmit timeouts), giving a predicted next-session window.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+
+from cost_model import SleepCostModel, load_cost_models
+from router import ResidencyController, SleepModeRouter
+
+
+class ArrivalModel:
+    """Predicts when the next burst of requests for one model will start."""
+
+    def __init__(self, session_gap_s: float = 2.0, alpha: float = 0.125, beta: float = 0.25):
+        self.session_gap_s = session_gap_s
+        self.alpha = alpha
+        self.beta = beta
+        self.last_arrival: float | None = None
+        self.last_session_start: float | None = None
+        self.mean_gap: float | None = None
+        self.dev_gap = 0.0
+        self.sessions = 0
+
+    def observe(self, t: float) -> bool:
+        """Record a request at time t. Returns True if it started a new session."""
+        new_session = self.last_arrival is None or t - self.last_arrival > self.session_gap_s
+        self.last_arrival = t
+        if not new_session:
+            return False
+        if self.last_session_start is not None:
+            gap = t - self.last_session_start
+            if self.mean_gap is None:
+                self.mean_gap, self.dev_gap = gap, gap / 2
+            else:
+                self.dev_gap = (1 - self.beta) * self.dev_gap + self.beta * abs(gap - self.mean_gap)
+                self.mean_gap = (1 - self.alpha) * self.mean_gap + self.alpha * gap
+        self.last_session_start = t
+        self.sessions += 1
+        return True
+
+    def predicted_window(self) -> tuple[float, float] | None:
+        """(earliest, latest) expected start of the next session, or None if unknown."""
+        if self.mean_gap is None or self.last_session_start is None:
+            return None
+        expected = self.last_session_start + self.mean_gap
+        spread = 2 * self.dev_gap
+        return expected - spread, expected + spread
+
+
+@dataclass
+class ModelSchedule:
+    """Scheduler state and accounting for one model."""
+
+    name: str
+    residency: ResidencyController
+    memory_mb: float = 0.0
+    wake_lead_s: float | None = None  # Overrides the scheduler default
+    arrivals: ArrivalModel = field(default_factory=ArrivalModel)
+    prewoken: bool = False  # Woken by the scheduler and not used yet
+    prewake_ms: float = 0.0
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    stats: dict = field(
+        default_factory=lambda: {
+            "requests": 0,
+            "wakes_on_demand": 0,
+            "prewakes": 0,
+            "prewakes_used": 0,
+            "prewakes_wasted": 0,
+            "idle_sleeps": 0,
+            "exposed_wake_ms": 0.0,
+            "hidden_wake_ms": 0.0,
+        }
+    )
+
+
+class SleepScheduler:
+    """Drives sleep/wake for several SleepModeRouters from their request history."""
+
+    def __init__(
+        self,
+        idle_window_s: float = 30.0,
+        sleep_level: int = 1,
+        wake_lead_s: float = 1.0,
+        tick_s: float = 0.1,
+        session_gap_s: float = 2.0,
+        drain_timeout_s: float = 5.0,
+    ):
+        """
+        Args:
+            idle_window_s: Sleep a model after this long without requests
+            sleep_level: Level used for idle sleeps (1 = offload, 2 = discard)
+            wake_lead_s: Start a pre-wake this long before predicted traffic
+                (should be at least the expected wake latency)
+            tick_s: How often the background thread re-evaluates models
+            session_gap_s: Requests closer than this count as one burst
+            drain_timeout_s: How long an idle sleep waits for in-flight requests
+        """
+        self.idle_window_s = idle_window_s
+        self.sleep_level = sleep_level
+        self.wake_lead_s = wake_lead_s
+        self.tick_s = tick_s
+        self.session_gap_s = session_gap_s
+        self.drain_timeout_s = drain_timeout_s
+        self.models: dict[str, ModelSchedule] = {}
+        self._started_at = time.monotonic()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def add_model(
+        self,
+        name: str,
+        router: SleepModeRouter,
+        memory_mb: float = 0.0,
+        cost: SleepCostModel | None = None,
+    ) -> None:
+        """
+        Register a model; its current sleep state is read from the server.
+
+        Args:
+            name: Model name used in complete()
+            router: Router for the model's server
+            memory_mb: GPU memory the model holds while awake (for reporting)
+            cost: Fitted sleep/wake costs; when given, the pre-wake lead time
+                comes from its predicted switch cost instead of wake_lead_s
+        """
+        wake_lead_s = None
+        if cost is not None and self.sleep_level in cost.levels:
+            wake_lead_s = cost.recommended_lead_s(self.sleep_level, idle_s=self.idle_window_s)
+            if not memory_mb and cost.memory_awake_mb:
+                memory_mb = cost.memory_awake_mb
+        residency = ResidencyController(router, drain_timeout_s=self.drain_timeout_s)
+        residency.is_sleeping(refresh=True)
+        self.models[name] = ModelSchedule(
+            name=name,
+            residency=residency,
+            memory_mb=memory_mb,
+            wake_lead_s=wake_lead_s,
+            arrivals=ArrivalModel(session_gap_s=self.session_gap_s),
+        )
+
+    def complete(self, name: str, prompt: str, max_tokens: int = 50) -> str:
+        """
+        Serve a request, waking the model first if needed.
+
+        Any time the request spends waiting for a wake counts as exposed
+        wake latency; the part of a pre-wake it did not wait for is hidden.
+        """
+        model = self.models[name]
+        with model.lock:
+            model.arrivals.observe(time.monotonic())
+            model.stats["requests"] += 1
+
+        with model.residency.request() as waited_ms:
+            with model.lock:
+                if model.prewoken:
+                    # Joined or followed a pre-wake: only the wait was exposed
+                    wake_ms = model.residency.last_wake_ms
+                    model.stats["prewakes_used"] += 1
+                    model.stats["exposed_wake_ms"] += waited_ms
+                    model.stats["hidden_wake_ms"] += max(wake_ms - waited_ms, 0.0)
+                    model.prewoken = False
+                elif waited_ms > 0:
+                    model.stats["wakes_on_demand"] += 1
+                    model.stats["exposed_wake_ms"] += waited_ms
+            return model.residency.router.complete(prompt, max_tokens=max_tokens)
+
+    def tick(self, now: float | None = None) -> None:
+        """Pre-wake models with imminent traffic and sleep idle ones."""
+        now = time.monotonic() if now is None else now
+        for model in self.models.values():
+            window = model.arrivals.predicted_window()
+            lead = self.wake_lead_s if model.wake_lead_s is None else model.wake_lead_s
+            traffic_soon = window is not None and window[0] - lead <= now <= window[1]
+            sleeping = model.residency.is_sleeping()
+
+            if sleeping and traffic_soon:
+                self._prewake(model)
+            elif not sleeping and not traffic_soon and model.residency.in_flight == 0:
+                last = model.arrivals.last_arrival
+                idle_since = last if last is not None else self._started_at
+                if now - idle_since >= self.idle_window_s:
+                    self._idle_sleep(model)
+
+    def _prewake(self, model: ModelSchedule) -> None:
+        with model.lock:
+            model.prewoken = True
+        try:
+            model.residency.ensure_awake()
+        except RuntimeError as e:
+            print(f"Pre-wake of {model.name} failed: {e}")
+            with model.lock:
+                model.prewoken = False
+            return
+        with model.lock:
+            model.stats["prewakes"] += 1
+
+    def _idle_sleep(self, model: ModelSchedule) -> None:
+        if model.residency.sleep(level=self.sleep_level):
+            with model.lock:
+                if model.prewoken:
+                    model.stats["prewakes_wasted"] += 1
+                    model.prewoken = False
+                model.stats["idle_sleeps"] += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.tick_s):
+            self.tick()
+
+    def start(self) -> "SleepScheduler":
+        """Start the background scheduling thread."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="sleep-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def report(self) -> dict:
+        """Per-model counters plus hidden/exposed wake latency and memory-seconds."""
+        now = time.monotonic()
+        report = {}
+        for model in self.models.values():
+            stats = dict(model.stats)
+            stats["awake_seconds"] = model.residency.awake_seconds
+            total_wake = stats["hidden_wake_ms"] + stats["exposed_wake_ms"]
+            stats["hidden_fraction"] = stats["hidden_wake_ms"] / total_wake if total_wake else None
+            stats["memory_mb_seconds"] = stats["awake_seconds"] * model.memory_mb
+            window = model.arrivals.predicted_window()
+            stats["wake_lead_s"] = self.wake_lead_s if model.wake_lead_s is None else model.wake_lead_s
+            stats["predicted_gap_s"] = model.arrivals.mean_gap
+            stats["next_window_in_s"] = (window[0] - now, window[1] - now) if window else None
+            report[model.name] = stats
+        return report
+
+
+def print_report(report: dict) -> None:
+    """Print the scheduler report as a table."""
+    print(
+        f"\n{'Model':<20} {'Reqs':>5} {'Demand':>6} {'Pre':>4} {'Used':>4} {'Waste':>5} "
+        f"{'Exposed':>9} {'Hidden':>9} {'Hidden%':>7} {'Awake s':>8}"
+    )
+    for name, s in report.items():
+        hidden_pct = f"{s['hidden_fraction'] * 100:.0f}%" if s["hidden_fraction"] is not None else "-"
+        print(
+            f"{name:<20} {s['requests']:>5} {s['wakes_on_demand']:>6} {s['prewakes']:>4} "
+            f"{s['prewakes_used']:>4} {s['prewakes_wasted']:>5} {s['exposed_wake_ms']:>7.0f}ms "
+            f"{s['hidden_wake_ms']:>7.0f}ms {hidden_pct:>7} {s['awake_seconds']:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay periodic traffic through the sleep scheduler")
+    parser.add_argument(
+        "--backend",
+        action="append",
+        default=[],
+        help="NAME=URL of a sleep-mode vLLM server (repeatable, default: one at localhost:8000)",
+    )
+    parser.add_argument("--period", type=float, default=10.0, help="Seconds between traffic bursts")
+    parser.add_argument("--burst", type=int, default=3, help="Requests per burst")
+    parser.add_argument("--bursts", type=int, default=8, help="Bursts to replay per model")
+    parser.add_argument("--idle-window", type=float, default=3.0, help="Idle seconds before sleeping")
+    parser.add_argument("--sleep-level", type=int, default=1, choices=[1, 2])
+    parser.add_argument("--wake-lead", type=float, default=1.0, help="Pre-wake lead time (s)")
+    parser.add_argument(
+        "--cost-model", help="Cost model JSON from benchmark.py --sweep; sets per-model lead times"
+    )
+    args = parser.parse_args()
+
+    backends = [spec.split("=", 1) for spec in args.backend] or [["default", "http://localhost:8000"]]
+    scheduler = SleepScheduler(
+        idle_window_s=args.idle_window, sleep_level=args.sleep_level, wake_lead_s=args.wake_lead
+    )
+    costs = load_cost_models(args.cost_model) if args.cost_model else {}
+    for name, url in backends:
+        router = SleepModeRouter(base_url=url)
+        if not router.health_check():
+            print(f"ERROR: {name} at {url} not healthy")
+            sys.exit(1)
+        # Match by backend name, then by served model; a single entry applies to all
+        cost = costs.get(name) or costs.get(router.client.model)
+        if cost is None and len(costs) == 1:
+            cost = next(iter(costs.values()))
+        scheduler.add_model(name, router, cost=cost)
+        lead = scheduler.models[name].wake_lead_s
+        if lead is not None:
+            print(f"{name}: pre-wake lead {lead:.2f}s from cost model")
+
+    scheduler.start()
+    print(f"Replaying {args.bursts} bursts of {args.burst} every {args.period}s per model...")
+    try:
+        start = time.monotonic()
+        for i in range(args.bursts):
+            for name in scheduler.models:
+                for _ in range(args.burst):
+                    scheduler.complete(name, "Hello, I am", max_tokens=5)
+            print(f"  burst {i + 1}/{args.bursts} done")
+            time.sleep(max(0.0, start + (i + 1) * args.period - time.monotonic()))
+    finally:
+        scheduler.stop()
+
+    print_report(scheduler.report())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""
+APC Simulator - Replay a prompt trace through a model of vLLM's prefix cache.
+
+The live benchmark needs a GPU and only compares "everything shared" with
+"nothing shared". This simulator predicts the prefix cache hit rate of any
+prompt trace offline, for a given KV cache size, so the cache can be sized
+(--gpu-memory-utilization) and prompt layouts compared before deploying.
+
+Model of vLLM's block manager:
+- Prompts are split into full blocks of `block_size` tokens, identified by
+  hashes chained through all previous blocks (shared/prefix_analyzer.py).
+- A request reuses the longest run of leading blocks already in the cache.
+  If the whole prompt is cached, the last block is recomputed anyway
+  (the final prompt token must run through the model to produce logits).
+- Missing blocks, the partial last block and the output tokens' blocks are
+  allocated from `num_gpu_blocks`. Up to `max_num_seqs` requests hold their
+  blocks at once; a request that does not fit waits for older ones to finish.
+- Finished requests' full blocks stay cached until evicted. "lru" evicts the
+  least recently released block first, deepest blocks of a prompt before its
+  prefix (like vLLM's free block queue); "fifo" evicts the oldest cached block.
+"""
+
+import argparse
+import heapq
+import json
+import sys
+from collections import deque
+from dataclasses import dataclass, field
+
+import numpy as np
+
+sys.path.insert(0, "../..")
+from shared.prefix_analyzer import block_hashes, load_corpus, pack_token_ids
+from shared.tokens import get_token_counter
+
+from template_builder import (
+    SYSTEM_PROMPT,
+    WorkloadSpec,
+    add_workload_args,
+    generate_high_reuse_prompts,
+    generate_no_reuse_prompts,
+    generate_workload,
+    workload_spec_from_args,
+)
+
+EVICTION_POLICIES = ("lru", "fifo")
+SCENARIOS = ("high-reuse", "no-reuse", "mixed", "tenants", "workload")
+
+
+def kv_bytes_per_token(num_layers: int, num_kv_heads: int, head_dim: int, dtype_bytes: int = 2) -> int:
+    """KV cache bytes per token: keys and values for every layer and KV head."""
+    return 2 * num_layers * num_kv_heads * head_dim * dtype_bytes
+
+
+def kv_cache_blocks(
+    gpu_memory_mb: float,
+    utilization: float,
+    weights_mb: float,
+    bytes_per_token: int,
+    block_size: int = 16,
+    overhead_mb: float = 0.0,
+) -> int:
+    """
+    GPU blocks vLLM would allocate for the KV cache.
+
+    Args:
+        gpu_memory_mb: Total GPU memory
+        utilization: --gpu-memory-utilization
+        weights_mb: Model weights in GPU memory
+        bytes_per_token: See kv_bytes_per_token()
+        block_size: Tokens per block
+        overhead_mb: Activations, CUDA graphs and other non-KV memory
+
+    Returns:
+        Number of KV blocks (vLLM logs this as "# GPU blocks")
+    """
+    budget_mb = gpu_memory_mb * utilization - weights_mb - overhead_mb
+    return max(int(budget_mb * 1024 * 1024) // (bytes_per_token * block_size), 0)
+
+
+@dataclass
+class SimWindow:
+    """Cache behavior over one window of consecutive requests."""
+
+    requests: int  # Requests replayed so far
+    hit_rate: float  # Cached prompt tokens / prompt tokens, this window
+    cumulative_hit_rate: float
+    tokens_saved: int  # Cumulative prefill tokens served from cache
+    cached_blocks: int  # Blocks holding reusable prefixes at window end
+    evictions: int  # Cumulative
+
+
+@dataclass
+class SimulationResult:
+    """Outcome of replaying one trace."""
+
+    scenario: str
+    block_size: int
+    num_gpu_blocks: int
+    eviction: str
+    max_num_seqs: int
+    requests: int = 0
+    prompt_tokens: int = 0
+    hit_tokens: int = 0
+    evictions: int = 0
+    rejected: int = 0  # Requests larger than the whole cache
+    windows: list[SimWindow] = field(default_factory=list)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hit_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "scenario": self.scenario,
+            "block_size": self.block_size,
+            "num_gpu_blocks": self.num_gpu_blocks,
+            "eviction": self.eviction,
+            "max_num_seqs": self.max_num_seqs,
+            "requests": self.requests,
+            "prompt_tokens": self.prompt_tokens,
+            "hit_tokens": self.hit_tokens,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "rejected": self.rejected,
+            "windows": [vars(w) for w in self.windows],
+        }
+
+
+class PrefixCacheSimulator:
+    """Block-hashed prefix cache with a fixed number of GPU blocks."""
+
+    def __init__(
+        self,
+        num_gpu_blocks: int,
+        block_size: int = 16,
+        eviction: str = "lru",
+        max_num_seqs: int = 16,
+    ):
+        if eviction not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy {eviction}; use one of {EVICTION_POLICIES}")
+        self.num_gpu_blocks = num_gpu_blocks
+        self.block_size = block_size
+        self.eviction = eviction
+        self.max_num_seqs = max_num_seqs
+        self.evictions = 0
+        self._refs: dict[int, int] = {}  # Cached blocks in use -> number of requests using them
+        self._free: dict[int, int] = {}  # Cached blocks not in use -> eviction key
+        self._heap: list[tuple[int, int]] = []  # (eviction key, hash); stale entries skipped
+        self._born: dict[int, int] = {}  # Cached block -> tick it was computed (fifo)
+        self._private = 0  # Blocks in use that can't be shared (partial, duplicate, output)
+        self._running: deque[tuple[list[int], int]] = deque()
+        self._tick = 0
+
+    @property
+    def cached_blocks(self) -> int:
+        """Blocks currently holding a reusable prefix (in use or evictable)."""
+        return len(self._refs) + len(self._free)
+
+    def _blank_blocks(self) -> int:
+        return self.num_gpu_blocks - len(self._refs) - len(self._free) - self._private
+
+    def _evict_one(self) -> None:
+        while True:
+            key, h = heapq.heappop(self._heap)
+            if self._free.get(h) == key:
+                break
+        del self._free[h]
+        self._born.pop(h, None)
+        self.evictions += 1
+
+    def _release(self, pinned: list[int], private: int) -> None:
+        # Deepest blocks first, so they get the oldest keys and are evicted
+        # before the prefix they extend
+        for h in reversed(pinned):
+            self._refs[h] -= 1
+            if self._refs[h]:
+                continue
+            del self._refs[h]
+            self._tick += 1
+            key = self._tick if self.eviction == "lru" else self._born[h]
+            self._free[h] = key
+            heapq.heappush(self._heap, (key, h))
+        self._private -= private
+        if len(self._heap) > 4 * len(self._free) + 1024:
+            self._heap = [(k, h) for h, k in self._free.items()]
+            heapq.heapify(self._heap)
+
+    def _finish_oldest(self) -> None:
+        self._release(*self._running.popleft())
+
+    def drain(self) -> None:
+        """Finish every running request."""
+        while self._running:
+            self._finish_oldest()
+
+    def submit(self, hashes: list[int], num_tokens: int, output_tokens: int = 0) -> int | None:
+        """
+        Schedule one request.
+
+        Args:
+            hashes: Chained hashes of the prompt's full blocks
+            num_tokens: Prompt length in tokens
+            output_tokens: Tokens generated (their blocks occupy the cache too)
+
+        Returns:
+            Prompt tokens served from the cache, or None if the request needs
+            more blocks than the whole cache
+        """
+        B = self.block_size
+        hits = 0
+        for h in hashes:
+            if h not in self._refs and h not in self._free:
+                break
+            hits += 1
+        if hits and hits * B >= num_tokens:
+            hits -= 1  # The last prompt token is always recomputed
+
+        tail_blocks = -(-(num_tokens + output_tokens) // B) - len(hashes)
+        needed = len(hashes) - hits + tail_blocks
+        if needed + hits > self.num_gpu_blocks:
+            return None
+        # Wait for running requests until the misses fit next to the pinned hits
+        while self._running:
+            pinned_free = sum(1 for h in hashes[:hits] if h in self._free)
+            if needed <= self._blank_blocks() + len(self._free) - pinned_free:
+                break
+            self._finish_oldest()
+
+        pinned = list(hashes[:hits])
+        for h in pinned:
+            if h in self._free:
+                del self._free[h]
+            self._refs[h] = self._refs.get(h, 0) + 1
+        while needed > self._blank_blocks():
+            self._evict_one()
+
+        private = tail_blocks
+        for h in hashes[hits:]:
+            if h in self._refs or h in self._free:
+                private += 1  # Recomputed duplicate of a cached block
+                continue
+            self._tick += 1
+            self._refs[h] = 1
+            self._born[h] = self._tick
+            pinned.append(h)
+        self._private += private
+        self._running.append((pinned, private))
+        if len(self._running) > self.max_num_seqs:
+            self._finish_oldest()
+        return hits * B
+
+
+def simulate(
+    lengths: np.ndarray,
+    flat: np.ndarray,
+    num_gpu_blocks: int,
+    block_size: int = 16,
+    eviction: str = "lru",
+    max_num_seqs: int = 16,
+    output_tokens: int = 0,
+    window: int | None = None,
+    scenario: str = "trace",
+) -> SimulationResult:
+    """
+    Replay a packed trace (see pack_token_ids()) through a PrefixCacheSimulator.
+
+    Args:
+        lengths, flat: Prompt token IDs in arrival order
+        num_gpu_blocks: KV cache capacity in blocks
+        block_size: Tokens per block
+        eviction: "lru" or "fifo"
+        max_num_seqs: Requests holding blocks at once
+        output_tokens: Tokens generated per request
+        window: Requests per time-series window (default: a tenth of the trace)
+        scenario: Label stored in the result
+
+    Returns:
+        SimulationResult with totals and per-window hit rates
+    """
+    sim = PrefixCacheSimulator(num_gpu_blocks, block_size, eviction, max_num_seqs)
+    result = SimulationResult(scenario, block_size, num_gpu_blocks, eviction, max_num_seqs)
+    hashes, offsets = block_hashes(lengths, flat, block_size)
+    hashes = hashes.tolist()
+    window = window or max(len(lengths) // 10, 1)
+    window_tokens = window_hits = 0
+
+    for i, num_tokens in enumerate(lengths.tolist()):
+        hit = sim.submit(hashes[offsets[i] : offsets[i + 1]], num_tokens, output_tokens)
+        if hit is None:
+            result.rejected += 1
+            hit = 0
+        result.requests += 1
+        result.prompt_tokens += num_tokens
+        result.hit_tokens += hit
+        window_tokens += num_tokens
+        window_hits += hit
+        if result.requests % window == 0 or i == len(lengths) - 1:
+            result.windows.append(
+                SimWindow(
+                    requests=result.requests,
+                    hit_rate=window_hits / window_tokens if window_tokens else 0.0,
+                    cumulative_hit_rate=result.hit_rate,
+                    tokens_saved=result.hit_tokens,
+                    cached_blocks=sim.cached_blocks,
+                    evictions=sim.evictions,
+                )
+            )
+            window_tokens = window_hits = 0
+    sim.drain()
+    result.evictions = sim.evictions
+    return result
+
+
+def build_scenario(
+    name: str,
+    count: int,
+    tenants: int = 8,
+    reuse_fraction: float = 0.5,
+    spec: WorkloadSpec | None = None,
+) -> list[str]:
+    """
+    Prompt trace for a built-in scenario.
+
+    - high-reuse: one system prompt, varying questions
+    - no-reuse: unique prompts
+    - mixed: high-reuse and no-reuse prompts interleaved (`reuse_fraction`
+      of them share the system prompt)
+    - tenants: `tenants` distinct system prompts, requests round-robin
+      across them; needs tenants x prefix blocks to stay warm
+    - workload: parametric stream from generate_workload(spec)
+    """
+    if name == "high-reuse":
+        return generate_high_reuse_prompts(count)
+    if name == "no-reuse":
+        return generate_no_reuse_prompts(count)
+    if name == "mixed":
+        shared = generate_high_reuse_prompts(count)
+        unique = generate_no_reuse_prompts(count)
+        period = max(round(1 / reuse_fraction), 1) if reuse_fraction > 0 else None
+        return [shared[i] if period and i % period == 0 else unique[i] for i in range(count)]
+    if name == "tenants":
+        per_tenant = [
+            generate_high_reuse_prompts(-(-count // tenants), prefix=f"Tenant {t}.\n{SYSTEM_PROMPT}")
+            for t in range(tenants)
+        ]
+        return [per_tenant[i % tenants][i // tenants] for i in range(count)]
+    if name == "workload":
+        return list(generate_workload(spec or WorkloadSpec(), count))
+    raise ValueError(f"Unknown scenario {name}; use one of {SCENARIOS}")
+
+
+def print_simulation(result: SimulationResult) -> None:
+    """Print one simulation's totals and time series."""
+    print(
+        f"\n{result.scenario}: {result.num_gpu_blocks:,} blocks x {result.block_size} tokens, "
+        f"{result.eviction}, max {result.max_num_seqs} seqs"
+    )
+    print(
+        f"  Hit rate: {result.hit_rate:.1%} ({result.hit_tokens:,} of {result.prompt_tokens:,} "
+        f"prompt tokens), {result.evictions:,} evictions"
+    )
+    if result.rejected:
+        print(f"  {result.rejected} requests larger than the whole cache (counted as misses)")
+    print(f"\n  {'Requests':>9} {'Window hit':>11} {'Cumulative':>11} {'Saved tok':>11} {'Cached':>8} {'Evicted':>8}")
+    for w in result.windows:
+        print(
+            f"  {w.requests:>9,} {w.hit_rate:>10.1%} {w.cumulative_hit_rate:>10.1%} "
+            f"{w.tokens_saved:>11,} {w.cached_blocks:>8,} {w.evictions:>8,}"
+        )
+
+
+def print_summary(results: list[SimulationResult]) -> None:
+    """Print one row per simulation."""
+    print("\n" + "=" * 70)
+    print("SUMMARY")
+    print("=" * 70)
+    print(f"  {'Scenario':<14} {'Blocks':>8} {'Evict':>6} {'Hit rate':>9} {'Saved tok':>12} {'Evictions':>10}")
+    for r in results:
+        print(
+            f"  {r.scenario:<14} {r.num_gpu_blocks:>8,} {r.eviction:>6} {r.hit_rate:>8.1%} "
+            f"{r.hit_tokens:>12,} {r.evictions:>10,}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline APC hit-rate simulator")
+    parser.add_argument(
+        "--scenario", nargs="+", choices=SCENARIOS, default=list(SCENARIOS), help="Built-in traces to replay"
+    )
+    parser.add_argument("--trace", help="JSONL prompt trace to replay instead of the built-in scenarios")
+    parser.add_argument("--field", default="prompt", help="JSON field holding the prompt text")
+    parser.add_argument("--prompts", type=int, default=1000, help="Requests per built-in scenario")
+    parser.add_argument("--tenants", type=int, default=8, help="System prompts in the tenants scenario")
+    parser.add_argument("--reuse-fraction", type=float, default=0.5, help="Shared prompts in the mixed scenario")
+    parser.add_argument("--block-size", type=int, default=16, help="KV cache block size (tokens)")
+    parser.add_argument("--gpu-blocks", type=int, nargs="+", default=[1024], help="KV cache sizes to simulate")
+    parser.add_argument(
+        "--gpu-memory-utilization",
+        type=float,
+        nargs="+",
+        help="Derive cache sizes from utilization instead of --gpu-blocks",
+    )
+    parser.add_argument("--gpu-memory-mb", type=float, default=24576, help="Total GPU memory")
+    parser.add_argument("--weights-mb", type=float, default=1000, help="Model weights in GPU memory")
+    parser.add_argument("--overhead-mb", type=float, default=1000, help="Activations and other non-KV memory")
+    parser.add_argument(
+        "--kv-bytes-per-token",
+        type=int,
+        default=kv_bytes_per_token(num_layers=24, num_kv_heads=2, head_dim=64),
+        help="KV cache bytes per token (default: Qwen2.5-0.5B in fp16)",
+    )
+    parser.add_argument("--eviction", choices=EVICTION_POLICIES, default="lru", help="Eviction policy")
+    parser.add_argument("--max-num-seqs", type=int, default=16, help="Concurrent requests (vLLM --max-num-seqs)")
+    parser.add_argument("--output-tokens", type=int, default=20, help="Generated tokens per request")
+    parser.add_argument("--window", type=int, help="Requests per time-series row (default: trace/10)")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server for /tokenize")
+    parser.add_argument("--json", metavar="PATH", help="Also write all results as JSON")
+    add_workload_args(parser)
+    args = parser.parse_args()
+
+    if args.gpu_memory_utilization:
+        capacities = [
+            kv_cache_blocks(
+                args.gpu_memory_mb, u, args.weights_mb, args.kv_bytes_per_token, args.block_size, args.overhead_mb
+            )
+            for u in args.gpu_memory_utilization
+        ]
+        for u, blocks in zip(args.gpu_memory_utilization, capacities):
+            print(f"--gpu-memory-utilization={u}: {blocks:,} blocks ({blocks * args.block_size:,} tokens)")
+    else:
+        capacities = args.gpu_blocks
+
+    counter = get_token_counter(base_url=args.url, block_size=args.block_size)
+    if args.trace:
+        traces = {args.trace: load_corpus(args.trace, args.field)}
+    else:
+        traces = {
+            name: build_scenario(name, args.prompts, args.tenants, args.reuse_fraction, workload_spec_from_args(args))
+            for name in args.scenario
+        }
+
+    print("=" * 70)
+    print("APC SIMULATOR")
+    print("=" * 70)
+    print(f"Tokenizer: {counter.backend}{'' if counter.exact else ' (approximate)'}")
+
+    results = []
+    for name, prompts in traces.items():
+        lengths, flat = pack_token_ids(counter.encode_batch(prompts))
+        for blocks in capacities:
+            result = simulate(
+                lengths,
+                flat,
+                blocks,
+                args.block_size,
+                args.eviction,
+                args.max_num_seqs,
+                args.output_tokens,
+                args.window,
+                scenario=name,
+            )
+            print_simulation(result)
+            results.append(result)
+    print_summary(results)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump([r.to_dict() for r in results], f, indent=2)
+        print(f"\nResults written to {args.json}")
+
+
+if __name__ == "__main__":
+    main()
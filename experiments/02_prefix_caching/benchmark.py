@@ -4,17 +4,44 @@ Prefix Caching Benchmark - Measures APC effectiveness.
 Compares TTFT for:
 1. High prefix reuse (same system prompt, different questions)
 2. No prefix reuse (unique prompts)
+
+With --concurrency and/or --duration, instead measures throughput: both
+scenarios run with N requests in flight at each concurrency level,
+reporting output tokens/s, requests/s, TTFT percentiles and the server's
+prefix cache hit rate.
+
+With --reorder, instead compares a parametric workload dispatched in
+arrival order against the cache-aware prefix scheduler.
 """
 
 import argparse
-import statistics
+import asyncio
+import itertools
 import sys
 import time
+from typing import Iterator
 
-sys.path.insert(0, "../..")
-from shared import VLLMClient, get_vllm_metrics, timer
+import requests
 
-from template_builder import generate_high_reuse_prompts, generate_no_reuse_prompts, get_prefix_length
+sys.path.insert(0, "../..")
+from shared import AsyncVLLMClient, StreamTimeline, VLLMClient, timer
+from shared.metrics import MetricsSampler, print_phase_report
+from shared.histogram import LatencyHistogram, histogram_of, print_latency_summary
+from shared.prefix_analyzer import pack_token_ids
+from shared.results import record_run
+from shared.tokens import get_token_counter, print_prefix_report
+
+from apc_simulator import simulate
+from prefix_scheduler import Dispatch, PrefixAwareScheduler, dispatch
+from template_builder import (
+    WorkloadSpec,
+    add_workload_args,
+    generate_high_reuse_prompts,
+    generate_no_reuse_prompts,
+    generate_workload,
+    get_prefix_tokens,
+    workload_spec_from_args,
+)
 
 
 def measure_ttft_batch(
@@ -32,26 +59,35 @@ def measure_ttft_batch(
         if show_progress:
             print(f"  [{i+1}/{total}]", end=" ", flush=True)
 
-        start = time.perf_counter()
-        ttft_recorded = False
-
         # Use streaming to measure time to first token
-        stream = client.complete_stream(prompt, max_tokens=max_tokens)
-        for _token in stream:
-            if not ttft_recorded:
-                ttft = time.perf_counter() - start
-                ttfts.append(ttft)
-                ttft_recorded = True
+        timeline = StreamTimeline()
+        for _token in client.complete_stream(prompt, max_tokens=max_tokens, timeline=timeline):
+            pass
 
-                if show_progress:
-                    print(f"{ttft*1000:.0f}ms", flush=True)
-            # Continue consuming the stream until done
+        if timeline.ttft_ms is not None:
+            ttfts.append(timeline.ttft_ms / 1000)
+            if show_progress:
+                tpot = f", TPOT {timeline.tpot_ms:.1f}ms" if timeline.tpot_ms is not None else ""
+                print(f"{timeline.ttft_ms:.0f}ms{tpot}", flush=True)
 
     return ttfts
 
 
-def run_benchmark(client: VLLMClient, num_prompts: int = 10, max_tokens: int = 20):
-    """Run the prefix caching benchmark."""
+def run_benchmark(
+    client: VLLMClient,
+    num_prompts: int = 10,
+    max_tokens: int = 20,
+    sample_interval: float = 0.5,
+    block_size: int = 16,
+):
+    """
+    Run the prefix caching benchmark.
+
+    Server metrics are sampled every `sample_interval` seconds and reported
+    per scenario, so warm-up and earlier runs don't leak into the numbers.
+    Prompt and shared-prefix sizes are counted with the served model's
+    tokenizer, in tokens and in KV blocks of `block_size`.
+    """
 
     print("=" * 70)
     print("Prefix Caching Benchmark")
@@ -61,27 +97,28 @@ def run_benchmark(client: VLLMClient, num_prompts: int = 10, max_tokens: int = 2
         print("ERROR: Server not healthy")
         return None
 
-    # Get initial metrics
-    initial_metrics = get_vllm_metrics(client.base_url)
-
     # Generate prompts
     print(f"\nGenerating {num_prompts} prompts for each scenario...")
     high_reuse_prompts = generate_high_reuse_prompts(num_prompts)
     no_reuse_prompts = generate_no_reuse_prompts(num_prompts)
 
-    prefix_len = get_prefix_length(high_reuse_prompts)
-    print(f"High-reuse common prefix: {prefix_len} chars")
-    print(f"No-reuse common prefix: {get_prefix_length(no_reuse_prompts)} chars")
+    counter = get_token_counter(client.model, client.base_url, block_size=block_size)
+    high_prefix = get_prefix_tokens(high_reuse_prompts, counter)
+    no_prefix = get_prefix_tokens(no_reuse_prompts, counter)
+    print_prefix_report("High-reuse prompts", high_prefix)
+    print_prefix_report("No-reuse prompts", no_prefix)
 
     # Warm up
     print("\nWarming up...")
     client.complete("Hello", max_tokens=5)
 
+    sampler = MetricsSampler(client.base_url, interval=sample_interval).start()
+
     # Benchmark high reuse scenario
     print(f"\n--- High Prefix Reuse ({num_prompts} requests) ---")
     print("Sending requests with shared system prompt...")
 
-    with timer() as t_high:
+    with sampler.phase("high_reuse"), timer() as t_high:
         high_reuse_ttfts = measure_ttft_batch(client, high_reuse_prompts, max_tokens)
 
     print(f"Total time: {t_high.elapsed_ms:.0f}ms")
@@ -93,72 +130,403 @@ def run_benchmark(client: VLLMClient, num_prompts: int = 10, max_tokens: int = 2
     print(f"\n--- No Prefix Reuse ({num_prompts} requests) ---")
     print("Sending requests with unique prefixes...")
 
-    with timer() as t_no:
+    with sampler.phase("no_reuse"), timer() as t_no:
         no_reuse_ttfts = measure_ttft_batch(client, no_reuse_prompts, max_tokens)
 
     print(f"Total time: {t_no.elapsed_ms:.0f}ms")
 
-    # Get final metrics from vLLM
-    final_metrics = get_vllm_metrics(client.base_url)
+    sampler.stop()
 
     # Calculate statistics
+    high_hist = histogram_of(ttft * 1000 for ttft in high_reuse_ttfts)
+    no_hist = histogram_of(ttft * 1000 for ttft in no_reuse_ttfts)
+
     print("\n" + "=" * 70)
     print("Results")
     print("=" * 70)
 
-    if high_reuse_ttfts:
-        print("\nHigh Prefix Reuse TTFT:")
-        print(f"  Min:  {min(high_reuse_ttfts) * 1000:.1f}ms")
-        print(f"  Max:  {max(high_reuse_ttfts) * 1000:.1f}ms")
-        print(f"  Mean: {statistics.mean(high_reuse_ttfts) * 1000:.1f}ms")
-        if len(high_reuse_ttfts) > 1:
-            print(f"  Stdev: {statistics.stdev(high_reuse_ttfts) * 1000:.1f}ms")
-
-    if no_reuse_ttfts:
-        print("\nNo Prefix Reuse TTFT:")
-        print(f"  Min:  {min(no_reuse_ttfts) * 1000:.1f}ms")
-        print(f"  Max:  {max(no_reuse_ttfts) * 1000:.1f}ms")
-        print(f"  Mean: {statistics.mean(no_reuse_ttfts) * 1000:.1f}ms")
-        if len(no_reuse_ttfts) > 1:
-            print(f"  Stdev: {statistics.stdev(no_reuse_ttfts) * 1000:.1f}ms")
+    if high_hist.count:
+        print_latency_summary("High Prefix Reuse TTFT", high_hist)
+
+    if no_hist.count:
+        print_latency_summary("No Prefix Reuse TTFT", no_hist)
 
     # Comparison
-    if high_reuse_ttfts and no_reuse_ttfts:
-        high_mean = statistics.mean(high_reuse_ttfts) * 1000
-        no_mean = statistics.mean(no_reuse_ttfts) * 1000
+    if high_hist.count and no_hist.count:
+        high_mean = high_hist.mean
+        no_mean = no_hist.mean
         diff = no_mean - high_mean
         pct = (diff / no_mean) * 100 if no_mean > 0 else 0
 
         print("\nComparison:")
-        print(f"  High reuse mean: {high_mean:.1f}ms")
-        print(f"  No reuse mean:   {no_mean:.1f}ms")
+        print(f"  High reuse mean: {high_mean:.1f}ms (p99 {high_hist.percentile(99):.1f}ms)")
+        print(f"  No reuse mean:   {no_mean:.1f}ms (p99 {no_hist.percentile(99):.1f}ms)")
         print(f"  Difference:      {diff:.1f}ms ({pct:.1f}% faster with reuse)")
 
-    # vLLM server metrics
-    if final_metrics:
-        print("\nvLLM Server Metrics (cumulative):")
-        if "ttft_avg_ms" in final_metrics:
-            print(f"  Avg TTFT: {final_metrics['ttft_avg_ms']:.1f}ms")
-        if "e2e_latency_avg_ms" in final_metrics:
-            print(f"  Avg E2E:  {final_metrics['e2e_latency_avg_ms']:.1f}ms")
+    # vLLM server metrics, from bucket deltas of each phase
+    high_server = sampler.phase_report("high_reuse")
+    no_server = sampler.phase_report("no_reuse")
+    print_phase_report("High Prefix Reuse", high_server)
+    print_phase_report("No Prefix Reuse", no_server)
 
     print("\n" + "=" * 70)
 
     return {
-        "high_reuse_ttft_ms": statistics.mean(high_reuse_ttfts) * 1000 if high_reuse_ttfts else None,
-        "no_reuse_ttft_ms": statistics.mean(no_reuse_ttfts) * 1000 if no_reuse_ttfts else None,
+        "high_reuse_ttft_ms": high_hist.mean,
+        "high_reuse_ttft_p99_ms": high_hist.percentile(99),
+        "no_reuse_ttft_ms": no_hist.mean,
+        "no_reuse_ttft_p99_ms": no_hist.percentile(99),
+        "high_reuse_server": high_server,
+        "no_reuse_server": no_server,
+        "high_reuse_prefix": high_prefix,
+        "no_reuse_prefix": no_prefix,
+        "samples": {
+            "high_reuse_ttft_ms": [ttft * 1000 for ttft in high_reuse_ttfts],
+            "no_reuse_ttft_ms": [ttft * 1000 for ttft in no_reuse_ttfts],
+        },
     }
 
 
+def prompt_stream(scenario: str, batch: int = 100) -> Iterator[str]:
+    """
+    Endless prompts for a throughput scenario.
+
+    High-reuse prompts cycle through one batch (they all share the system
+    prompt anyway); no-reuse prompts are generated fresh, batch by batch,
+    so a long run never repeats a prompt.
+    """
+    if scenario == "high_reuse":
+        yield from itertools.cycle(generate_high_reuse_prompts(batch))
+    while True:
+        yield from generate_no_reuse_prompts(batch)
+
+
+async def run_closed_loop(
+    client: AsyncVLLMClient,
+    prompts: Iterator[str],
+    concurrency: int,
+    max_tokens: int = 20,
+    num_requests: int | None = None,
+    duration_s: float | None = None,
+) -> dict:
+    """
+    Keep `concurrency` streaming requests in flight.
+
+    Each worker sends its next request as soon as the previous one
+    finishes, until `num_requests` have been sent or `duration_s` has
+    elapsed (requests in flight at the deadline still complete).
+
+    Returns a dict with 'requests', 'errors', 'output_tokens', 'elapsed_s',
+    'ttft' (a LatencyHistogram in ms) and 'ttft_ms' (the raw values).
+    """
+    ttft = LatencyHistogram()
+    ttft_ms = []
+    totals = {"requests": 0, "errors": 0, "output_tokens": 0}
+    sent = itertools.count()
+    start = time.perf_counter()
+
+    def more() -> bool:
+        if duration_s is not None and time.perf_counter() - start >= duration_s:
+            return False
+        return num_requests is None or next(sent) < num_requests
+
+    async def worker():
+        while more():
+            timeline = StreamTimeline()
+            try:
+                async for _token in client.complete_stream(
+                    next(prompts), max_tokens=max_tokens, timeline=timeline
+                ):
+                    pass
+            except Exception as e:
+                totals["errors"] += 1
+                print(f"  request failed: {type(e).__name__}: {e}")
+                continue
+            totals["requests"] += 1
+            totals["output_tokens"] += len(timeline.stamps)
+            if timeline.ttft_ms is not None:
+                ttft.record(timeline.ttft_ms)
+                ttft_ms.append(timeline.ttft_ms)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return {**totals, "elapsed_s": time.perf_counter() - start, "ttft": ttft, "ttft_ms": ttft_ms}
+
+
+async def run_throughput_benchmark(
+    url: str,
+    levels: list[int],
+    num_prompts: int = 10,
+    duration_s: float | None = None,
+    max_tokens: int = 20,
+    sample_interval: float = 0.5,
+):
+    """
+    Measure throughput of both scenarios at each concurrency level.
+
+    Each (scenario, level) run starts from an empty prefix cache and sends
+    `num_prompts` requests, or keeps sending for `duration_s` seconds.
+    Output tokens/s comes from the server's generation token counter when
+    available (streamed chunks otherwise); the prefix cache hit rate from
+    vllm:prefix_cache_hits / vllm:prefix_cache_queries over the run.
+    """
+    print("=" * 70)
+    print("Prefix Caching Benchmark - Throughput")
+    print("=" * 70)
+
+    async with AsyncVLLMClient(base_url=url) as client:
+        if not await client.health_check():
+            print("ERROR: Server not healthy")
+            return None
+
+        print("\nWarming up...")
+        await client.complete("Hello", max_tokens=5)
+
+        mode = f"{duration_s:g}s per level" if duration_s else f"{num_prompts} requests per level"
+        print(f"Concurrency levels: {levels} ({mode})")
+
+        sampler = MetricsSampler(url, interval=sample_interval).start()
+        results = []
+        try:
+            for scenario in ("high_reuse", "no_reuse"):
+                prompts = prompt_stream(scenario, max(num_prompts, 100))
+                for level in levels:
+                    phase = f"{scenario}@{level}"
+                    print(f"\n--- {phase} ---")
+                    # Start every run cold, or later levels hit prefixes cached by earlier ones
+                    if not await asyncio.to_thread(reset_prefix_cache, url):
+                        print("  (could not reset the prefix cache; runs may share cached prefixes)")
+                    async with sampler.async_phase(phase):
+                        run = await run_closed_loop(
+                            client,
+                            prompts,
+                            level,
+                            max_tokens,
+                            num_requests=None if duration_s else num_prompts,
+                            duration_s=duration_s,
+                        )
+                    server = sampler.phase_report(phase)
+                    output_tokens = server.get("generation_tokens") or run["output_tokens"]
+                    hist = run["ttft"]
+                    result = {
+                        "scenario": scenario,
+                        "concurrency": level,
+                        "requests": run["requests"],
+                        "errors": run["errors"],
+                        "elapsed_s": run["elapsed_s"],
+                        "requests_per_s": run["requests"] / run["elapsed_s"],
+                        "output_tokens_per_s": output_tokens / run["elapsed_s"],
+                        "ttft_p50_ms": hist.percentile(50),
+                        "ttft_p90_ms": hist.percentile(90),
+                        "ttft_p99_ms": hist.percentile(99),
+                        "prefix_cache_hit_rate": server.get("prefix_cache_hit_rate"),
+                        "server": server,
+                        "samples": {"ttft_ms": run["ttft_ms"]},
+                    }
+                    results.append(result)
+                    print(
+                        f"  {run['requests']} requests in {run['elapsed_s']:.1f}s: "
+                        f"{result['requests_per_s']:.1f} req/s, {result['output_tokens_per_s']:.0f} output tok/s"
+                    )
+        finally:
+            sampler.stop()
+
+    print("\n" + "=" * 70)
+    print("Results")
+    print("=" * 70)
+    print(
+        f"\n  {'Scenario':<11} {'Conc':>5} {'Req/s':>8} {'Out tok/s':>10} "
+        f"{'TTFT p50':>9} {'p90':>8} {'p99':>8} {'APC hit':>8}"
+    )
+    for r in results:
+        hit = f"{r['prefix_cache_hit_rate']:.1%}" if r["prefix_cache_hit_rate"] is not None else "-"
+        if r["ttft_p50_ms"] is None:
+            ttfts = f"{'-':>9} {'-':>8} {'-':>8}"
+        else:
+            ttfts = f"{r['ttft_p50_ms']:>7.1f}ms {r['ttft_p90_ms']:>6.1f}ms {r['ttft_p99_ms']:>6.1f}ms"
+        print(
+            f"  {r['scenario']:<11} {r['concurrency']:>5} {r['requests_per_s']:>8.1f} "
+            f"{r['output_tokens_per_s']:>10.0f} {ttfts} {hit:>8}"
+        )
+
+    print("\n" + "=" * 70)
+    return results
+
+
+def reset_prefix_cache(base_url: str) -> bool:
+    """Clear vLLM's prefix cache (POST /reset_prefix_cache) so runs start cold."""
+    try:
+        resp = requests.post(f"{base_url}/reset_prefix_cache", timeout=30)
+        return resp.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def run_reorder_comparison(
+    client: VLLMClient,
+    spec: WorkloadSpec,
+    num_prompts: int = 200,
+    max_tokens: int = 20,
+    concurrency: int = 8,
+    max_delay: int = 32,
+    gpu_blocks: int = 1024,
+    block_size: int = 16,
+    sample_interval: float = 0.5,
+):
+    """
+    Compare arrival-order dispatch with the cache-aware prefix scheduler.
+
+    Both runs send the same parametric workload with `concurrency` requests
+    in flight, starting from an empty prefix cache. Throughput and TTFT are
+    measured live; the prefix cache hit rate of each dispatch order is
+    predicted with the APC simulator for a cache of `gpu_blocks` blocks.
+    """
+    print("=" * 70)
+    print("Prefix Caching Benchmark - Cache-Aware Ordering")
+    print("=" * 70)
+
+    if not client.health_check():
+        print("ERROR: Server not healthy")
+        return None
+
+    prompts = list(generate_workload(spec, num_prompts))
+    counter = get_token_counter(client.model, client.base_url, block_size=block_size)
+    scheduler = PrefixAwareScheduler(counter, max_delay=max_delay)
+    orders = {
+        "arrival": [Dispatch(index=i, prompt=p) for i, p in enumerate(prompts)],
+        "cache_aware": list(scheduler.schedule(prompts)),
+    }
+    print(
+        f"\n{num_prompts} prompts, {spec.num_system_prompts} system prompts (zipf {spec.zipf_s}), "
+        f"{spec.turns} turn(s), concurrency {concurrency}"
+    )
+    print(
+        f"Scheduler: {scheduler.stats['groups']} groups, {scheduler.stats['warmups']} warm-ups, "
+        f"max delay {scheduler.stats['max_delay']} positions (bound {max_delay})"
+    )
+
+    print("\nWarming up...")
+    client.complete("Hello", max_tokens=5)
+
+    sampler = MetricsSampler(client.base_url, interval=sample_interval).start()
+    results = {}
+    for name, order in orders.items():
+        if not reset_prefix_cache(client.base_url):
+            print("  (could not reset the prefix cache; runs may share cached prefixes)")
+        tokens = counter.encode_batch([item.prompt for item in order])
+        lengths, flat = pack_token_ids(tokens)
+        predicted = simulate(
+            lengths, flat, gpu_blocks, block_size, max_num_seqs=concurrency, output_tokens=max_tokens
+        )
+
+        print(f"\n--- {name} ({len(order)} requests) ---")
+        with sampler.phase(name), timer() as t:
+            dispatched = dispatch(client, order, concurrency, max_tokens)
+        measured = [r for r in dispatched if not r.warm]
+        hist = histogram_of(r.ttft_ms for r in measured if r.ttft_ms is not None)
+        prompt_tokens = sum(len(ids) for ids, item in zip(tokens, order) if not item.warm)
+        results[name] = {
+            "elapsed_s": t.elapsed_ms / 1000,
+            "requests_per_s": len(measured) / (t.elapsed_ms / 1000),
+            "prompt_tokens_per_s": prompt_tokens / (t.elapsed_ms / 1000),
+            "ttft_ms": hist.mean,
+            "ttft_p99_ms": hist.percentile(99),
+            "predicted_hit_rate": predicted.hit_rate,
+            "max_delay": max((r.delay for r in measured), default=0),
+            "server": sampler.phase_report(name),
+            "samples": {"ttft_ms": [r.ttft_ms for r in measured if r.ttft_ms is not None]},
+        }
+        print(f"Total time: {t.elapsed_ms:.0f}ms")
+        print_latency_summary(f"TTFT ({name})", hist)
+    sampler.stop()
+
+    print("\n" + "=" * 70)
+    print("Results")
+    print("=" * 70)
+    print(f"\n  {'Order':<12} {'Req/s':>8} {'Prompt tok/s':>13} {'TTFT mean':>10} {'TTFT p99':>9} {'Hit rate*':>10}")
+    for name, r in results.items():
+        print(
+            f"  {name:<12} {r['requests_per_s']:>8.1f} {r['prompt_tokens_per_s']:>13.0f} "
+            f"{r['ttft_ms']:>8.1f}ms {r['ttft_p99_ms']:>7.1f}ms {r['predicted_hit_rate']:>9.1%}"
+        )
+    print(f"\n  * predicted by apc_simulator.py for {gpu_blocks} GPU blocks of {block_size} tokens")
+    for name, r in results.items():
+        print_phase_report(name, r["server"])
+
+    print("\n" + "=" * 70)
+    return results
+
+
 def main():
     parser = argparse.ArgumentParser(description="Prefix Caching Benchmark")
     parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
     parser.add_argument("--prompts", type=int, default=10, help="Number of prompts per scenario")
     parser.add_argument("--max-tokens", type=int, default=20, help="Max tokens per response")
+    parser.add_argument(
+        "--sample-interval", type=float, default=0.5, help="Server metrics polling interval (s)"
+    )
+    parser.add_argument("--block-size", type=int, default=16, help="KV cache block size (tokens)")
+    parser.add_argument(
+        "--reorder", action="store_true", help="Compare arrival order with the cache-aware scheduler"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        help="Throughput mode: concurrency levels to measure (--reorder uses the first; default 8)",
+    )
+    parser.add_argument(
+        "--duration", type=float, help="Throughput mode: seconds per level instead of --prompts requests"
+    )
+    parser.add_argument("--max-delay", type=int, default=32, help="Scheduler reordering bound (--reorder)")
+    parser.add_argument("--gpu-blocks", type=int, default=1024, help="KV cache size for hit-rate prediction")
+    parser.add_argument(
+        "--compose-file", default="docker-compose.yml", help="Compose file of the server (recorded with the run)"
+    )
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
+    add_workload_args(parser)
     args = parser.parse_args()
 
+    def save(mode: str, results) -> None:
+        if not args.no_save:
+            record_run("prefix_caching", mode, vars(args), results, args.url, args.compose_file)
+
     client = VLLMClient(base_url=args.url)
-    run_benchmark(client, num_prompts=args.prompts, max_tokens=args.max_tokens)
+    if args.reorder:
+        results = run_reorder_comparison(
+            client,
+            workload_spec_from_args(args),
+            num_prompts=args.prompts,
+            max_tokens=args.max_tokens,
+            concurrency=args.concurrency[0] if args.concurrency else 8,
+            max_delay=args.max_delay,
+            gpu_blocks=args.gpu_blocks,
+            block_size=args.block_size,
+            sample_interval=args.sample_interval,
+        )
+        save("reorder", results)
+        return
+    if args.concurrency or args.duration:
+        results = asyncio.run(
+            run_throughput_benchmark(
+                args.url,
+                args.concurrency or [1, 4, 16],
+                num_prompts=args.prompts,
+                duration_s=args.duration,
+                max_tokens=args.max_tokens,
+                sample_interval=args.sample_interval,
+            )
+        )
+        if results:
+            save("throughput", {f"{r['scenario']}@{r['concurrency']}": r for r in results})
+        return
+    results = run_benchmark(
+        client,
+        num_prompts=args.prompts,
+        max_tokens=args.max_tokens,
+        sample_interval=args.sample_interval,
+        block_size=args.block_size,
+    )
+    save("ttft", results)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+"""
+Prefix Scheduler - Cache-aware ordering of queued prompts.
+
+APC only helps while a shared prefix is still in the KV cache. Batch jobs
+that submit prompts in arbitrary order interleave unrelated prefixes and
+evict each other's blocks before they are reused. This stage sits in front
+of VLLMClient and:
+
+1. Looks ahead over a bounded window of queued prompts and dispatches the
+   one sharing the most full KV blocks with the previous prompt, so each
+   prefix group runs back to back while it is cached.
+2. When a new group starts, sends one warming request for the group's
+   shared prefix first (max_tokens=1) and holds the group until it
+   finishes, so concurrent members hit the cache instead of all computing
+   the same prefix. A group is the prompts sharing the deepest prefix
+   available (e.g. one system prompt, not just a preamble common to all
+   system prompts): once the next prompt shares less with the previous one
+   than the group's depth, a new group with its own warm-up starts.
+3. Bounds reordering: prompt i is dispatched no later than position
+   i + max_delay, so no prompt starves behind popular groups.
+
+Prompts are consumed lazily, so the scheduler works on endless streams such
+as template_builder.generate_workload().
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+sys.path.insert(0, "../..")
+from shared import StreamTimeline, VLLMClient
+from shared.tokens import TokenCounter, get_token_counter
+
+
+@dataclass
+class Dispatch:
+    """One request in dispatch order."""
+
+    index: int | None  # Position in the input stream; None for warming requests
+    prompt: str
+    warm: bool = False  # Prefix-warming request: wait for it before the group
+    shared_blocks: int = 0  # Full blocks shared with the previous prompt / group
+
+
+@dataclass
+class DispatchResult:
+    """Outcome of one dispatched request."""
+
+    index: int | None
+    warm: bool
+    ttft_ms: float | None
+    latency_ms: float
+    delay: int  # Dispatch position minus arrival position
+
+
+def _shared_tokens(a: tuple, b: tuple) -> int:
+    n = min(len(a), len(b))
+    i = 0
+    while i < n and a[i] == b[i]:
+        i += 1
+    return i
+
+
+class PrefixAwareScheduler:
+    """Reorders a prompt stream so prompts with a common prefix run together."""
+
+    def __init__(
+        self,
+        counter: TokenCounter | None = None,
+        max_delay: int = 32,
+        min_shared_blocks: int = 1,
+        warm: bool = True,
+    ):
+        """
+        Args:
+            counter: Tokenizer used to compare prefixes in KV blocks
+                (default: the served model's, see shared/tokens.py)
+            max_delay: Most positions a prompt may be moved back; also the
+                lookahead window minus one
+            min_shared_blocks: Shared full blocks needed to group two prompts
+                or to send a warming request
+            warm: Send a warming request when a group starts
+        """
+        self.counter = counter or get_token_counter()
+        self.block_size = self.counter.block_size
+        self.max_delay = max_delay
+        self.min_shared_blocks = min_shared_blocks
+        self.warm = warm
+        self.stats = {"prompts": 0, "groups": 0, "warmups": 0, "forced": 0, "max_delay": 0}
+
+    def _blocks(self, a: tuple, b: tuple) -> int:
+        return _shared_tokens(a, b) // self.block_size
+
+    def schedule(self, prompts: Iterable[str]) -> Iterator[Dispatch]:
+        """
+        Yield prompts in cache-aware order, with warming requests interleaved.
+
+        Args:
+            prompts: Prompt stream in arrival order (consumed lazily)
+
+        Yields:
+            Dispatch entries; warming entries come right before their group
+        """
+        source = enumerate(prompts)
+        window: list[tuple[tuple, int, str]] = []  # Sorted by token IDs: (tokens, index, prompt)
+        arrival: dict[int, tuple] = {}  # Queued index -> tokens, for the oldest-first check
+        position = 0
+        last: tuple | None = None
+        depth: int | None = None  # Blocks the current group shares; None until known
+        exhausted = False
+
+        while True:
+            # Refill the lookahead window
+            while not exhausted and len(window) <= self.max_delay:
+                try:
+                    index, prompt = next(source)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tokens = tuple(self.counter.encode(prompt))
+                bisect.insort(window, (tokens, index, prompt))
+                arrival[index] = tokens
+            if not window:
+                return
+
+            oldest = min(arrival)
+            pick = None
+            if oldest + self.max_delay <= position:
+                pick = bisect.bisect_left(window, (arrival[oldest], oldest))
+                self.stats["forced"] += 1
+            elif last is not None:
+                # The best match for `last` is next to where it would sort
+                i = bisect.bisect_left(window, (last, -1))
+                best = -1
+                for j in (i - 1, i):
+                    if 0 <= j < len(window):
+                        shared = self._blocks(window[j][0], last)
+                        if shared >= self.min_shared_blocks and shared > best:
+                            pick, best = j, shared
+            if pick is None:
+                pick = bisect.bisect_left(window, (arrival[oldest], oldest))
+
+            tokens, index, prompt = window[pick]
+            shared = self._blocks(tokens, last) if last is not None else 0
+            if shared < self.min_shared_blocks or (depth is not None and shared < depth):
+                # Leaving the group's prefix, even if a shallower one is still shared
+                self.stats["groups"] += 1
+                depth = self._group_depth(window, pick)
+                warmup = self._warmup(window, pick, depth) if depth is not None else None
+                if warmup is not None:
+                    self.stats["warmups"] += 1
+                    yield warmup
+            elif depth is None:
+                depth = shared
+            window.pop(pick)
+            del arrival[index]
+            self.stats["prompts"] += 1
+            self.stats["max_delay"] = max(self.stats["max_delay"], position - index)
+            position += 1
+            last = tokens
+            yield Dispatch(index=index, prompt=prompt, shared_blocks=shared)
+
+    def _group_depth(self, window: list, pick: int) -> int | None:
+        """Deepest prefix (in blocks) window[pick] shares with a neighbour, None if too shallow."""
+        tokens = window[pick][0]
+        # The deepest match sorts next to window[pick]
+        depth = max(
+            (self._blocks(window[j][0], tokens) for j in (pick - 1, pick + 1) if 0 <= j < len(window)),
+            default=0,
+        )
+        return depth if depth >= self.min_shared_blocks else None
+
+    def _warmup(self, window: list, pick: int, depth: int) -> Dispatch | None:
+        """Warming request for the prompts sharing `depth` blocks with window[pick]."""
+        if not self.warm:
+            return None
+        tokens, _, prompt = window[pick]
+        members = [prompt]
+        # Group members are contiguous in sorted order
+        for step in (-1, 1):
+            j = pick + step
+            while 0 <= j < len(window) and self._blocks(window[j][0], tokens) >= depth:
+                members.append(window[j][2])
+                j += step
+        prefix = os.path.commonprefix(members)
+        return Dispatch(index=None, prompt=prefix, warm=True, shared_blocks=depth)
+
+
+def dispatch(
+    client: VLLMClient,
+    dispatches: Iterable[Dispatch],
+    concurrency: int = 8,
+    max_tokens: int = 20,
+) -> list[DispatchResult]:
+    """
+    Send requests in the given order with up to `concurrency` in flight.
+
+    Warming requests are sent alone: dispatch waits for every earlier
+    request and for the warm-up itself before starting the group.
+
+    Returns:
+        One DispatchResult per request, in completion order
+    """
+    results: list[DispatchResult] = []
+    lock = threading.Lock()
+    slots = threading.Semaphore(concurrency)
+
+    def run(item: Dispatch, position: int) -> None:
+        try:
+            timeline = StreamTimeline()
+            start = time.perf_counter()
+            tokens = 1 if item.warm else max_tokens
+            for _ in client.complete_stream(item.prompt, max_tokens=tokens, timeline=timeline):
+                pass
+            result = DispatchResult(
+                index=item.index,
+                warm=item.warm,
+                ttft_ms=timeline.ttft_ms,
+                latency_ms=(time.perf_counter() - start) * 1000,
+                delay=position - item.index if item.index is not None else 0,
+            )
+            with lock:
+                results.append(result)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        position = 0
+        pending = []
+        for item in dispatches:
+            if item.warm:
+                for future in pending:
+                    future.result()
+                pending.clear()
+                slots.acquire()
+                pool.submit(run, item, position).result()
+                continue
+            slots.acquire()
+            pending.append(pool.submit(run, item, position))
+            position += 1
+        for future in pending:
+            future.result()
+    return results
+
+
+if __name__ == "__main__":
+    import itertools
+
+    from template_builder import WorkloadSpec, generate_workload
+
+    spec = WorkloadSpec(num_system_prompts=4, system_tokens=64, overlap=0.0, target_tokens=80)
+    scheduler = PrefixAwareScheduler(get_token_counter(base_url=None), max_delay=8)
+    prompts = list(generate_workload(spec, 24))
+    print("Dispatch order (warm = prefix warming request):")
+    for item in itertools.islice(scheduler.schedule(prompts), 40):
+        label = "warm" if item.warm else f"#{item.index:<3}"
+        print(f"  {label}  shared {item.shared_blocks:>2} blocks  {item.prompt[30:70]!r}")
+    print(f"\nStats: {scheduler.stats}")
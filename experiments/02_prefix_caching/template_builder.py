@@ -1,13 +1,28 @@
 """
 Template Builder - Generates prompts for prefix caching experiments.
 
-Creates two types of workloads:
+Creates three types of workloads:
 1. High reuse: Same long prefix (system prompt) + different suffixes (questions)
 2. No reuse: Unique prompts with no shared prefix
+3. Parametric: A stream of prompts drawn from several system prompts with
+   Zipf popularity, partial overlap between them and multi-turn
+   conversations whose history grows (see WorkloadSpec)
+
+Filler text is made of common English words, which tokenize like real
+text at roughly one token per word.
 """
 
+import argparse
+import bisect
+import itertools
+import os
 import random
-import string
+import sys
+from dataclasses import dataclass
+from typing import Iterator
+
+sys.path.insert(0, "../..")
+from shared.tokens import TokenCounter, get_token_counter
 
 
 # A long system prompt that will be reused across requests
@@ -50,6 +65,43 @@ QUESTIONS = [
 ]
 
 
+# Common English words; most are a single token with a leading space in
+# BPE vocabularies, so word count approximates token count
+WORDS = """
+the of and to in is that for it as with was on be by at this have from or
+one had not but what all were when we there can an your which their said if
+do will each about how up out them then she many some so these would other
+into has more her two like him see time could no make than first been its
+who now people my made over did down only way find use may water long little
+very after words called just where most know get through back much before go
+good new write our used me man too any day same right look think also around
+another came come work three word must because does part even place well such
+here take why things help put years different away again off went old number
+great tell men say small every found still between name should home big give
+air line set own under read last never us left end along while might next
+sound below saw something thought both few those always looked show large
+often together asked house world going want school important until form food
+keep children feet land side without boy once animals life enough took
+sometimes four head above kind began almost live page got earth need far hand
+high year mother light parts country father let night following picture being
+study second eyes soon times story boys since white days ever paper hard near
+sentence better best across during today others sure means knew its try told
+young miles sun ways thing whole hear example heard several change answer room
+sea against top turned learn point city play toward five using himself usually
+""".split()
+
+
+def random_text(num_words: int, rng: random.Random = random) -> str:
+    """Sentences of random common words, about `num_words` tokens long."""
+    sentences = []
+    while num_words > 0:
+        n = min(rng.randint(6, 16), num_words)
+        words = rng.choices(WORDS, k=n)
+        sentences.append(" ".join(words).capitalize() + ".")
+        num_words -= n
+    return " ".join(sentences)
+
+
 def generate_high_reuse_prompts(count: int = 10, prefix: str = SYSTEM_PROMPT) -> list[str]:
     """
     Generate prompts with shared prefix (high cache reuse).
@@ -73,37 +125,146 @@ def generate_no_reuse_prompts(count: int = 10, length: int = 200) -> list[str]:
     """
     prompts = []
     for i in range(count):
-        # Generate unique random prefix for each prompt
-        unique_prefix = ''.join(random.choices(string.ascii_letters + ' ', k=length))
+        # Unique prefix of real words, about `length` characters
+        unique_prefix = random_text(length // 5)[:length]
         question = QUESTIONS[i % len(QUESTIONS)]
         prompt = f"Context: {unique_prefix}\n\nQuestion: {question}\nAnswer:"
         prompts.append(prompt)
     return prompts
 
 
-def get_prefix_length(prompts: list[str]) -> int:
-    """Calculate the common prefix length across prompts."""
-    if not prompts:
-        return 0
+@dataclass
+class WorkloadSpec:
+    """
+    Parameters of a parametric prefix-reuse workload.
+
+    Each prompt is a system prompt, the conversation so far and a new user
+    message. System prompts share their first `overlap` fraction (a common
+    preamble) and differ after it; which one a conversation uses is drawn
+    from a Zipf distribution with exponent `zipf_s` (0 = uniform).
+    """
+
+    num_system_prompts: int = 8
+    zipf_s: float = 1.0
+    system_tokens: int = 512  # Length of each system prompt
+    overlap: float = 0.5  # Fraction of the system prompt common to all of them
+    target_tokens: int = 640  # First-turn prompt length; sets the user message length
+    turns: int = 1  # Turns per conversation; 1 = independent requests
+    answer_tokens: int = 64  # Assistant reply appended to the history per turn
+    concurrent_conversations: int = 16  # Open conversations whose turns interleave
+    seed: int = 0
+
+    @property
+    def user_tokens(self) -> int:
+        return max(self.target_tokens - self.system_tokens, 8)
+
+
+def _system_prompts(spec: WorkloadSpec, rng: random.Random) -> list[str]:
+    shared_words = round(spec.system_tokens * spec.overlap)
+    preamble = random_text(shared_words, rng) if shared_words else ""
+    prompts = []
+    for k in range(spec.num_system_prompts):
+        own = random_text(spec.system_tokens - shared_words, rng)
+        prompts.append(f"{preamble}\n\nAssistant profile {k}: {own}\n\n".lstrip())
+    return prompts
+
+
+def generate_workload(spec: WorkloadSpec, count: int | None = None) -> Iterator[str]:
+    """
+    Lazily generate prompts for a parametric workload.
 
-    prefix_len = 0
-    min_len = min(len(p) for p in prompts)
+    Only the system prompts and the open conversations are held in memory,
+    so streams of millions of prompts can be consumed one at a time.
 
-    for i in range(min_len):
-        chars = set(p[i] for p in prompts)
-        if len(chars) == 1:
-            prefix_len += 1
+    Args:
+        spec: Workload parameters
+        count: Prompts to generate (None = endless)
+
+    Yields:
+        Prompt strings in arrival order
+    """
+    rng = random.Random(spec.seed)
+    systems = _system_prompts(spec, rng)
+    cum_weights = list(
+        itertools.accumulate(1.0 / (k + 1) ** spec.zipf_s for k in range(spec.num_system_prompts))
+    )
+
+    def new_conversation() -> list:
+        k = bisect.bisect(cum_weights, rng.random() * cum_weights[-1])
+        return [systems[min(k, len(systems) - 1)], 0]  # [history, turns taken]
+
+    conversations = [new_conversation() for _ in range(max(spec.concurrent_conversations, 1))]
+    produced = 0
+    while count is None or produced < count:
+        i = rng.randrange(len(conversations))
+        history, turn = conversations[i]
+        prompt = f"{history}User: {random_text(spec.user_tokens, rng)}\nAssistant:"
+        yield prompt
+        produced += 1
+        if turn + 1 >= spec.turns:
+            conversations[i] = new_conversation()
         else:
-            break
+            conversations[i] = [f"{prompt} {random_text(spec.answer_tokens, rng)}\n", turn + 1]
+
 
-    return prefix_len
+def add_workload_args(parser: argparse.ArgumentParser) -> None:
+    """Add WorkloadSpec options to a benchmark's argument parser."""
+    defaults = WorkloadSpec()
+    group = parser.add_argument_group("parametric workload")
+    group.add_argument("--system-prompts", type=int, default=defaults.num_system_prompts, help="Distinct system prompts")
+    group.add_argument("--zipf", type=float, default=defaults.zipf_s, help="System prompt popularity skew (0 = uniform)")
+    group.add_argument("--system-tokens", type=int, default=defaults.system_tokens, help="System prompt length")
+    group.add_argument("--overlap", type=float, default=defaults.overlap, help="Fraction shared by all system prompts")
+    group.add_argument("--target-tokens", type=int, default=defaults.target_tokens, help="First-turn prompt length")
+    group.add_argument("--turns", type=int, default=defaults.turns, help="Turns per conversation")
+    group.add_argument("--answer-tokens", type=int, default=defaults.answer_tokens, help="Reply length added per turn")
+    group.add_argument(
+        "--conversations", type=int, default=defaults.concurrent_conversations, help="Interleaved conversations"
+    )
+    group.add_argument("--seed", type=int, default=defaults.seed, help="Workload random seed")
+
+
+def workload_spec_from_args(args: argparse.Namespace) -> WorkloadSpec:
+    """WorkloadSpec from options added by add_workload_args()."""
+    return WorkloadSpec(
+        num_system_prompts=args.system_prompts,
+        zipf_s=args.zipf,
+        system_tokens=args.system_tokens,
+        overlap=args.overlap,
+        target_tokens=args.target_tokens,
+        turns=args.turns,
+        answer_tokens=args.answer_tokens,
+        concurrent_conversations=args.conversations,
+        seed=args.seed,
+    )
+
+
+def get_prefix_length(prompts: list[str]) -> int:
+    """Calculate the common prefix length across prompts, in characters."""
+    # The common prefix of the whole list is the common prefix of its
+    # lexicographic extremes
+    return len(os.path.commonprefix([min(prompts), max(prompts)])) if prompts else 0
+
+
+def get_prefix_tokens(prompts: list[str], counter: TokenCounter | None = None) -> dict:
+    """
+    Shared prefix of prompts in tokens and KV blocks.
+
+    Uses the served model's tokenizer (see shared/tokens.py); the result is
+    TokenCounter.prefix_report() with 'shared_prefix_tokens' and
+    'shared_prefix_blocks'.
+    """
+    return (counter or get_token_counter()).prefix_report(prompts)
 
 
 if __name__ == "__main__":
+    from shared.tokens import print_prefix_report
+
     print("=== High Reuse Prompts ===")
     high_reuse = generate_high_reuse_prompts(3)
     prefix_len = get_prefix_length(high_reuse)
     print(f"Common prefix length: {prefix_len} chars")
+    print_prefix_report("Token accounting", get_prefix_tokens(high_reuse))
     print(f"System prompt length: {len(SYSTEM_PROMPT)} chars")
     for i, p in enumerate(high_reuse):
         print(f"\n--- Prompt {i+1} (total {len(p)} chars) ---")
@@ -113,6 +274,22 @@ if __name__ == "__main__":
     no_reuse = generate_no_reuse_prompts(3)
     prefix_len = get_prefix_length(no_reuse)
     print(f"Common prefix length: {prefix_len} chars")
+    print_prefix_report("Token accounting", get_prefix_tokens(no_reuse))
     for i, p in enumerate(no_reuse):
         print(f"\n--- Prompt {i+1} (total {len(p)} chars) ---")
-        print(p[:100] + "..." if len(p) > 100 else p)
\ No newline at end of file
+        print(p[:100] + "..." if len(p) > 100 else p)
+
+    print("\n\n=== Parametric Workload (4 system prompts, 3 turns) ===")
+    spec = WorkloadSpec(
+        num_system_prompts=4,
+        system_tokens=64,
+        target_tokens=96,
+        turns=3,
+        answer_tokens=16,
+        concurrent_conversations=2,
+    )
+    workload = list(generate_workload(spec, 6))
+    print_prefix_report("Token accounting", get_prefix_tokens(workload))
+    for i, p in enumerate(workload):
+        print(f"\n--- Prompt {i+1} (total {len(p)} chars) ---")
+        print("..." + p[-100:] if len(p) > 100 else p)
\ No newline at end of file
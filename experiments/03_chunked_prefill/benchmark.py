@@ -6,84 +6,149 @@ chunked prefill prevents long prompts from blocking short ones.
 """
 
 import argparse
+import asyncio
+import itertools
+import random
 import statistics
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import uuid
+from urllib.parse import urlparse
 
 sys.path.insert(0, "../..")
-from shared import VLLMClient, get_vllm_metrics, timer
+from shared import AsyncVLLMClient, StreamTimeline, timer
+from shared.histogram import histogram_of, print_latency_summary
+from shared.metrics import MetricsSampler, print_phase_report
+from shared.load_generator import ARRIVAL_KINDS, make_schedule, run_open_loop, summarize_send_lag
+from shared.results import record_run
+from shared.tokens import get_token_counter
 
-from workload_generator import generate_mixed_workload, estimate_tokens
+from workload_generator import filler_repeats_for, generate_mixed_workload, generate_prompt
 
 
-def measure_single_ttft(client: VLLMClient, prompt: str, max_tokens: int = 10) -> float:
-    """Measure TTFT for a single prompt. Returns seconds."""
-    start = time.perf_counter()
-    stream = client.complete_stream(prompt, max_tokens=max_tokens)
-    for _token in stream:
-        ttft = time.perf_counter() - start
-        # Consume rest of stream
-        for _ in stream:
-            pass
-        return ttft
-    return time.perf_counter() - start
-
-
-def run_concurrent_workload(
-    client: VLLMClient,
+async def measure_single_stream(
+    client: AsyncVLLMClient, prompt: str, max_tokens: int = 10
+) -> StreamTimeline:
+    """Stream a single prompt and record the arrival time of every chunk."""
+    timeline = StreamTimeline()
+    async for _token in client.complete_stream(prompt, max_tokens=max_tokens, timeline=timeline):
+        pass
+    return timeline
+
+
+def _stream_result(item: dict, timeline: StreamTimeline) -> dict:
+    """Build a per-request result dict from a workload item and its timeline."""
+    return {
+        "id": item["id"],
+        "length": item["length"],
+        "ttft_ms": timeline.ttft_ms if timeline.ttft_ms is not None else timeline.e2e_ms,
+        "tpot_ms": timeline.tpot_ms,
+        "e2e_ms": timeline.e2e_ms,
+        "itl_p99_ms": timeline.itl_percentile_ms(99),
+        "max_stall_ms": timeline.max_stall_ms(),
+        "tokens": item["tokens"],
+    }
+
+
+async def run_concurrent_workload(
+    client: AsyncVLLMClient,
     workload: list[dict],
     max_tokens: int = 10,
-    max_workers: int = 8,
+    max_concurrency: int | None = 8,
 ) -> list[dict]:
     """
     Run workload concurrently and measure TTFT for each request.
 
-    Returns list of results with 'id', 'length', 'ttft_ms', 'tokens'.
+    Args:
+        max_concurrency: Max requests in flight at once (None = send all at once)
+
+    Returns list of results with 'id', 'length', 'tokens' and per-request
+    streaming metrics ('ttft_ms', 'tpot_ms', 'e2e_ms', 'itl_p99_ms',
+    'max_stall_ms').
     """
     results = []
+    limit = asyncio.Semaphore(max_concurrency or len(workload) or 1)
 
-    def process_item(item):
-        ttft = measure_single_ttft(client, item["prompt"], max_tokens)
-        return {
-            "id": item["id"],
-            "length": item["length"],
-            "ttft_ms": ttft * 1000,
-            "tokens": estimate_tokens(item["prompt"]),
-        }
+    async def process_item(item):
+        async with limit:
+            timeline = await measure_single_stream(client, item["prompt"], max_tokens)
+        return _stream_result(item, timeline)
 
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(process_item, item): item for item in workload}
-        for future in as_completed(futures):
-            result = future.result()
-            results.append(result)
-            print(f"  {result['id']}: {result['ttft_ms']:.0f}ms (~{result['tokens']} tokens)")
+    for future in asyncio.as_completed([process_item(item) for item in workload]):
+        result = await future
+        results.append(result)
+        print(f"  {result['id']}: {result['ttft_ms']:.0f}ms ({result['tokens']} tokens)")
 
     return results
 
 
-def calculate_percentile(values: list[float], percentile: int) -> float:
-    """Calculate percentile value."""
-    if not values:
-        return 0
-    sorted_values = sorted(values)
-    index = int(len(sorted_values) * percentile / 100)
-    return sorted_values[min(index, len(sorted_values) - 1)]
+async def run_open_loop_workload(
+    client: AsyncVLLMClient,
+    workload: list[dict],
+    schedule: list[float],
+    max_tokens: int = 10,
+) -> list[dict]:
+    """
+    Send the workload on an arrival schedule, independent of completions.
+
+    Returns the same result dicts as run_concurrent_workload plus 'lag_ms',
+    the delay between scheduled and actual send time.
+    """
+
+    async def send(index: int) -> StreamTimeline:
+        return await measure_single_stream(client, workload[index]["prompt"], max_tokens)
 
+    records = await run_open_loop(schedule, send)
 
-def run_benchmark(
-    client: VLLMClient,
+    results = []
+    for record in records:
+        item = workload[record.index]
+        if record.error:
+            print(f"  {item['id']}: FAILED ({record.error})")
+            continue
+        result = _stream_result(item, record.result)
+        result["lag_ms"] = record.lag_ms
+        results.append(result)
+        print(
+            f"  {result['id']}: {result['ttft_ms']:.0f}ms ({result['tokens']} tokens, "
+            f"sent @{record.sent_s * 1000:.0f}ms)"
+        )
+
+    lag = summarize_send_lag(records)
+    if not lag:
+        print("\nNothing was scheduled")
+        return results
+    print(
+        f"\nOffered load: {lag['offered_rps'] or 0:.1f} req/s scheduled, "
+        f"{lag['achieved_rps'] or 0:.1f} req/s sent"
+    )
+    print(f"Send lag: p50 {lag['lag_p50_ms']:.2f}ms, p99 {lag['lag_p99_ms']:.2f}ms, max {lag['lag_max_ms']:.2f}ms")
+
+    return results
+
+
+async def run_benchmark(
+    client: AsyncVLLMClient,
     num_short: int = 10,
     num_long: int = 3,
     max_tokens: int = 10,
+    max_concurrency: int | None = 8,
+    schedule: list[float] | None = None,
+    sample_interval: float = 0.5,
 ):
-    """Run the chunked prefill fairness benchmark."""
+    """
+    Run the chunked prefill fairness benchmark.
+
+    With a `schedule` (send offsets in seconds, one per request) requests
+    are sent open-loop on that schedule instead of as one burst. Server
+    metrics are sampled every `sample_interval` seconds during the run.
+    """
 
     print("=" * 70)
     print("Chunked Prefill Benchmark")
     print("=" * 70)
 
-    if not client.health_check():
+    if not await client.health_check():
         print("ERROR: Server not healthy")
         return None
 
@@ -96,57 +161,67 @@ def run_benchmark(
         shuffle=True,
     )
 
+    # Count prompt tokens once, with the served model's tokenizer
+    counter = get_token_counter(client.model, client.base_url)
+    for item, tokens in zip(workload, counter.count_batch([item["prompt"] for item in workload])):
+        item["tokens"] = tokens
+    approx = "~" if not counter.exact else ""
+
     # Show workload order
-    print("Request order:")
+    print(f"Request order (tokenizer: {counter.backend}):")
     for item in workload:
-        tokens = estimate_tokens(item["prompt"])
-        print(f"  {item['id']}: ~{tokens} tokens")
+        print(f"  {item['id']}: {approx}{item['tokens']} tokens")
 
     # Warm up
     print("\nWarming up...")
-    client.complete("Hello", max_tokens=5)
-
-    # Run concurrent workload
-    print(f"\nSending {len(workload)} requests concurrently...")
-    with timer() as t:
-        results = run_concurrent_workload(client, workload, max_tokens)
+    await client.complete("Hello", max_tokens=5)
+
+    # Run workload
+    sampler = MetricsSampler(client.base_url, interval=sample_interval).start()
+    try:
+        async with sampler.async_phase("workload"):
+            with timer() as t:
+                if schedule is not None:
+                    print(f"\nSending {len(workload)} requests on arrival schedule...")
+                    results = await run_open_loop_workload(client, workload, schedule, max_tokens)
+                else:
+                    print(f"\nSending {len(workload)} requests concurrently...")
+                    results = await run_concurrent_workload(client, workload, max_tokens, max_concurrency)
+    finally:
+        sampler.stop()
 
     print(f"\nTotal time: {t.elapsed_ms:.0f}ms")
 
     # Analyze results by length
-    short_ttfts = [r["ttft_ms"] for r in results if r["length"] == "short"]
-    long_ttfts = [r["ttft_ms"] for r in results if r["length"] == "long"]
+    short_hist = histogram_of(r["ttft_ms"] for r in results if r["length"] == "short")
+    long_hist = histogram_of(r["ttft_ms"] for r in results if r["length"] == "long")
+    tpot_hist = histogram_of(r["tpot_ms"] for r in results if r["tpot_ms"] is not None)
+    stall_hist = histogram_of(r["max_stall_ms"] for r in results if r["max_stall_ms"] is not None)
 
-    # Get vLLM metrics
-    metrics = get_vllm_metrics(client.base_url)
+    server = sampler.phase_report("workload")
 
     # Print results
     print("\n" + "=" * 70)
     print("Results")
     print("=" * 70)
 
-    if short_ttfts:
-        print(f"\nShort Prompt TTFT ({len(short_ttfts)} requests):")
-        print(f"  Min:  {min(short_ttfts):.1f}ms")
-        print(f"  Max:  {max(short_ttfts):.1f}ms")
-        print(f"  Mean: {statistics.mean(short_ttfts):.1f}ms")
-        print(f"  p50:  {calculate_percentile(short_ttfts, 50):.1f}ms")
-        print(f"  p95:  {calculate_percentile(short_ttfts, 95):.1f}ms")
-        if len(short_ttfts) > 1:
-            print(f"  Stdev: {statistics.stdev(short_ttfts):.1f}ms")
-
-    if long_ttfts:
-        print(f"\nLong Prompt TTFT ({len(long_ttfts)} requests):")
-        print(f"  Min:  {min(long_ttfts):.1f}ms")
-        print(f"  Max:  {max(long_ttfts):.1f}ms")
-        print(f"  Mean: {statistics.mean(long_ttfts):.1f}ms")
+    if short_hist.count:
+        print_latency_summary("Short Prompt TTFT", short_hist)
+
+    if long_hist.count:
+        print_latency_summary("Long Prompt TTFT", long_hist)
+
+    # Decode smoothness (needs at least two streamed chunks per request)
+    if tpot_hist.count:
+        print_latency_summary("Decode TPOT", tpot_hist)
+        print_latency_summary("Longest Stall per Request", stall_hist)
 
     # Fairness analysis
-    if short_ttfts and long_ttfts:
+    if short_hist.count and long_hist.count:
         print("\nFairness Analysis:")
-        short_mean = statistics.mean(short_ttfts)
-        short_p95 = calculate_percentile(short_ttfts, 95)
-        long_mean = statistics.mean(long_ttfts)
+        short_mean = short_hist.mean
+        short_p95 = short_hist.percentile(95)
+        long_mean = long_hist.mean
 
         print(f"  Short mean vs Long mean: {short_mean:.1f}ms vs {long_mean:.1f}ms")
         print(f"  Short p95: {short_p95:.1f}ms")
@@ -156,32 +231,643 @@ def run_benchmark(
         else:
             print("  OK: Short prompts not excessively delayed")
 
-    if metrics:
-        print("\nvLLM Server Metrics:")
-        if "ttft_avg_ms" in metrics:
-            print(f"  Avg TTFT: {metrics['ttft_avg_ms']:.1f}ms")
-        if "e2e_latency_avg_ms" in metrics:
-            print(f"  Avg E2E:  {metrics['e2e_latency_avg_ms']:.1f}ms")
+    print_phase_report("Workload", server)
+
+    print("\n" + "=" * 70)
+
+    return {
+        "short_ttft_mean_ms": short_hist.mean,
+        "short_ttft_p95_ms": short_hist.percentile(95),
+        "short_ttft_p99_ms": short_hist.percentile(99),
+        "long_ttft_mean_ms": long_hist.mean,
+        "tpot_mean_ms": tpot_hist.mean,
+        "max_stall_ms": stall_hist.max,
+        "server": server,
+        "samples": {
+            "short_ttft_ms": [r["ttft_ms"] for r in results if r["length"] == "short"],
+            "long_ttft_ms": [r["ttft_ms"] for r in results if r["length"] == "long"],
+            "tpot_ms": [r["tpot_ms"] for r in results if r["tpot_ms"] is not None],
+            "max_stall_ms": [r["max_stall_ms"] for r in results if r["max_stall_ms"] is not None],
+        },
+    }
+
+# =============================================================================
+# Sweep: batched-token budget x workload mix
+# =============================================================================
+
+SWEEP_LATENCY_KEYS = ("short_ttft_p99_ms", "short_ttft_p95_ms", "prefill_itl_p99_ms")
+
+
+def gaps_during(timeline: StreamTimeline, windows: list[tuple[float, float]]) -> list[float]:
+    """
+    Inter-token gaps (ms) of a stream that overlap any of the time windows.
+
+    Windows are (start, end) perf_counter() pairs, e.g. the prefill of a
+    long prompt: from its send until its first token.
+    """
+    gaps = []
+    s = timeline.stamps
+    for i in range(1, len(s)):
+        if any(s[i - 1] < end and s[i] > start for start, end in windows):
+            gaps.append((s[i] - s[i - 1]) * 1000)
+    return gaps
+
+
+def pareto_frontier(points: list[dict], throughput_key: str, latency_key: str) -> list[int]:
+    """
+    Indices of the points no other point beats on both throughput (higher)
+    and latency (lower). Points missing either value are skipped.
+    """
+    valid = [i for i, p in enumerate(points) if p.get(throughput_key) is not None and p.get(latency_key) is not None]
+    frontier = []
+    for i in valid:
+        a = points[i]
+        dominated = any(
+            points[j][throughput_key] >= a[throughput_key]
+            and points[j][latency_key] <= a[latency_key]
+            and (points[j][throughput_key] > a[throughput_key] or points[j][latency_key] < a[latency_key])
+            for j in valid
+            if j != i
+        )
+        if not dominated:
+            frontier.append(i)
+    return sorted(frontier, key=lambda i: points[i][throughput_key])
+
+
+def _sweep_workload(counter, num_requests: int, long_ratio: float, long_tokens: int, seed: int):
+    """
+    Mixed short/long workload for one sweep point, and its prompt token counts.
+
+    Every prompt starts with a unique tag: the long prompts share their
+    filler text, so untagged they would be prefix-cache hits after the
+    first and never exercise the prefill budget.
+    """
+    random.seed(seed)
+    num_long = round(num_requests * long_ratio)
+    workload = generate_mixed_workload(
+        num_short=num_requests - num_long,
+        num_medium=0,
+        num_long=num_long,
+        long_repeats=filler_repeats_for(long_tokens, counter),
+    )
+    for item in workload:
+        item["prompt"] = f"[{uuid.uuid4().hex}] {item['prompt']}"
+    return workload, counter.count_batch([item["prompt"] for item in workload])
+
+
+async def run_sweep_point(
+    client: AsyncVLLMClient,
+    counter,
+    num_requests: int,
+    long_ratio: float,
+    long_tokens: int,
+    rate: float,
+    max_tokens: int = 32,
+    seed: int = 0,
+) -> dict:
+    """
+    Send one Poisson-arrival mixed workload and measure fairness and throughput.
+
+    Returns short-prompt TTFT p95/p99, the inter-token gaps of streams that
+    were decoding while a long prompt was in prefill ('prefill_itl_*'),
+    overall ITL p99, and total (prompt + output) tokens/s. Below saturation
+    tokens/s is just the offered load; see run_capacity_point.
+    """
+    workload, prompt_tokens = _sweep_workload(counter, num_requests, long_ratio, long_tokens, seed)
+    schedule = make_schedule("poisson", len(workload), rate=rate, seed=seed)
+
+    async def send(index: int) -> StreamTimeline:
+        return await measure_single_stream(client, workload[index]["prompt"], max_tokens)
+
+    start = time.perf_counter()
+    records = await run_open_loop(schedule, send)
+    done = [r for r in records if not r.error and r.result.stamps]
+    elapsed = max((r.result.end or r.result.stamps[-1] for r in done), default=start) - start
+
+    long_windows = [
+        (r.result.start, r.result.stamps[0]) for r in done if workload[r.index]["length"] == "long"
+    ]
+    short = [r.result for r in done if workload[r.index]["length"] == "short"]
+    prefill_gaps = [gap for timeline in short for gap in gaps_during(timeline, long_windows)]
+    all_gaps = [gap for r in done for gap in r.result.itls_ms()]
+    ttft = histogram_of(t.ttft_ms for t in short)
+    prefill_itl = histogram_of(prefill_gaps)
+    output_tokens = sum(r.result.num_chunks for r in done)
+    input_tokens = sum(prompt_tokens[r.index] for r in done)
+
+    return {
+        "long_ratio": long_ratio,
+        "long_tokens": long_tokens,
+        "rate": rate,
+        "requests": len(done),
+        "errors": len(records) - len(done),
+        "short_ttft_p95_ms": ttft.percentile(95),
+        "short_ttft_p99_ms": ttft.percentile(99),
+        "prefill_itl_p50_ms": prefill_itl.percentile(50),
+        "prefill_itl_p99_ms": prefill_itl.percentile(99),
+        "itl_p99_ms": histogram_of(all_gaps).percentile(99),
+        "total_tokens_per_s": (input_tokens + output_tokens) / elapsed if elapsed > 0 else None,
+        "output_tokens_per_s": output_tokens / elapsed if elapsed > 0 else None,
+        "samples": {"short_ttft_ms": [t.ttft_ms for t in short], "prefill_itl_ms": prefill_gaps},
+    }
+
+
+async def run_capacity_point(
+    client: AsyncVLLMClient,
+    counter,
+    num_requests: int,
+    long_ratio: float,
+    long_tokens: int,
+    max_tokens: int = 32,
+    concurrency: int = 16,
+    seed: int = 0,
+) -> dict:
+    """
+    Measure the server's capacity for a workload mix.
+
+    Sends the same mix as run_sweep_point closed-loop, `concurrency`
+    requests in flight, so the server never idles waiting for arrivals.
+
+    Returns:
+        'capacity_tokens_per_s' (prompt + output) and 'capacity_output_tokens_per_s'
+    """
+    workload, prompt_tokens = _sweep_workload(counter, num_requests, long_ratio, long_tokens, seed)
+    limit = asyncio.Semaphore(concurrency)
+
+    async def send(index: int) -> tuple[int, StreamTimeline]:
+        async with limit:
+            return index, await measure_single_stream(client, workload[index]["prompt"], max_tokens)
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(send(i) for i in range(len(workload))), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    done = [r for r in results if not isinstance(r, BaseException) and r[1].stamps]
+    output_tokens = sum(timeline.num_chunks for _, timeline in done)
+    input_tokens = sum(prompt_tokens[i] for i, _ in done)
+    return {
+        "capacity_tokens_per_s": (input_tokens + output_tokens) / elapsed if done else None,
+        "capacity_output_tokens_per_s": output_tokens / elapsed if done else None,
+    }
+
+
+def run_sweep(
+    url: str,
+    backend,
+    budgets: list[int],
+    long_ratios: list[float],
+    long_tokens: list[int],
+    rates: list[float],
+    num_requests: int = 60,
+    max_tokens: int = 32,
+    latency_key: str = "short_ttft_p99_ms",
+    slo_ms: float | None = None,
+    capacity_concurrency: int = 16,
+    seed: int = 0,
+) -> list[dict]:
+    """
+    Measure every (budget, long ratio, long length, rate) combination.
+
+    For each --max-num-batched-tokens budget the server is brought up with
+    that budget (via VLLM_MAX_NUM_BATCHED_TOKENS in docker-compose.yml, or
+    the fake server's setting), then every workload mix is run on it. With
+    backend=None the running server is used as is and only one budget can
+    be measured.
+
+    Open-loop arrivals below saturation only show the offered load as
+    throughput, so each (long ratio, long length) mix is also run
+    closed-loop with `capacity_concurrency` requests in flight
+    (run_capacity_point). The report gives, per workload mix, the Pareto
+    frontier between that capacity and `latency_key` across budgets, and
+    with `slo_ms` the highest-capacity budget that meets it.
+
+    Returns:
+        One result dict per point (see run_sweep_point) plus 'budget' and
+        the mix's 'capacity_tokens_per_s' / 'capacity_output_tokens_per_s'
+    """
+    from shared.orchestrator import EXPERIMENTS, Variant, wait_healthy
 
+    experiment = EXPERIMENTS["chunked_prefill"]
+    mixes = list(itertools.product(long_ratios, long_tokens, rates))
+    print("=" * 70)
+    print("Chunked Prefill Benchmark - Budget Sweep")
+    print("=" * 70)
+    print(f"\nBudgets: {budgets}")
+    print(f"Mixes: long ratio {long_ratios} x long tokens {long_tokens} x rate {rates} req/s")
+    print(f"{num_requests} requests per point, {len(budgets) * len(mixes)} points")
+
+    async def measure(budget: int) -> list[dict]:
+        points = []
+        async with AsyncVLLMClient(base_url=url) as client:
+            await client.complete("Hello", max_tokens=5)
+            counter = get_token_counter(client.model, client.base_url)
+            capacity = {}
+            for ratio, tokens in itertools.product(long_ratios, long_tokens):
+                capacity[ratio, tokens] = await run_capacity_point(
+                    client, counter, num_requests, ratio, tokens, max_tokens, capacity_concurrency, seed
+                )
+                print(
+                    f"  long {ratio:.0%} x {tokens} tok, closed-loop x{capacity_concurrency}: "
+                    f"capacity {capacity[ratio, tokens]['capacity_tokens_per_s'] or 0:.0f} tok/s"
+                )
+            for ratio, tokens, rate in mixes:
+                point = await run_sweep_point(client, counter, num_requests, ratio, tokens, rate, max_tokens, seed)
+                point["budget"] = budget
+                point.update(capacity[ratio, tokens])
+                points.append(point)
+                print(
+                    f"  long {ratio:.0%} x {tokens} tok @ {rate:g} req/s: "
+                    f"short TTFT p99 {point['short_ttft_p99_ms'] or 0:.0f}ms, "
+                    f"prefill ITL p99 {point['prefill_itl_p99_ms'] or 0:.0f}ms, "
+                    f"{point['total_tokens_per_s'] or 0:.0f} tok/s"
+                )
+        return points
+
+    results = []
+    for budget in budgets:
+        print(f"\n--- max-num-batched-tokens={budget} ---")
+        variant = Variant(
+            f"budget_{budget}",
+            "docker-compose.yml",
+            fake={"chunked_prefill": True, "max_num_batched_tokens": budget},
+            environment={"VLLM_MAX_NUM_BATCHED_TOKENS": str(budget)},
+        )
+        if backend is not None:
+            backend.up(experiment, variant)
+        try:
+            if wait_healthy(url) is None:
+                print("  ERROR: server not healthy, skipping budget")
+                continue
+            results.extend(asyncio.run(measure(budget)))
+        finally:
+            if backend is not None:
+                backend.down(experiment, variant)
+
+    print("\n" + "=" * 70)
+    print(f"Results (* = Pareto frontier of capacity tok/s vs {latency_key})")
+    print("=" * 70)
+    for ratio, tokens, rate in mixes:
+        points = [
+            p for p in results if (p["long_ratio"], p["long_tokens"], p["rate"]) == (ratio, tokens, rate)
+        ]
+        frontier = set(pareto_frontier(points, "capacity_tokens_per_s", latency_key))
+        print(f"\nLong {ratio:.0%} x {tokens} tokens @ {rate:g} req/s:")
+        print(f"  {'Budget':>7} {'TTFT p95':>9} {'TTFT p99':>9} {'ITL p99*':>9} {'Tok/s':>8} {'Capacity':>9}")
+        for i, p in enumerate(points):
+            cells = [
+                f"{p[k]:>7.0f}ms" if p[k] is not None else f"{'-':>9}"
+                for k in ("short_ttft_p95_ms", "short_ttft_p99_ms", "prefill_itl_p99_ms")
+            ]
+            mark = "*" if i in frontier else " "
+            print(
+                f"  {p['budget']:>7} {' '.join(cells)} {p['total_tokens_per_s'] or 0:>8.0f} "
+                f"{p['capacity_tokens_per_s'] or 0:>9.0f} {mark}"
+            )
+        if slo_ms is not None:
+            meeting = [points[i] for i in frontier if points[i][latency_key] <= slo_ms]
+            if meeting:
+                best = max(meeting, key=lambda p: p["capacity_tokens_per_s"])
+                print(f"  -> budget {best['budget']}: highest capacity with {latency_key} <= {slo_ms:g}ms")
+            else:
+                print(f"  -> no budget meets {latency_key} <= {slo_ms:g}ms")
+    print("\n  * ITL p99 of short streams while a long prompt was in prefill")
+    print("  Tok/s: served at the offered rate; Capacity: closed-loop tok/s for the mix")
     print("\n" + "=" * 70)
+    return results
 
+
+# =============================================================================
+# Probe: decode stalls caused by long prefills
+# =============================================================================
+
+CANARY_PROMPT = "Write a very long story about a lighthouse keeper, chapter by chapter:"
+
+
+def _stalls_around(
+    timelines: list[StreamTimeline], start: float, end: float, baseline_s: float
+) -> tuple[float, float] | None:
+    """
+    Longest gap of a canary overlapping [start, end] and its median gap over
+    the `baseline_s` seconds before `start` (ms), or None if it had no gap there.
+    """
+    around, before = [], []
+    for timeline in timelines:
+        s = timeline.stamps
+        for i in range(1, len(s)):
+            gap = (s[i] - s[i - 1]) * 1000
+            if s[i - 1] < end and s[i] > start:
+                around.append(gap)
+            elif start - baseline_s <= s[i - 1] and s[i] <= start:
+                before.append(gap)
+    if not around or not before:
+        return None
+    return max(around), statistics.median(before)
+
+
+async def run_probe(
+    client: AsyncVLLMClient,
+    counter,
+    num_canaries: int = 4,
+    long_tokens: list[int] | None = None,
+    injections: int = 6,
+    interval_s: float = 1.0,
+    max_wait_s: float = 120.0,
+) -> dict | None:
+    """
+    Measure how much each injected long prefill stalls streams already decoding.
+
+    Keeps `num_canaries` streaming decodes running (restarted if one
+    finishes), then sends long prompts one at a time, `interval_s` apart,
+    cycling through `long_tokens`. Each injected prompt starts with a unique
+    tag so it never hits the prefix cache. For every injection and canary,
+    the stall is the longest inter-token gap overlapping the injection's
+    prefill (send to first token) minus the canary's median gap in the
+    preceding interval.
+
+    Returns:
+        Per-injection results, mean/max stall, stall per 1k prefill tokens
+        (total stall / total injected tokens) and the least-squares slope of
+        stall vs injected tokens (needs two or more prompt lengths); None if
+        the canaries never started
+    """
+    long_tokens = long_tokens or [1000, 2000, 3000]
+    print(
+        f"{num_canaries} canary streams, {injections} long prompts injected "
+        f"({', '.join(str(t) for t in long_tokens)} tokens, {interval_s:g}s apart)"
+    )
+    canaries: list[list[StreamTimeline]] = [[] for _ in range(num_canaries)]
+    stop = asyncio.Event()
+
+    async def canary(timelines: list[StreamTimeline]) -> None:
+        while not stop.is_set():
+            timeline = StreamTimeline()
+            timelines.append(timeline)
+            async for _token in client.complete_stream(CANARY_PROMPT, max_tokens=4000, timeline=timeline):
+                if stop.is_set():
+                    break
+
+    tasks = [asyncio.create_task(canary(timelines)) for timelines in canaries]
+    deadline = time.perf_counter() + max_wait_s
+    while not all(t and len(t[-1].stamps) >= 2 for t in canaries):
+        if time.perf_counter() > deadline or any(task.done() for task in tasks):
+            stop.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            print("  ERROR: canaries did not start decoding")
+            return None
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(interval_s)  # Baseline gaps before the first injection
+
+    injected = []
+    for k in range(injections):
+        target = long_tokens[k % len(long_tokens)]
+        tag = f"[probe {uuid.uuid4().hex}] "
+        prompt = tag + generate_prompt("long", filler_repeats_for(target, counter))
+        tokens = counter.count(prompt)
+        timeline = await measure_single_stream(client, prompt, max_tokens=1)
+        prefill_end = timeline.stamps[0] if timeline.stamps else timeline.end
+        injected.append({"tokens": tokens, "start": timeline.start, "end": prefill_end})
+        await asyncio.sleep(interval_s)
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    rows, stalls, sizes, baselines = [], [], [], []
+    for k, inj in enumerate(injected):
+        excess = []
+        for timelines in canaries:
+            found = _stalls_around(timelines, inj["start"], inj["end"], interval_s)
+            if found is not None:
+                gap, baseline = found
+                excess.append(max(gap - baseline, 0.0))
+                baselines.append(baseline)
+        row = {
+            "tokens": inj["tokens"],
+            "prefill_ms": (inj["end"] - inj["start"]) * 1000,
+            "canaries": len(excess),
+            "stall_ms": statistics.fmean(excess) if excess else None,
+            "stall_max_ms": max(excess) if excess else None,
+        }
+        rows.append(row)
+        if excess:
+            stalls.append(row["stall_ms"])
+            sizes.append(inj["tokens"])
+        stall = f"stall {row['stall_ms']:.1f}ms (max {row['stall_max_ms']:.1f}ms)" if excess else "no canary gap"
+        print(f"  injection {k + 1}: {row['tokens']} tokens, prefill {row['prefill_ms']:.0f}ms, {stall}")
+
+    slope = None
+    if len(set(sizes)) >= 2:
+        slope = statistics.linear_regression(sizes, stalls).slope
     return {
-        "short_ttft_mean_ms": statistics.mean(short_ttfts) if short_ttfts else None,
-        "short_ttft_p95_ms": calculate_percentile(short_ttfts, 95) if short_ttfts else None,
-        "long_ttft_mean_ms": statistics.mean(long_ttfts) if long_ttfts else None,
+        "injections": rows,
+        "canary_itl_ms": statistics.median(baselines) if baselines else None,
+        "stall_mean_ms": statistics.fmean(stalls) if stalls else None,
+        "stall_max_ms": max((r["stall_max_ms"] for r in rows if r["stall_max_ms"] is not None), default=None),
+        "stall_per_1k_tokens_ms": sum(stalls) / sum(sizes) * 1000 if sizes else None,
+        "stall_slope_ms_per_1k_tokens": slope * 1000 if slope is not None else None,
+        "samples": {"stall_ms": stalls},
     }
 
 
+def run_probe_comparison(url: str, backend, **probe_args) -> dict:
+    """
+    Run the probe with chunked prefill on and off.
+
+    With a backend, each of the experiment's compose variants (chunked,
+    no_chunk) is brought up in turn; with backend=None only the running
+    server is probed, as 'running'.
+
+    Returns:
+        Probe results by variant name (see run_probe)
+    """
+    from shared.orchestrator import EXPERIMENTS, Variant, wait_healthy
+
+    experiment = EXPERIMENTS["chunked_prefill"]
+    variants = experiment.variants if backend is not None else [Variant("running", "")]
+    print("=" * 70)
+    print("Chunked Prefill Benchmark - Decode Interference Probe")
+    print("=" * 70)
+
+    async def probe() -> dict | None:
+        async with AsyncVLLMClient(base_url=url) as client:
+            await client.complete("Hello", max_tokens=5)
+            counter = get_token_counter(client.model, client.base_url)
+            return await run_probe(client, counter, **probe_args)
+
+    results = {}
+    for variant in variants:
+        print(f"\n--- {variant.name} ---")
+        if backend is not None:
+            backend.up(experiment, variant)
+        try:
+            if wait_healthy(url) is None:
+                print("  ERROR: server not healthy, skipping variant")
+                continue
+            result = asyncio.run(probe())
+            if result is not None:
+                results[variant.name] = result
+        finally:
+            if backend is not None:
+                backend.down(experiment, variant)
+
+    print("\n" + "=" * 70)
+    print("Results (stall = longest canary gap during the prefill minus its usual gap)")
+    print("=" * 70)
+    print(f"\n  {'Variant':<10} {'Canary ITL':>11} {'Stall mean':>11} {'Stall max':>10} {'Per 1k tok':>11} {'Slope':>9}")
+    for name, r in results.items():
+        cells = [
+            f"{r[k]:>9.1f}ms" if r[k] is not None else f"{'-':>11}"
+            for k in ("canary_itl_ms", "stall_mean_ms", "stall_max_ms", "stall_per_1k_tokens_ms")
+        ]
+        slope = r["stall_slope_ms_per_1k_tokens"]
+        slope_cell = f"{slope:>7.1f}ms" if slope is not None else f"{'-':>9}"
+        print(f"  {name:<10} {' '.join(cells)} {slope_cell}")
+    print("\n  Per 1k tok: total stall / total injected prefill tokens x 1000")
+    print("  Slope: stall growth per 1k extra prompt tokens (least squares); near zero with")
+    print("         chunking, since a canary waits for one chunk rather than the whole prompt")
+    print("\n" + "=" * 70)
+    return results
+
+
+def _sweep_backend(args):
+    """Server backend for --sweep / --probe (None = use the running server)."""
+    if args.backend == "compose":
+        from shared.orchestrator import ComposeBackend
+
+        return ComposeBackend()
+    if args.backend == "stub":
+        from shared.orchestrator import StubBackend
+
+        return StubBackend(port=urlparse(args.url).port or 8000, seed=args.seed or 0)
+    return None
+
+
 def main():
     parser = argparse.ArgumentParser(description="Chunked Prefill Benchmark")
     parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
     parser.add_argument("--short", type=int, default=10, help="Number of short prompts")
     parser.add_argument("--long", type=int, default=3, help="Number of long prompts")
     parser.add_argument("--max-tokens", type=int, default=10, help="Max tokens per response")
+    parser.add_argument(
+        "--concurrency", type=int, default=8, help="Max requests in flight (0 = all at once)"
+    )
+    parser.add_argument(
+        "--arrival",
+        choices=ARRIVAL_KINDS,
+        help="Send open-loop on this arrival schedule instead of one burst",
+    )
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrival rate in req/s")
+    parser.add_argument("--burst-size", type=int, default=5, help="Requests per burst (bursty)")
+    parser.add_argument("--trace", help="JSONL file with 'timestamp' fields (trace)")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for random arrivals")
+    parser.add_argument(
+        "--sample-interval", type=float, default=0.5, help="Server metrics polling interval (s)"
+    )
+    parser.add_argument(
+        "--compose-file", default="docker-compose.yml", help="Compose file of the server (recorded with the run)"
+    )
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
+    sweep = parser.add_argument_group("sweep (--sweep) and probe (--probe)")
+    sweep.add_argument("--sweep", action="store_true", help="Sweep batched-token budgets and workload mixes")
+    sweep.add_argument(
+        "--budgets", type=int, nargs="+", default=[256, 512, 1024, 2048], help="--max-num-batched-tokens values"
+    )
+    sweep.add_argument("--long-ratios", type=float, nargs="+", default=[0.1, 0.3], help="Fractions of long prompts")
+    sweep.add_argument("--long-tokens", type=int, nargs="+", default=[1000, 3000], help="Long prompt lengths (tokens)")
+    sweep.add_argument("--rates", type=float, nargs="+", default=[10.0], help="Poisson arrival rates (req/s)")
+    sweep.add_argument("--requests", type=int, default=60, help="Requests per sweep point")
+    sweep.add_argument(
+        "--capacity-concurrency",
+        type=int,
+        default=16,
+        help="Requests in flight for the closed-loop capacity run (the server's --max-num-seqs)",
+    )
+    sweep.add_argument(
+        "--backend",
+        choices=["compose", "stub", "running"],
+        default="compose",
+        help="How to restart the server per budget / variant ('running': use the server as is)",
+    )
+    sweep.add_argument("--latency-metric", choices=SWEEP_LATENCY_KEYS, default="short_ttft_p99_ms")
+    sweep.add_argument("--slo-ms", type=float, help="Latency target for the budget recommendation")
+    probe = parser.add_argument_group("probe (--probe)")
+    probe.add_argument("--probe", action="store_true", help="Measure decode stalls caused by long prefills")
+    probe.add_argument("--canaries", type=int, default=4, help="Streaming decodes kept open")
+    probe.add_argument(
+        "--inject-tokens", type=int, nargs="+", default=[1000, 2000, 3000], help="Injected prompt lengths (cycled)"
+    )
+    probe.add_argument("--injections", type=int, default=6, help="Long prompts to inject")
+    probe.add_argument("--inject-interval", type=float, default=1.0, help="Seconds between injections")
     args = parser.parse_args()
 
-    client = VLLMClient(base_url=args.url)
-    run_benchmark(client, num_short=args.short, num_long=args.long, max_tokens=args.max_tokens)
+    if args.probe:
+        results = run_probe_comparison(
+            args.url,
+            _sweep_backend(args),
+            num_canaries=args.canaries,
+            long_tokens=args.inject_tokens,
+            injections=args.injections,
+            interval_s=args.inject_interval,
+        )
+        if not args.no_save and results:
+            record_run("chunked_prefill", "probe", vars(args), results, args.url, args.compose_file)
+        return
+
+    if args.sweep:
+        if args.backend == "running" and len(args.budgets) > 1:
+            print(f"Using the running server for budget {args.budgets[0]} only")
+            args.budgets = args.budgets[:1]
+        results = run_sweep(
+            args.url,
+            _sweep_backend(args),
+            args.budgets,
+            args.long_ratios,
+            args.long_tokens,
+            args.rates,
+            num_requests=args.requests,
+            max_tokens=args.max_tokens,
+            latency_key=args.latency_metric,
+            slo_ms=args.slo_ms,
+            capacity_concurrency=args.capacity_concurrency,
+            seed=args.seed or 0,
+        )
+        if not args.no_save and results:
+            points = {
+                f"b{p['budget']}_long{p['long_ratio']:g}x{p['long_tokens']}_r{p['rate']:g}": p for p in results
+            }
+            record_run("chunked_prefill", "sweep", vars(args), points, args.url, args.compose_file)
+        return
+
+    results = asyncio.run(_run(args))
+    if not args.no_save:
+        mode = args.arrival or "burst"
+        record_run("chunked_prefill", mode, vars(args), results, args.url, args.compose_file)
+
+
+async def _run(args):
+    schedule = None
+    if args.arrival:
+        schedule = make_schedule(
+            args.arrival,
+            count=args.short + args.long,
+            rate=args.rate,
+            burst_size=args.burst_size,
+            trace_path=args.trace,
+            seed=args.seed,
+        )
+
+    async with AsyncVLLMClient(base_url=args.url) as client:
+        return await run_benchmark(
+            client,
+            num_short=args.short,
+            num_long=args.long,
+            max_tokens=args.max_tokens,
+            max_concurrency=args.concurrency or None,
+            schedule=schedule,
+            sample_interval=args.sample_interval,
+        )
 
 
 if __name__ == "__main__":
@@ -5,7 +5,12 @@ Used to test chunked prefill fairness by simulating a mixed workload
 where short prompts shouldn't be blocked by long ones.
 """
 
+import math
 import random
+import sys
+
+sys.path.insert(0, "../..")
+from shared.tokens import get_token_counter
 
 
 # Base text to repeat for creating long prompts
@@ -25,12 +30,15 @@ QUESTIONS = [
 ]
 
 
-def generate_prompt(length: str = "short") -> str:
+def generate_prompt(length: str = "short", long_repeats: int = 15) -> str:
     """
     Generate a prompt of specified length.
 
     Args:
-        length: "short" (~50 tokens), "medium" (~500 tokens), "long" (~2000 tokens)
+        length: "short", "medium" or "long" (roughly 15, 200 and 1000 tokens;
+            run this module for exact counts with the served tokenizer)
+        long_repeats: Filler paragraphs in a long prompt (~70 tokens each,
+            see filler_repeats_for)
 
     Returns:
         The generated prompt string
@@ -38,28 +46,32 @@ def generate_prompt(length: str = "short") -> str:
     question = random.choice(QUESTIONS)
 
     if length == "short":
-        # ~50 tokens
         return f"Answer briefly: {question}\nAnswer:"
 
     elif length == "medium":
-        # ~500 tokens
         padding = (FILLER_TEXT * 3).strip()
         return f"Context: {padding}\n\nQuestion: {question}\nAnswer:"
 
     elif length == "long":
-        # ~2000 tokens
-        padding = (FILLER_TEXT * 15).strip()
+        padding = (FILLER_TEXT * long_repeats).strip()
         return f"Context: {padding}\n\nQuestion: {question}\nAnswer:"
 
     else:
         raise ValueError(f"Unknown length: {length}")
 
 
+def filler_repeats_for(target_tokens: int, counter=None) -> int:
+    """Filler paragraphs needed for a long prompt of about `target_tokens` tokens."""
+    counter = counter or get_token_counter()
+    return max(1, math.ceil(target_tokens / counter.count(FILLER_TEXT)))
+
+
 def generate_mixed_workload(
     num_short: int = 10,
     num_medium: int = 5,
     num_long: int = 2,
     shuffle: bool = True,
+    long_repeats: int = 15,
 ) -> list[dict]:
     """
     Generate a mixed workload of prompts.
@@ -69,6 +81,7 @@ def generate_mixed_workload(
         num_medium: Number of medium prompts
         num_long: Number of long prompts
         shuffle: Whether to randomize order
+        long_repeats: Filler paragraphs per long prompt (see generate_prompt)
 
     Returns:
         List of dicts with 'prompt', 'length', and 'id' keys
@@ -93,7 +106,7 @@ def generate_mixed_workload(
         workload.append({
             "id": f"long-{i+1}",
             "length": "long",
-            "prompt": generate_prompt("long"),
+            "prompt": generate_prompt("long", long_repeats),
         })
 
     if shuffle:
@@ -103,22 +116,29 @@ def generate_mixed_workload(
 
 
 def estimate_tokens(text: str) -> int:
-    """Rough estimate of token count (1 token ≈ 4 chars)."""
-    return len(text) // 4
+    """
+    Token count of text with the served model's tokenizer.
+
+    Falls back to 1 token per 4 characters when no tokenizer is available
+    (see shared/tokens.py).
+    """
+    return get_token_counter().count(text)
 
 
 if __name__ == "__main__":
     print("=== Prompt Length Examples ===\n")
 
+    counter = get_token_counter()
+    print(f"Tokenizer: {counter.backend} ({counter.model})\n")
     for length in ["short", "medium", "long"]:
         prompt = generate_prompt(length)
-        tokens = estimate_tokens(prompt)
-        print(f"{length.upper()}: ~{tokens} tokens, {len(prompt)} chars")
+        tokens = counter.count(prompt)
+        print(f"{length.upper()}: {tokens} tokens, {len(prompt)} chars")
         print(f"  Preview: {prompt[:80]}...")
         print()
 
     print("\n=== Mixed Workload Example ===\n")
     workload = generate_mixed_workload(num_short=3, num_medium=2, num_long=1)
-    for item in workload:
-        tokens = estimate_tokens(item["prompt"])
-        print(f"  {item['id']}: ~{tokens} tokens")
\ No newline at end of file
+    counts = counter.count_batch([item["prompt"] for item in workload])
+    for item, tokens in zip(workload, counts):
+        print(f"  {item['id']}: {tokens} tokens")
\ No newline at end of file
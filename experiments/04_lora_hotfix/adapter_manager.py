@@ -0,0 +1,294 @@
+"""
+LoRA Adapter Manager - Keeps the adapters a server has loaded within its slots.
+
+A vLLM server started with --max-loras=N can batch at most N adapters, so
+serving more tenants than that means loading and unloading adapters as
+requests arrive. The manager:
+1. Knows every tenant's adapter path and which adapters the server has loaded
+2. Loads a missing adapter when a request needs it, unloading the least
+   recently (LRU) or least frequently (LFU) used idle adapter to make room
+3. Never unloads an adapter that has requests in flight
+4. Shares one load between all concurrent requests for the same adapter
+
+Requests go through acquire()/release() (or use()), so they are routed to
+the adapter by name and only cause a load on a miss.
+
+    python adapter_manager.py --list
+    python adapter_manager.py --load my-adapter /adapters/my-adapter
+    python adapter_manager.py --load my-adapter /adapters/my-adapter-v2 --inplace
+    python adapter_manager.py --unload my-adapter
+    python adapter_manager.py --simulate --tenants 12 --max-loras 4   # LRU vs LFU churn, fake server
+"""
+
+import argparse
+import asyncio
+import random
+import sys
+import time
+from dataclasses import dataclass
+
+# Add project root to path for shared imports
+sys.path.insert(0, "../..")
+from shared import AsyncVLLMClient
+from shared.residency import Resident, ResidencyManager, ResidentState
+
+POLICIES = ("lru", "lfu")
+
+
+@dataclass(kw_only=True)
+class AdapterSlot(Resident):
+    """One adapter; each takes one of the server's --max-loras slots."""
+
+    path: str
+
+
+class AdapterManager(ResidencyManager):
+    """
+    Adapter cache over a server's LoRA slots.
+
+    A miss loads the adapter from its registered path after unloading an
+    idle one if all slots are taken (see shared/residency.py); `policy`
+    picks that victim by recency (LRU) or by request count (LFU).
+    """
+
+    def __init__(
+        self,
+        client: AsyncVLLMClient,
+        max_loras: int = 4,
+        policy: str = "lru",
+        queue_timeout_s: float = 120.0,
+    ):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {POLICIES}")
+        super().__init__(capacity=max_loras, queue_timeout_s=queue_timeout_s)
+        self.client = client
+        self.policy = policy
+        self.adapters: dict[str, AdapterSlot] = self.residents
+
+    @property
+    def max_loras(self) -> int:
+        return self.capacity
+
+    def register(self, name: str, path: str) -> None:
+        """Make adapter `name` (at `path` as the server sees it) available to requests."""
+        if name in self.adapters:
+            self.adapters[name].path = path
+        else:
+            self.adapters[name] = AdapterSlot(name=name, path=path)
+
+    async def start(self) -> None:
+        """Read which adapters the server has loaded, then unload extras beyond max_loras."""
+        loaded = await self.client.list_lora_adapters()
+        for name, path in loaded.items():
+            if name not in self.adapters:
+                self.register(name, path)
+            self.adapters[name].state = ResidentState.LOADED
+        await self.evict_to_capacity()
+
+    def _eviction_order(self, slot: AdapterSlot) -> tuple:
+        if self.policy == "lfu":
+            return (slot.uses, slot.last_used)
+        return (slot.last_used,)
+
+    async def _load(self, slot: AdapterSlot) -> bool:
+        if await self.client.load_lora_adapter(slot.name, slot.path):
+            return True
+        # Someone else may have loaded it behind our back (vLLM answers 400)
+        return slot.name in await self.client.list_lora_adapters()
+
+    async def _unload(self, slot: AdapterSlot) -> bool:
+        return await self.client.unload_lora_adapter(slot.name)
+
+    def _load_failed(self, slot: AdapterSlot) -> Exception:
+        return RuntimeError(f"Failed to load adapter {slot.name} from {slot.path}")
+
+    def _timed_out(self, slot: AdapterSlot) -> Exception:
+        return TimeoutError(f"Timed out waiting for a LoRA slot for {slot.name}")
+
+    async def complete(self, name: str, prompt: str, max_tokens: int = 100, **kwargs) -> str:
+        """Complete `prompt` with adapter `name`, loading it first if needed."""
+        async with self.use(name):
+            return await self.client.complete(prompt, max_tokens=max_tokens, model=name, **kwargs)
+
+    async def complete_stream(self, name: str, prompt: str, max_tokens: int = 100, **kwargs):
+        """Stream a completion with adapter `name`; the adapter stays loaded until the stream ends."""
+        async with self.use(name):
+            async for token in self.client.complete_stream(prompt, max_tokens=max_tokens, model=name, **kwargs):
+                yield token
+
+    async def replace(self, name: str, path: str) -> bool:
+        """
+        Point adapter `name` at new weights (a hotfix).
+
+        A loaded adapter is replaced in place, so requests keep using the
+        name without an unload; an unloaded one picks the path up on its
+        next load. A load or unload in progress is waited for first, since
+        it may have sent the old path. The adapter is pinned while its
+        weights are replaced so it cannot be unloaded halfway.
+        """
+        self.register(name, path)
+        slot = self.adapters[name]
+        async with self._changed:
+            await asyncio.wait_for(
+                self._changed.wait_for(lambda: slot.state in (ResidentState.LOADED, ResidentState.UNLOADED)),
+                self.queue_timeout_s,
+            )
+            if slot.state is ResidentState.UNLOADED:
+                return True
+            slot.in_flight += 1
+        try:
+            return await self.client.load_lora_adapter(name, path, load_inplace=True)
+        finally:
+            await self.release(slot)
+
+    def status(self) -> dict:
+        """Residency and per-adapter counters."""
+        return {
+            "max_loras": self.max_loras,
+            "policy": self.policy,
+            "loaded": sorted(s.name for s in self.adapters.values() if s.state is ResidentState.LOADED),
+            "adapters": {
+                s.name: {"state": s.state.value, "in_flight": s.in_flight, "uses": s.uses, **s.stats}
+                for s in self.adapters.values()
+            },
+        }
+
+    def totals(self) -> dict:
+        """Counters summed over all adapters."""
+        totals = {"requests": 0, "hits": 0, "loads": 0, "unloads": 0, "queued": 0, "load_ms": 0.0}
+        for slot in self.adapters.values():
+            for key in totals:
+                totals[key] += slot.stats[key]
+        return totals
+
+
+def zipf_trace(num_tenants: int, num_requests: int, skew: float = 1.1, seed: int = 42) -> list[str]:
+    """
+    Tenant names for a request stream where tenant k gets traffic ~ 1/k^skew.
+
+    Args:
+        num_tenants: Number of distinct adapters
+        num_requests: Length of the trace
+        skew: Zipf exponent; 0 is uniform, larger concentrates on few tenants
+        seed: Random seed
+
+    Returns:
+        Adapter names ("tenant-0" ... ), one per request
+    """
+    rng = random.Random(seed)
+    weights = [1 / (k + 1) ** skew for k in range(num_tenants)]
+    return rng.choices([f"tenant-{k}" for k in range(num_tenants)], weights=weights, k=num_requests)
+
+
+async def replay(
+    manager: AdapterManager, trace: list[str], concurrency: int = 8, max_tokens: int = 8
+) -> float:
+    """
+    Send one short completion per trace entry through the manager.
+
+    Returns:
+        Wall-clock seconds for the whole trace
+    """
+    queue = asyncio.Queue()
+    for name in trace:
+        queue.put_nowait(name)
+
+    async def worker():
+        while not queue.empty():
+            name = queue.get_nowait()
+            await manager.complete(name, f"Request for {name}.", max_tokens=max_tokens)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start
+
+
+def simulate(args) -> None:
+    """Replay a Zipf tenant trace against the fake server with each eviction policy."""
+    from shared.fake_vllm import FakeVLLM, FakeVLLMConfig
+
+    trace = zipf_trace(args.tenants, args.requests, args.skew, args.seed)
+    print("=" * 70)
+    print("Adapter Churn Simulation")
+    print("=" * 70)
+    print(
+        f"{args.tenants} tenants, {args.requests} requests (Zipf skew {args.skew}), "
+        f"{args.max_loras} slots, concurrency {args.concurrency}"
+    )
+    print()
+    print(f"  {'Policy':<8} {'Hit rate':>9} {'Loads':>7} {'Unloads':>8} {'Queued':>7} {'Load ms':>8} {'Wall s':>7}")
+    for policy in POLICIES:
+        config = FakeVLLMConfig(max_loras=args.max_loras, lora_load_ms=args.load_ms, seed=args.seed)
+        with FakeVLLM(config, port=args.fake_port) as server:
+
+            async def run() -> tuple[dict, float]:
+                async with AsyncVLLMClient(base_url=server.url) as client:
+                    manager = AdapterManager(client, max_loras=args.max_loras, policy=policy)
+                    for k in range(args.tenants):
+                        manager.register(f"tenant-{k}", f"/adapters/tenant-{k}")
+                    await manager.start()
+                    elapsed = await replay(manager, trace, args.concurrency)
+                    await manager.close()
+                    return manager.totals(), elapsed
+
+            totals, elapsed = asyncio.run(run())
+        hit_rate = totals["hits"] / max(totals["requests"], 1)
+        print(
+            f"  {policy:<8} {hit_rate:>8.1%} {totals['loads']:>7} {totals['unloads']:>8} "
+            f"{totals['queued']:>7} {totals['load_ms']:>8.0f} {elapsed:>7.2f}"
+        )
+    print()
+    print("  Queued: requests that waited for a load (including ones sharing another's load)")
+    print("=" * 70)
+
+
+async def run_command(args) -> int:
+    async with AsyncVLLMClient(base_url=args.url) as client:
+        if args.load:
+            name, path = args.load
+            ok = await client.load_lora_adapter(name, path, load_inplace=args.inplace)
+            print(f"{'Loaded' if ok else 'Failed to load'} {name} from {path}{' (in place)' if args.inplace else ''}")
+            if not ok:
+                return 1
+        if args.unload:
+            ok = await client.unload_lora_adapter(args.unload)
+            print(f"{'Unloaded' if ok else 'Failed to unload'} {args.unload}")
+            if not ok:
+                return 1
+        if args.list or not (args.load or args.unload):
+            adapters = await client.list_lora_adapters()
+            models = await client.list_models()
+            base = [m for m in models if m not in adapters]
+            print(f"Base model: {', '.join(base)}")
+            print(f"LoRA adapters ({len(adapters)}):")
+            for name, path in sorted(adapters.items()):
+                print(f"  {name:<30} {path}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage LoRA adapters on a vLLM server")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
+    parser.add_argument("--list", action="store_true", help="List loaded adapters (default)")
+    parser.add_argument("--load", nargs=2, metavar=("NAME", "PATH"), help="Load an adapter")
+    parser.add_argument("--inplace", action="store_true", help="With --load: replace a loaded adapter's weights")
+    parser.add_argument("--unload", metavar="NAME", help="Unload an adapter")
+    parser.add_argument("--simulate", action="store_true", help="Compare LRU and LFU churn on a fake server")
+    parser.add_argument("--tenants", type=int, default=12, help="Simulation: number of adapters")
+    parser.add_argument("--requests", type=int, default=1000, help="Simulation: trace length")
+    parser.add_argument("--skew", type=float, default=1.1, help="Simulation: Zipf exponent of tenant traffic")
+    parser.add_argument("--concurrency", type=int, default=8, help="Simulation: requests in flight")
+    parser.add_argument("--max-loras", type=int, default=4, help="Simulation: server LoRA slots")
+    parser.add_argument("--load-ms", type=float, default=50.0, help="Simulation: adapter load latency")
+    parser.add_argument("--fake-port", type=int, default=8099, help="Simulation: fake server port")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    if args.simulate:
+        simulate(args)
+        return
+    sys.exit(asyncio.run(run_command(args)))
+
+
+if __name__ == "__main__":
+    main()
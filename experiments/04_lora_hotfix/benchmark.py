@@ -0,0 +1,252 @@
+"""
+LoRA Benchmark - Multi-tenant throughput with and without adapter affinity.
+
+Every tenant has its own LoRA adapter, and requests arrive interleaved
+across tenants (Poisson arrivals, Zipf-skewed tenant mix). The same
+arrival schedule is replayed through AffinityDispatcher twice:
+- off: requests are sent in arrival order, up to --max-in-flight at once
+- on:  requests are grouped by adapter, at most --max-loras adapters in
+       flight, with a --max-delay bound per request
+
+For a growing number of tenants it reports aggregate output tokens/s and
+per-tenant latency (arrival to last token, including time held in the
+dispatcher), so you can see where interleaving starts to thrash the
+server's adapter slots and how much grouping recovers.
+
+    python benchmark.py                          # server from `make exp4-up`
+    python benchmark.py --fake                   # in-process fake vLLM, no GPU
+    python benchmark.py --tenants 2 4 8 16 32 --rate 60 --requests 400
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+# Add project root to path for shared imports
+sys.path.insert(0, "../..")
+from shared import AsyncVLLMClient
+from shared.fake_vllm import fake_server
+from shared.histogram import histogram_of
+from shared.load_generator import poisson_schedule, run_open_loop
+from shared.results import record_run
+
+from adapter_manager import zipf_trace
+from affinity_dispatcher import AffinityDispatcher
+
+MODES = (("off", False), ("on", True))
+
+
+async def run_trial(
+    client: AsyncVLLMClient,
+    dispatcher: AffinityDispatcher,
+    trace: list[str],
+    schedule: list[float],
+    max_tokens: int,
+) -> dict:
+    """
+    Replay one arrival schedule through `dispatcher`.
+
+    Args:
+        client: Client for the server
+        dispatcher: Decides when each request is sent
+        trace: Adapter name per request
+        schedule: Arrival offsets in seconds, one per request
+        max_tokens: Tokens generated per request
+
+    Returns:
+        Dict with tokens_per_s, latency summaries (overall and per tenant),
+        dispatcher wait and counters, and raw samples
+    """
+
+    async def send(i: int) -> tuple[int, float]:
+        adapter = trace[i]
+        wait_s = await dispatcher.acquire(adapter)
+        try:
+            tokens = 0
+            async for _ in client.complete_stream(
+                f"[{adapter}] Request {i}: summarize the ticket.", max_tokens=max_tokens, model=adapter
+            ):
+                tokens += 1
+            return tokens, wait_s
+        finally:
+            dispatcher.release(adapter)
+
+    records = await run_open_loop(schedule, send)
+    ok = [r for r in records if r.error is None]
+    errors = [r.error for r in records if r.error is not None]
+    if errors:
+        print(f"    {len(errors)} errors, first: {errors[0]}")
+    if not ok:
+        return {}
+
+    # Latency from the scheduled arrival: time held in the dispatcher counts
+    latencies = [(r.done_s - r.scheduled_s) * 1000 for r in ok]
+    by_tenant: dict[str, list[float]] = {}
+    for r, latency in zip(ok, latencies):
+        by_tenant.setdefault(trace[r.index], []).append(latency)
+    tenant_p99 = {name: histogram_of(values).percentile(99) for name, values in by_tenant.items()}
+    tenant_p50 = {name: histogram_of(values).percentile(50) for name, values in by_tenant.items()}
+    worst = max(tenant_p99, key=tenant_p99.get)
+    tokens = sum(r.result[0] for r in ok)
+    span = max(r.done_s for r in ok) - min(r.sent_s for r in ok)
+    overall = histogram_of(latencies)
+    waits = [r.result[1] * 1000 for r in ok]
+    return {
+        "requests": len(ok),
+        "errors": len(errors),
+        "tokens_per_s": tokens / span if span > 0 else 0.0,
+        "latency_p50_ms": overall.percentile(50),
+        "latency_p99_ms": overall.percentile(99),
+        "tenant_p50_median_ms": statistics.median(tenant_p50.values()),
+        "worst_tenant_p99_ms": tenant_p99[worst],
+        "worst_tenant": worst,
+        "dispatch_wait_max_ms": max(waits),
+        "adapter_switches": dispatcher.stats["switches"],
+        "forced_switches": dispatcher.stats["forced"],
+        "samples": {"latency_ms": latencies},
+    }
+
+
+async def setup_adapters(client: AsyncVLLMClient, names: list[str], adapter_path: str) -> None:
+    """Load every tenant's adapter (all pointing at `adapter_path`) if the server lacks it."""
+    loaded = await client.list_lora_adapters()
+    for name in names:
+        if name not in loaded and not await client.load_lora_adapter(name, adapter_path):
+            raise RuntimeError(f"Could not load adapter {name} from {adapter_path}")
+
+
+async def run_benchmark(
+    url: str,
+    tenant_counts: list[int],
+    num_requests: int = 300,
+    rate: float = 40.0,
+    max_tokens: int = 64,
+    max_loras: int = 4,
+    max_in_flight: int = 16,
+    max_delay_s: float = 2.0,
+    skew: float = 0.8,
+    adapter_path: str = "/adapters/sft-lora",
+    seed: int = 42,
+) -> dict:
+    """
+    Compare dispatch without and with adapter affinity as the tenant count grows.
+
+    Args:
+        url: vLLM server URL
+        tenant_counts: Numbers of tenants (adapters) to test
+        num_requests: Requests per trial
+        rate: Mean arrival rate (requests/s)
+        max_tokens: Tokens generated per request
+        max_loras: Server's --max-loras, the adapters the dispatcher keeps in flight
+        max_in_flight: Requests outstanding at once (the server's --max-num-seqs)
+        max_delay_s: Affinity: longest a request is held before its adapter is forced in
+        skew: Zipf exponent of the tenant mix (0 = uniform)
+        adapter_path: Adapter loaded under every tenant's name
+        seed: Random seed for arrivals and tenant mix
+
+    Returns:
+        Dict keyed by "tenants_N", each with "off" and "on" trial results
+    """
+    print("=" * 70)
+    print("LoRA Benchmark - Adapter-Affinity Dispatch")
+    print("=" * 70)
+    print(
+        f"{num_requests} requests at {rate:g}/s (Poisson), {max_tokens} tokens each, "
+        f"max_loras={max_loras}, max_in_flight={max_in_flight}, max_delay={max_delay_s:g}s"
+    )
+
+    schedule = poisson_schedule(rate, num_requests, seed)
+    results = {}
+    async with AsyncVLLMClient(base_url=url) as client:
+        for i, tenants in enumerate(tenant_counts):
+            trace = zipf_trace(tenants, num_requests, skew, seed)
+            await setup_adapters(client, sorted(set(trace)), adapter_path)
+            print(f"\n--- {tenants} tenants ---")
+            results[f"tenants_{tenants}"] = {}
+            # Alternate which mode runs first, so neither always inherits the other's warm adapter slots
+            for mode, affinity in MODES if i % 2 == 0 else MODES[::-1]:
+                dispatcher = AffinityDispatcher(max_loras, max_in_flight, max_delay_s, affinity=affinity)
+                start = time.perf_counter()
+                trial = await run_trial(client, dispatcher, trace, schedule, max_tokens)
+                if not trial:
+                    continue
+                results[f"tenants_{tenants}"][mode] = trial
+                print(
+                    f"  affinity {mode:<3}: {trial['tokens_per_s']:7.0f} tok/s, "
+                    f"p50 {trial['latency_p50_ms']:6.0f}ms, p99 {trial['latency_p99_ms']:6.0f}ms, "
+                    f"worst tenant p99 {trial['worst_tenant_p99_ms']:6.0f}ms "
+                    f"({time.perf_counter() - start:.1f}s)"
+                )
+
+    print()
+    print("=" * 70)
+    print("Results (latency = arrival to last token, per tenant over its requests)")
+    print("=" * 70)
+    print()
+    print(
+        f"  {'Tenants':>7}  {'Affinity':<8} {'Tok/s':>7} {'Median tenant p50':>18} "
+        f"{'Worst tenant p99':>17} {'Max hold':>9} {'Switches':>9}"
+    )
+    for key, modes in results.items():
+        tenants = key.split("_")[1]
+        for mode, trial in ((mode, modes[mode]) for mode, _ in MODES if mode in modes):
+            print(
+                f"  {tenants:>7}  {mode:<8} {trial['tokens_per_s']:>7.0f} {trial['tenant_p50_median_ms']:>16.0f}ms "
+                f"{trial['worst_tenant_p99_ms']:>15.0f}ms {trial['dispatch_wait_max_ms']:>7.0f}ms "
+                f"{trial['adapter_switches']:>9}"
+            )
+        if len(modes) == 2 and modes["off"]["tokens_per_s"]:
+            gain = modes["on"]["tokens_per_s"] / modes["off"]["tokens_per_s"]
+            print(f"  {'':>7}  {'on / off':<8} {gain:>6.2f}x")
+    print()
+    print("  Max hold: longest a request waited in the dispatcher before being sent")
+    print("  Switches: times an adapter entered the in-flight set")
+    print("=" * 70)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoRA Benchmark - Adapter-Affinity Dispatch")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
+    parser.add_argument("--tenants", type=int, nargs="+", default=[2, 4, 8, 16], help="Tenant counts to test")
+    parser.add_argument("--requests", type=int, default=300, help="Requests per trial")
+    parser.add_argument("--rate", type=float, default=40.0, help="Mean arrival rate (requests/s)")
+    parser.add_argument("--max-tokens", type=int, default=64, help="Tokens per request")
+    parser.add_argument("--max-loras", type=int, default=4, help="Server --max-loras")
+    parser.add_argument("--max-in-flight", type=int, default=16, help="Requests outstanding (server --max-num-seqs)")
+    parser.add_argument("--max-delay", type=float, default=2.0, help="Affinity: max hold per request (s)")
+    parser.add_argument("--skew", type=float, default=0.8, help="Zipf exponent of the tenant mix (0 = uniform)")
+    parser.add_argument(
+        "--adapter-path", default="/adapters/sft-lora", help="Adapter loaded under every tenant's name"
+    )
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument(
+        "--fake", action="store_true", help="Run against an in-process fake vLLM at --url (matching the compose flags)"
+    )
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
+    args = parser.parse_args()
+
+    with fake_server(args.url, args.fake, max_num_seqs=16, max_loras=args.max_loras, seed=args.seed):
+        results = asyncio.run(
+            run_benchmark(
+                args.url,
+                args.tenants,
+                num_requests=args.requests,
+                rate=args.rate,
+                max_tokens=args.max_tokens,
+                max_loras=args.max_loras,
+                max_in_flight=args.max_in_flight,
+                max_delay_s=args.max_delay,
+                skew=args.skew,
+                adapter_path=args.adapter_path,
+                seed=args.seed,
+            )
+        )
+    if not args.no_save and not args.fake:
+        record_run("lora_hotfix", "affinity", vars(args), results, args.url, "docker-compose.yml")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+LoRA Hotfix Harness - Replace an adapter in place while streams are using it.
+
+Keeps --streams streaming completions open on one adapter (each restarted
+when it finishes), then hot-swaps the adapter's weights with
+`load_inplace` every --swap-interval seconds, alternating between the
+given paths. Right after each swap a fresh request checks that the
+adapter still serves. Then reports:
+- stream errors, in total and for streams that were open during a swap
+- swap latency (the load_inplace call)
+- the longest inter-token gap of a stream during a swap vs the
+  streams' median gap, i.e. how much a swap stalls running requests
+- TTFT of the request sent right after each swap
+
+A hotfix passes if no stream failed, every swap returned 200 and every
+post-swap request was served.
+
+Usage:
+    python hotfix_harness.py --adapter sft --paths /adapters/sft-lora /adapters/sft-lora-v2
+    python hotfix_harness.py --fake
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+
+sys.path.insert(0, "../..")
+from shared import AsyncVLLMClient, StreamTimeline
+from shared.fake_vllm import fake_server
+from shared.histogram import histogram_of, print_latency_summary
+from shared.results import record_run
+
+PROMPT = "Write a detailed incident report about a failed deployment, section by section:"
+
+
+def _overlaps(timeline: StreamTimeline, windows: list[tuple[float, float]]) -> bool:
+    return any(timeline.start < end and timeline.end > start for start, end in windows)
+
+
+def _max_gap_during(timeline: StreamTimeline, windows: list[tuple[float, float]]) -> float | None:
+    """Longest inter-token gap (ms) of `timeline` that overlaps any window."""
+    s = timeline.stamps
+    gaps = [
+        (s[i] - s[i - 1]) * 1000
+        for i in range(1, len(s))
+        if any(s[i - 1] < end and s[i] > start for start, end in windows)
+    ]
+    return max(gaps) if gaps else None
+
+
+async def run_hotfix(
+    url: str,
+    adapter: str,
+    paths: list[str],
+    streams: int = 8,
+    max_tokens: int = 128,
+    swaps: int = 4,
+    interval_s: float = 1.0,
+) -> dict | None:
+    """
+    Hot-swap `adapter` between `paths` while streams are using it.
+
+    Args:
+        url: vLLM server URL
+        adapter: Adapter name the streams use as `model`
+        paths: Adapter paths as seen by the server; the adapter starts on
+            paths[0] and swap k loads paths[(k + 1) % len(paths)]
+        streams: Streams kept open on the adapter
+        max_tokens: Tokens requested per stream
+        swaps: In-place replacements to make
+        interval_s: Seconds before the first swap and between swaps
+
+    Returns:
+        Dict with stream/swap counts and errors, swap latency, stalls and
+        post-swap TTFT; None if the server or adapter was not usable
+    """
+    print("=" * 70)
+    print("LoRA Hotfix Harness - In-Place Adapter Swap Under Load")
+    print("=" * 70)
+    print(f"Adapter {adapter}: {' -> '.join(paths)}, {swaps} swaps {interval_s:g}s apart, {streams} streams")
+
+    async with AsyncVLLMClient(base_url=url) as client:
+        if not await client.health_check():
+            print("ERROR: Server not healthy")
+            return None
+        loaded = await client.list_lora_adapters()
+        if not await client.load_lora_adapter(adapter, paths[0], load_inplace=adapter in loaded):
+            print(f"ERROR: could not load {adapter} from {paths[0]}")
+            return None
+
+        stop = asyncio.Event()
+        finished: list[tuple[StreamTimeline, int]] = []
+        errors: list[tuple[StreamTimeline, str]] = []
+
+        async def stream_loop() -> None:
+            while not stop.is_set():
+                timeline = StreamTimeline()
+                tokens = 0
+                try:
+                    async for _ in client.complete_stream(
+                        PROMPT, max_tokens=max_tokens, model=adapter, timeline=timeline
+                    ):
+                        tokens += 1
+                except Exception as e:
+                    timeline.finish()
+                    errors.append((timeline, f"{type(e).__name__}: {e}"))
+                    continue
+                finished.append((timeline, tokens))
+
+        tasks = [asyncio.create_task(stream_loop()) for _ in range(streams)]
+        await asyncio.sleep(interval_s)
+
+        swap_rows = []
+        for k in range(swaps):
+            path = paths[(k + 1) % len(paths)]
+            start = time.perf_counter()
+            ok = await client.load_lora_adapter(adapter, path, load_inplace=True)
+            end = time.perf_counter()
+            probe = StreamTimeline()
+            try:
+                async for _ in client.complete_stream(PROMPT, max_tokens=8, model=adapter, timeline=probe):
+                    pass
+                served = probe.num_chunks > 0
+            except Exception:
+                served = False
+            swap_rows.append(
+                {"path": path, "ok": ok, "start": start, "end": end, "served": served, "ttft_ms": probe.ttft_ms}
+            )
+            status = "ok" if ok else "FAILED"
+            ttft = f"{probe.ttft_ms:.0f}ms" if probe.ttft_ms is not None else "-"
+            print(
+                f"  swap {k + 1} -> {path}: {status} in {(end - start) * 1000:.0f}ms, "
+                f"next request {'served' if served else 'FAILED'} (TTFT {ttft})"
+            )
+            await asyncio.sleep(interval_s)
+
+        # Let the open streams run to completion: a swap must not cut them short
+        stop.set()
+        await asyncio.gather(*tasks)
+
+    windows = [(row["start"], row["end"]) for row in swap_rows]
+    during = [t for t, _ in finished if _overlaps(t, windows)]
+    failed_during = [e for t, e in errors if _overlaps(t, windows)]
+    median_itl = statistics.median([gap for t, _ in finished for gap in t.itls_ms()] or [0.0])
+    stalls = [gap for t in during if (gap := _max_gap_during(t, windows)) is not None]
+    swap_ms = histogram_of((row["end"] - row["start"]) * 1000 for row in swap_rows)
+    post_ttft = histogram_of(row["ttft_ms"] for row in swap_rows if row["ttft_ms"] is not None)
+
+    print()
+    print("=" * 70)
+    print("Results")
+    print("=" * 70)
+    print(f"\nStreams: {len(finished)} completed, {len(errors)} failed")
+    print(f"  Open during a swap: {len(during) + len(failed_during)} ({len(failed_during)} failed)")
+    if errors:
+        print(f"  First error: {errors[0][1]}")
+    print_latency_summary("Swap latency (load_inplace)", swap_ms)
+    print(f"\nMedian inter-token gap: {median_itl:.1f}ms")
+    if stalls:
+        print(f"Longest gap during a swap: {max(stalls):.1f}ms (median over streams {statistics.median(stalls):.1f}ms)")
+    if post_ttft.count:
+        print_latency_summary("TTFT right after a swap", post_ttft)
+
+    swaps_failed = sum(not row["ok"] for row in swap_rows)
+    unserved = sum(not row["served"] for row in swap_rows)
+    passed = not errors and not swaps_failed and not unserved
+    print("\n" + "=" * 70)
+    if passed:
+        print("OK: every stream completed and the adapter served after every swap")
+    else:
+        print(
+            f"FAIL: {len(errors)} stream errors, {swaps_failed} failed swaps, "
+            f"{unserved} swaps not followed by a served request"
+        )
+
+    return {
+        "passed": passed,
+        "streams_completed": len(finished),
+        "stream_errors": len(errors),
+        "streams_during_swap": len(during) + len(failed_during),
+        "stream_errors_during_swap": len(failed_during),
+        "swaps": len(swap_rows),
+        "swaps_failed": swaps_failed,
+        "swaps_unserved": unserved,
+        "swap_p50_ms": swap_ms.percentile(50),
+        "swap_max_ms": swap_ms.max,
+        "itl_median_ms": median_itl,
+        "swap_stall_max_ms": max(stalls) if stalls else None,
+        "post_swap_ttft_p50_ms": post_ttft.percentile(50),
+        "samples": {"swap_ms": [(row["end"] - row["start"]) * 1000 for row in swap_rows], "swap_stall_ms": stalls},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="LoRA Hotfix Harness")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
+    parser.add_argument("--adapter", default="hotfix", help="Adapter name the streams use")
+    parser.add_argument(
+        "--paths", nargs="+", default=["/adapters/sft-lora"], help="Adapter paths to alternate between (server side)"
+    )
+    parser.add_argument("--streams", type=int, default=8, help="Streams kept open on the adapter")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Tokens requested per stream")
+    parser.add_argument("--swaps", type=int, default=4, help="In-place replacements to make")
+    parser.add_argument("--swap-interval", type=float, default=1.0, help="Seconds between swaps")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake", action="store_true", help="Run against an in-process fake vLLM at --url")
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
+    args = parser.parse_args()
+
+    with fake_server(args.url, args.fake, max_num_seqs=16, seed=args.seed):
+        results = asyncio.run(
+            run_hotfix(
+                args.url,
+                args.adapter,
+                args.paths,
+                streams=args.streams,
+                max_tokens=args.max_tokens,
+                swaps=args.swaps,
+                interval_s=args.swap_interval,
+            )
+        )
+    if not args.no_save and not args.fake and results:
+        record_run("lora_hotfix", "hotfix", vars(args), results, args.url, "docker-compose.yml")
+    sys.exit(0 if results and results["passed"] else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,472 @@
+"""
+Streaming Torture - Cancellation storms, slow readers and dropped connections.
+
+Opens many streaming completions at once and mistreats most of them:
+- cancel: stop reading at a random token offset and close the connection
+  (a user pressing "stop"; vLLM aborts the request)
+- slow: read with a pause after every chunk, applying backpressure
+- drop: abort the TCP connection at a random time, possibly mid-prefill
+- survivor: read the whole stream normally
+
+Then checks two things:
+1. Leaks: after the storm, the server's running/waiting gauges and KV cache
+   usage must return to their pre-storm baseline. Aborted requests that are
+   still counted as running hold KV blocks nobody will read.
+2. Recovery: once the aborts are done, the freed batch slots should show up
+   as faster tokens for the survivors. Reports the survivors' inter-token
+   latency under load and after the aborts, how long after the last abort
+   it settled, and how long the server's running gauge lagged behind the
+   client's count of open streams.
+
+Usage:
+    python torture.py --streams 2000
+    python torture.py --fake --streams 2000     # against shared/fake_vllm.py
+"""
+
+import argparse
+import asyncio
+import bisect
+import random
+import resource
+import statistics
+import sys
+import time
+from dataclasses import dataclass
+
+import aiohttp
+
+sys.path.insert(0, "../..")
+from shared import AsyncVLLMClient, MetricsSampler, StreamTimeline
+from shared.fake_vllm import fake_server
+from shared.histogram import histogram_of, print_latency_summary
+from shared.results import record_run
+
+KINDS = ("survivor", "cancel", "slow", "drop")
+GAUGES = ("requests_running", "requests_waiting", "kv_cache_usage")
+KV_TOLERANCE = 0.001  # KV usage counted as back at baseline within this fraction
+
+
+@dataclass
+class StreamOutcome:
+    """What happened to one stream."""
+
+    index: int
+    kind: str
+    timeline: StreamTimeline
+    error: str | None = None
+
+    @property
+    def tokens(self) -> int:
+        return self.timeline.num_chunks
+
+    @property
+    def ended(self) -> float:
+        """perf_counter() time the client let go of the stream."""
+        t = self.timeline
+        return t.end or (t.stamps[-1] if t.stamps else t.start)
+
+
+def assign_kinds(count: int, cancel: float, slow: float, drop: float, rng: random.Random) -> list[str]:
+    """Shuffled stream kinds in the given proportions; the rest are survivors."""
+    if cancel + slow + drop > 1:
+        raise ValueError("cancel + slow + drop fractions must not exceed 1")
+    sizes = {"cancel": round(count * cancel), "slow": round(count * slow), "drop": round(count * drop)}
+    kinds = [kind for kind, n in sizes.items() for _ in range(n)]
+    kinds += ["survivor"] * (count - len(kinds))
+    rng.shuffle(kinds)
+    return kinds
+
+
+def raise_open_file_limit(streams: int) -> None:
+    """Lift the soft file descriptor limit toward the hard one if `streams` sockets need it."""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = streams + 256
+    if soft < wanted:
+        new = wanted if hard == resource.RLIM_INFINITY else min(wanted, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new, hard))
+        if new < wanted:
+            print(f"WARNING: open file limit {new} is below {wanted}; some streams may fail")
+
+
+async def drop_stream(
+    client: AsyncVLLMClient, prompt: str, max_tokens: int, timeline: StreamTimeline, drop_after_s: float
+) -> None:
+    """
+    Stream `prompt` and abort the TCP connection `drop_after_s` seconds after sending it.
+
+    The socket is torn down without a clean close, like a client that
+    crashed or lost its network. If the response headers have not arrived
+    by then (the request may still be in prefill), the pending request is
+    cancelled instead, which also closes its connection.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + drop_after_s
+    payload = {"model": client.model, "prompt": prompt, "max_tokens": max_tokens, "stream": True}
+    timeline.begin()
+    try:
+        resp = await asyncio.wait_for(
+            client.session.post(f"{client.base_url}/v1/completions", json=payload), timeout=drop_after_s
+        )
+    except asyncio.TimeoutError:
+        timeline.finish()
+        return
+
+    aborted = False
+
+    def abort() -> None:
+        nonlocal aborted
+        if resp.connection is not None and resp.connection.transport is not None:
+            aborted = True
+            resp.connection.transport.abort()
+
+    handle = loop.call_at(deadline, abort)
+    try:
+        resp.raise_for_status()
+        async for line in resp.content:
+            if line.startswith(b"data: ") and line[6:].strip() != b"[DONE]":
+                timeline.stamps.append(time.perf_counter())
+    except aiohttp.ClientError:
+        if not aborted:
+            raise
+    finally:
+        handle.cancel()
+        resp.close()
+        timeline.finish()
+
+
+async def run_stream(
+    client: AsyncVLLMClient,
+    index: int,
+    kind: str,
+    max_tokens: int,
+    cancel_after: int,
+    read_delay_s: float,
+    drop_after_s: float,
+) -> StreamOutcome:
+    """Send one streaming request and treat it according to its kind."""
+    timeline = StreamTimeline()
+    prompt = f"Stream {index}: tell a long story about the number {index}."
+
+    try:
+        if kind == "drop":
+            await drop_stream(client, prompt, max_tokens, timeline, drop_after_s)
+        else:
+            async for _token in client.complete_stream(
+                prompt,
+                max_tokens=max_tokens,
+                timeline=timeline,
+                cancel_after=cancel_after if kind == "cancel" else None,
+                read_delay_s=read_delay_s if kind == "slow" else 0.0,
+            ):
+                pass
+    except (aiohttp.ClientError, OSError, ValueError) as e:
+        # ValueError: a malformed SSE event; it fails this stream, not the storm
+        timeline.finish()
+        return StreamOutcome(index, kind, timeline, error=f"{type(e).__name__}: {e}")
+    return StreamOutcome(index, kind, timeline)
+
+
+def _median(values: list[float]) -> float | None:
+    return statistics.median(values) if values else None
+
+
+class OpenStreams:
+    """Number of streams the client had open at a given perf_counter() time."""
+
+    def __init__(self, outcomes: list[StreamOutcome]):
+        self.starts = sorted(o.timeline.start for o in outcomes)
+        self.ends = sorted(o.ended for o in outcomes)
+
+    def at(self, t: float) -> int:
+        return bisect.bisect_right(self.starts, t) - bisect.bisect_right(self.ends, t)
+
+
+def recovery_stats(
+    outcomes: list[StreamOutcome], bin_s: float = 0.1, tolerance: float = 0.1, loaded: float = 0.75
+) -> dict:
+    """
+    Survivor inter-token latency around the abort wave.
+
+    'itl_loaded_ms' is the survivors' median gap while the client still had
+    at least `loaded` of its peak streams open, 'itl_settled_ms' the median
+    over the second half of the time after the last abort, and
+    'recovery_ms' the time from the last abort until the first `bin_s` bin
+    whose median gap is within `tolerance` of settled.
+    """
+    aborted = [o.ended for o in outcomes if o.kind in ("cancel", "drop") and not o.error]
+    gaps = [
+        (s[i], (s[i] - s[i - 1]) * 1000)
+        for o in outcomes
+        if o.kind == "survivor"
+        for s in (o.timeline.stamps,)
+        for i in range(1, len(s))
+    ]
+    if not aborted or not gaps:
+        return {}
+    first_abort, last_abort = min(aborted), max(aborted)
+    end = max(t for t, _ in gaps)
+    settle_from = last_abort + (end - last_abort) / 2
+    open_streams = OpenStreams(outcomes)
+    peak = max(open_streams.at(t) for t in open_streams.starts)
+    itl_loaded = _median([g for t, g in gaps if open_streams.at(t) >= loaded * peak])
+    settled = _median([g for t, g in gaps if t >= settle_from])
+
+    recovery_ms = None
+    if settled is not None:
+        bins: dict[int, list[float]] = {}
+        for t, g in gaps:
+            if t > last_abort:
+                bins.setdefault(int((t - last_abort) / bin_s), []).append(g)
+        for b in sorted(bins):
+            if statistics.median(bins[b]) <= settled * (1 + tolerance):
+                recovery_ms = b * bin_s * 1000
+                break
+
+    return {
+        "peak_open_streams": peak,
+        "abort_window_s": last_abort - first_abort,
+        "itl_loaded_ms": itl_loaded,
+        "itl_settled_ms": settled,
+        "recovery_ms": recovery_ms,
+        "last_abort": last_abort,
+    }
+
+
+def abort_lag_ms(
+    outcomes: list[StreamOutcome], running: list[tuple[float, float]], after: float
+) -> float | None:
+    """
+    Time after `after` until the server's running gauge stopped exceeding the
+    number of streams the client still had open (times in perf_counter()).
+    """
+    open_streams = OpenStreams(outcomes)
+    for t, value in running:
+        if t >= after and value <= open_streams.at(t):
+            return (t - after) * 1000
+    return None
+
+
+def wait_for_baseline(
+    sampler: MetricsSampler, baseline: dict, since: float, timeout_s: float = 30.0
+) -> dict[str, float | None]:
+    """
+    Poll the gauges until each is back at its baseline.
+
+    Returns:
+        Seconds from `since` (wall clock) until each gauge was back, or None
+        for gauges still above baseline after `timeout_s`
+    """
+    settled: dict[str, float | None] = {key: None for key in GAUGES if key in baseline}
+    deadline = time.time() + timeout_s
+    while time.time() < deadline:
+        snapshot = sampler.scrape()
+        if snapshot is not None:
+            for key in settled:
+                if settled[key] is None:
+                    tolerance = KV_TOLERANCE if key == "kv_cache_usage" else 0.0
+                    if snapshot.gauges.get(key, 0.0) <= baseline[key] + tolerance:
+                        settled[key] = max(snapshot.timestamp - since, 0.0)
+        if all(v is not None for v in settled.values()):
+            break
+        time.sleep(sampler.interval)
+    return settled
+
+
+async def run_torture(
+    url: str,
+    streams: int = 1000,
+    cancel: float = 0.4,
+    slow: float = 0.1,
+    drop: float = 0.2,
+    max_tokens: int = 128,
+    cancel_range: tuple[int, int] = (8, 48),
+    read_delay_s: float = 0.05,
+    drop_window_s: float = 2.0,
+    open_rate: float = 0.0,
+    settle_timeout_s: float = 30.0,
+    sample_interval: float = 0.1,
+    seed: int = 0,
+) -> dict | None:
+    """
+    Run one storm and check for leaks and recovery.
+
+    Args:
+        url: Server URL
+        streams: Streams to open
+        cancel / slow / drop: Fractions of streams of each kind (the rest
+            are survivors)
+        max_tokens: Tokens requested per stream
+        cancel_range: Token offsets at which cancelled streams stop reading
+        read_delay_s: Pause per chunk of slow readers
+        drop_window_s: Dropped streams are killed at a random time in
+            [0, drop_window_s) after they are sent
+        open_rate: Streams opened per second (0 = all at once)
+        settle_timeout_s: How long to wait for gauges to return to baseline
+        sample_interval: /metrics polling interval (s)
+        seed: Seed for stream kinds, offsets and drop times
+    """
+    print("=" * 70)
+    print("Streaming Torture")
+    print("=" * 70)
+
+    rng = random.Random(seed)
+    kinds = assign_kinds(streams, cancel, slow, drop, rng)
+    counts = {kind: kinds.count(kind) for kind in KINDS}
+    raise_open_file_limit(streams)
+
+    async with AsyncVLLMClient(base_url=url, pool_size=0) as client:
+        if not await client.health_check():
+            print("ERROR: Server not healthy")
+            return None
+
+        print("\nWarming up...")
+        await client.complete("Hello", max_tokens=5)
+
+        sampler = MetricsSampler(url, interval=sample_interval)
+        first = sampler.scrape()
+        if first is None:
+            print("ERROR: /metrics not available")
+            return None
+        baseline = {key: first.gauges.get(key, 0.0) for key in GAUGES}
+        print(f"Baseline gauges: {baseline}")
+        print(
+            f"\nOpening {streams} streams ({', '.join(f'{n} {k}' for k, n in counts.items())}), "
+            f"{'all at once' if not open_rate else f'{open_rate:g}/s'}..."
+        )
+
+        clock_offset = time.time() - time.perf_counter()
+        sampler.start()
+        tasks = []
+        for i, kind in enumerate(kinds):
+            if open_rate:
+                await asyncio.sleep(1 / open_rate)
+            tasks.append(
+                asyncio.create_task(
+                    run_stream(
+                        client,
+                        i,
+                        kind,
+                        max_tokens,
+                        cancel_after=rng.randint(*cancel_range),
+                        read_delay_s=read_delay_s,
+                        drop_after_s=rng.uniform(0, drop_window_s),
+                    )
+                )
+            )
+        outcomes = await asyncio.gather(*tasks)
+        storm_end = time.time()
+        print(f"Storm finished in {storm_end - clock_offset - min(o.timeline.start for o in outcomes):.1f}s")
+
+    print(f"\nWaiting up to {settle_timeout_s:g}s for gauges to return to baseline...")
+    settle = wait_for_baseline(sampler, baseline, storm_end, settle_timeout_s)
+    sampler.stop()
+
+    running = [(t - clock_offset, v) for t, v in sampler.gauge_series("requests_running")]
+    peaks = {key: max((v for _, v in sampler.gauge_series(key)), default=0.0) for key in GAUGES}
+    recovery = recovery_stats(outcomes)
+    lag = abort_lag_ms(outcomes, running, recovery["last_abort"]) if recovery else None
+    errors = [o for o in outcomes if o.error]
+    survivors = [o for o in outcomes if o.kind == "survivor" and not o.error]
+    incomplete = sum(1 for o in survivors if o.tokens < max_tokens)
+    tpot = histogram_of(o.timeline.tpot_ms for o in survivors if o.timeline.tpot_ms is not None)
+
+    print("\n" + "=" * 70)
+    print("Results")
+    print("=" * 70)
+    print(f"\nStreams: {streams} ({len(errors)} errors, {incomplete} survivors cut short)")
+    for o in errors[:5]:
+        print(f"  #{o.index} ({o.kind}): {o.error}")
+
+    print("\nGauges (baseline -> peak, back at baseline after):")
+    leaked = []
+    for key in GAUGES:
+        after = settle.get(key)
+        status = f"{after:.2f}s" if after is not None else f"NOT after {settle_timeout_s:g}s (LEAK?)"
+        if after is None:
+            leaked.append(key)
+        print(f"  {key:<17} {baseline[key]:>8.3f} -> {peaks[key]:>8.3f}   {status}")
+
+    if tpot.count:
+        print_latency_summary("Survivor TPOT", tpot)
+    if recovery:
+        print("\nSurvivor inter-token latency around the aborts (median):")
+        for key, label in (
+            ("itl_loaded_ms", f"Under load (>= 75% of {recovery['peak_open_streams']} open)"),
+            ("itl_settled_ms", "Settled after aborts"),
+        ):
+            value = recovery[key]
+            print(f"  {label:<34} {value:.1f}ms" if value is not None else f"  {label:<34} -")
+        print(f"  {'Abort window':<34} {recovery['abort_window_s'] * 1000:.0f}ms")
+        if recovery["recovery_ms"] is not None:
+            print(f"  {'Settled (within 10%) after':<34} {recovery['recovery_ms']:.0f}ms from the last abort")
+        if lag is not None:
+            print(f"  {'Running gauge lag':<34} {lag:.0f}ms behind the client's open streams")
+
+    print("\n" + "=" * 70)
+    if leaked:
+        print(f"FAIL: {', '.join(leaked)} did not return to baseline")
+    else:
+        print("OK: all gauges returned to baseline")
+
+    return {
+        "streams": streams,
+        **{f"{kind}_streams": n for kind, n in counts.items()},
+        "errors": len(errors),
+        "survivors_cut_short": incomplete,
+        **{f"{key}_baseline": baseline[key] for key in GAUGES},
+        **{f"{key}_peak": peaks[key] for key in GAUGES},
+        **{f"{key}_settle_s": settle.get(key) for key in GAUGES},
+        "leaked": leaked,
+        "survivor_tpot_ms": tpot.mean,
+        **{k: v for k, v in recovery.items() if k != "last_abort"},
+        "abort_lag_ms": lag,
+        "samples": {"survivor_tpot_ms": [o.timeline.tpot_ms for o in survivors if o.timeline.tpot_ms is not None]},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming Torture")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server URL")
+    parser.add_argument("--streams", type=int, default=1000, help="Streams to open")
+    parser.add_argument("--cancel", type=float, default=0.4, help="Fraction cancelled at a random token")
+    parser.add_argument("--slow", type=float, default=0.1, help="Fraction of slow readers")
+    parser.add_argument("--drop", type=float, default=0.2, help="Fraction dropped at a random time")
+    parser.add_argument("--max-tokens", type=int, default=128, help="Tokens requested per stream")
+    parser.add_argument(
+        "--cancel-range", type=int, nargs=2, default=[8, 48], metavar=("MIN", "MAX"), help="Cancel token offsets"
+    )
+    parser.add_argument("--read-delay", type=float, default=0.05, help="Slow reader pause per chunk (s)")
+    parser.add_argument("--drop-window", type=float, default=2.0, help="Drops happen within this many seconds")
+    parser.add_argument("--open-rate", type=float, default=0.0, help="Streams opened per second (0 = all at once)")
+    parser.add_argument("--settle-timeout", type=float, default=30.0, help="Seconds to wait for gauges to settle")
+    parser.add_argument("--sample-interval", type=float, default=0.1, help="Server metrics polling interval (s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fake", action="store_true", help="Run against an in-process fake vLLM at --url")
+    parser.add_argument("--no-save", action="store_true", help="Don't store the run in the result store")
+    args = parser.parse_args()
+
+    with fake_server(args.url, args.fake, seed=args.seed):
+        results = asyncio.run(
+            run_torture(
+                args.url,
+                streams=args.streams,
+                cancel=args.cancel,
+                slow=args.slow,
+                drop=args.drop,
+                max_tokens=args.max_tokens,
+                cancel_range=tuple(args.cancel_range),
+                read_delay_s=args.read_delay,
+                drop_window_s=args.drop_window,
+                open_rate=args.open_rate,
+                settle_timeout_s=args.settle_timeout,
+                sample_interval=args.sample_interval,
+                seed=args.seed,
+            )
+        )
+    if not args.no_save and not args.fake:
+        record_run("streaming_torture", "storm", vars(args), results, args.url, "docker-compose.yml")
+    sys.exit(1 if results is None or results["leaked"] else 0)
+
+
+if __name__ == "__main__":
+    main()
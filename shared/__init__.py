@@ -1,6 +1,20 @@
 """Shared utilities for vLLM Ops Lab experiments."""
 
-from .vllm_client import VLLMClient
-from .metrics import timer, TimingResult, get_vllm_metrics, get_gpu_memory_mb
+from .vllm_client import VLLMClient, AsyncVLLMClient
+from .metrics import timer, TimingResult, get_vllm_metrics, get_gpu_memory_mb, MetricsSampler
+from .timeline import StreamTimeline
+from .histogram import LatencyHistogram
+from .gpu_memory import GPUMemorySampler
 
-__all__ = ["VLLMClient", "timer", "TimingResult", "get_vllm_metrics", "get_gpu_memory_mb"]
\ No newline at end of file
+__all__ = [
+    "VLLMClient",
+    "AsyncVLLMClient",
+    "timer",
+    "TimingResult",
+    "get_vllm_metrics",
+    "get_gpu_memory_mb",
+    "MetricsSampler",
+    "StreamTimeline",
+    "LatencyHistogram",
+    "GPUMemorySampler",
+]
\ No newline at end of file
@@ -0,0 +1,831 @@
+"""
+Fake vLLM server for testing harnesses without Docker or a GPU.
+
+Serves the subset of vLLM's HTTP API the experiments use:
+- /health, /v1/models, /tokenize, /reset_prefix_cache
+- /v1/completions, streaming (SSE) or not, for the base model or a LoRA adapter
+- /sleep, /wake_up, /is_sleeping, /collective_rpc (reload_weights)
+- /v1/load_lora_adapter, /v1/unload_lora_adapter
+- /metrics in Prometheus format (TTFT/E2E/queue/TPOT histograms, request,
+  token, prefix cache and preemption counters, running/waiting, KV cache
+  usage, sleep state and LoRA gauges)
+
+Engine model: one scheduler loop runs steps like vLLM's engine core. Each
+step the scheduler gives running requests their next tokens (one for a
+decode, a chunk of the prompt for a prefill) and then admits waiting
+requests, within `max_num_batched_tokens` tokens, `max_num_seqs` running
+requests, the KV cache (`num_gpu_blocks` blocks of `block_size` tokens)
+and `max_loras` distinct adapters. Without chunked prefill, prompts are
+prefilled whole in steps of their own, and decodes wait for them. A step
+takes
+
+    prefill_tokens * prefill_ms_per_token
+    + decode_ms_per_token + decode_seqs * decode_ms_per_seq   (if any decode)
+    + adapters * lora_ms_per_adapter + adapter swaps * lora_swap_ms
+
+with `jitter` drawn from a generator seeded by `seed`, scaled by
+`time_scale` (0 runs steps back to back, to load-test a client as fast as
+the server can go). Given the same arrivals, the server produces the same
+steps. With prefix caching, full prompt blocks that an earlier request
+computed are skipped, in an LRU cache that holds as many blocks as are free.
+When a decode needs a block and none is free, the newest running request
+is preempted and recomputed later. Tokens are 4-character chunks.
+
+When a streaming client disconnects, the request is aborted: it leaves the
+batch at the next step, its blocks are freed and it is counted with
+finished_reason="abort". While asleep the engine is paused and new
+requests queue until /wake_up.
+
+Usage:
+    with FakeVLLM(FakeVLLMConfig(prefix_caching=False), port=8000):
+        run_benchmark(VLLMClient("http://localhost:8000"))
+
+    python -m shared.fake_vllm --port 8000 --no-prefix-caching
+    python -m shared.fake_vllm --port 8000 --time-scale 0    # as fast as possible
+"""
+
+import asyncio
+import contextlib
+import itertools
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field, replace
+from typing import Iterator
+from urllib.parse import urlparse
+
+from aiohttp import web
+
+CHARS_PER_TOKEN = 4
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.02, 0.04, 0.06, 0.08, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+SLEEP_STATES = {0: "awake", 1: "weights_offloaded", 2: "discard_all"}
+
+
+@dataclass
+class FakeVLLMConfig:
+    """Behavior of a FakeVLLM server."""
+
+    model: str = "Qwen/Qwen2.5-0.5B-Instruct"
+    max_model_len: int = 4096  # Reported by /tokenize and /v1/models; caps max_tokens=null
+    prefix_caching: bool = True
+    chunked_prefill: bool = True
+    max_num_batched_tokens: int = 512  # Token budget per step
+    max_num_seqs: int = 256  # Running requests per step
+    block_size: int = 16
+    num_gpu_blocks: int = 4096  # KV cache size
+    base_ttft_ms: float = 5.0  # API server overhead before a request reaches the scheduler
+    prefill_ms_per_token: float = 0.05
+    decode_ms_per_token: float = 2.0  # Fixed cost of a step that decodes
+    decode_ms_per_seq: float = 0.02  # Extra cost per decoding request in the step
+    jitter: float = 0.05  # Relative random noise on every delay
+    time_scale: float = 1.0  # Multiplies every delay; 0 runs without waiting
+    stream_interval: int = 1  # Tokens buffered per SSE write after the first, like vLLM's --stream-interval
+    max_loras: int = 4  # Distinct adapters per step (GPU adapter slots)
+    lora_load_ms: float = 50.0  # /v1/load_lora_adapter (reading the adapter)
+    lora_swap_ms: float = 5.0  # Moving an adapter into a GPU slot
+    lora_ms_per_adapter: float = 0.5  # Extra step cost per distinct adapter in the batch
+    sleep_ms: float = 200.0
+    wake_ms: float = 500.0  # From level 1: weights copied back from CPU
+    wake_level2_ms: float = 100.0  # From level 2: memory reallocated, weights still need reloading
+    reload_weights_ms: float = 2000.0  # /collective_rpc reload_weights
+    lora_modules: dict[str, str] = field(default_factory=dict)  # Adapters loaded at start: name -> path
+    seed: int = 0
+
+
+class _Histogram:
+    """Prometheus histogram; buckets are cumulated when rendered."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float) -> None:
+        self.counts[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def lines(self, name: str, labels: str) -> list[str]:
+        out = [f"# TYPE {name} histogram"]
+        for bound, count in zip(LATENCY_BUCKETS, itertools.accumulate(self.counts)):
+            out.append(f'{name}_bucket{{{labels},le="{bound}"}} {float(count)}')
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {float(self.count)}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum}")
+        out.append(f"{name}_count{{{labels}}} {float(self.count)}")
+        return out
+
+
+def fake_tokenize(text: str) -> list[int]:
+    """Token IDs of the fake tokenizer: one per 4-character chunk, stable across runs."""
+    return [zlib.crc32(text[i : i + CHARS_PER_TOKEN].encode()) for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+
+def _error(status: int, message: str, kind: str) -> web.Response:
+    """vLLM's JSON error body."""
+    return web.json_response({"object": "error", "message": message, "type": kind, "code": status}, status=status)
+
+
+class _Request:
+    """One completion request as the engine sees it."""
+
+    __slots__ = (
+        "id", "tokens", "max_tokens", "lora", "stream", "head", "arrival", "scheduled_at", "first_token_at",
+        "num_computed", "generated", "blocks", "hashes", "cached", "state", "aborted", "out", "ready",
+    )
+
+    def __init__(self, request_id: int, tokens: list[int], max_tokens: int, lora: str | None, stream: bool,
+                 head: bytes):
+        self.id = request_id
+        self.tokens = tokens
+        self.max_tokens = max_tokens
+        self.lora = lora
+        self.stream = stream
+        self.head = head  # SSE chunk prefix up to the token text
+        self.arrival = time.perf_counter()
+        self.scheduled_at: float | None = None
+        self.first_token_at: float | None = None
+        self.num_computed = 0  # Tokens with KV in cache (prompt, then outputs)
+        self.generated = 0
+        self.blocks = 0
+        self.hashes: list[int] | None = None  # Chained prompt block hashes, for the prefix cache
+        self.cached = False  # Prompt blocks added to the prefix cache
+        self.state = "arriving"  # arriving -> waiting <-> running -> done
+        self.aborted = False
+        self.out: list = []  # SSE chunks (streaming) or token texts, not yet taken by the handler
+        self.ready = asyncio.Event()
+
+    @property
+    def seq_len(self) -> int:
+        return len(self.tokens) + self.generated
+
+
+class FakeVLLM:
+    """In-process fake vLLM server running on a background event loop."""
+
+    def __init__(
+        self, config: FakeVLLMConfig | None = None, host: str = "127.0.0.1", port: int = 8000, reuse_port: bool = False
+    ):
+        self.config = config or FakeVLLMConfig()
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port  # Let several processes listen on the port
+        self._rng = random.Random(self.config.seed)
+        self._ids = itertools.count()
+        self._cache: OrderedDict[int, None] = OrderedDict()  # Prefix cache block hashes, LRU first
+        self._waiting: deque[_Request] = deque()
+        self._running: list[_Request] = []
+        self._arriving = 0
+        self._aborted_running = 0
+        self._used_blocks = 0
+        self._sleep_level = 0
+        self._adapters = dict(self.config.lora_modules)  # Loaded LoRA adapters: name -> path
+        self._lora_slots: OrderedDict[str, None] = OrderedDict()  # Adapters on the GPU, LRU first
+        self._active_loras: dict[str, int] = {}  # Running requests per adapter
+        self._ttft = _Histogram()
+        self._e2e = _Histogram()
+        self._queue = _Histogram()
+        self._tpot = _Histogram()
+        self._finished = {"length": 0, "abort": 0}  # vllm:request_success by finished_reason
+        self._counters = {
+            "prompt_tokens": 0,
+            "generation_tokens": 0,
+            "prefix_cache_hits": 0,
+            "prefix_cache_queries": 0,
+            "num_preemptions": 0,
+        }
+        self.steps = 0
+        self._kick: asyncio.Event | None = None
+        self._engine_task: asyncio.Task | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._runner: web.AppRunner | None = None
+        self._thread: threading.Thread | None = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    # -- model ---------------------------------------------------------------
+
+    def _delay(self, ms: float) -> float:
+        """Seconds to sleep for `ms`, with jitter and time scaling."""
+        if not self.config.time_scale:
+            return 0.0
+        noise = 1 + self._rng.uniform(-self.config.jitter, self.config.jitter)
+        return max(ms * noise * self.config.time_scale, 0.0) / 1000
+
+    def _block_hashes(self, req: _Request) -> list[int]:
+        """Chained hashes of the prompt's full blocks, computed once per request."""
+        if req.hashes is None:
+            B = self.config.block_size
+            tokens = req.tokens
+            req.hashes = []
+            h = 0
+            for start in range(0, len(tokens) - B + 1, B):
+                h = hash((h, *tokens[start : start + B]))
+                req.hashes.append(h)
+        return req.hashes
+
+    def _cached_blocks(self, req: _Request) -> int:
+        """Leading prompt blocks of `req` already in the prefix cache."""
+        if not self.config.prefix_caching or req.generated:
+            return 0
+        hits = 0
+        for h in self._block_hashes(req):
+            if h not in self._cache:
+                break
+            hits += 1
+        if hits and hits * self.config.block_size >= len(req.tokens):
+            hits -= 1  # The last token is always recomputed
+        return hits
+
+    def _cache_prompt(self, req: _Request) -> None:
+        """Add the prompt's blocks to the prefix cache once they are computed."""
+        req.cached = True
+        if not self.config.prefix_caching:
+            return
+        for h in self._block_hashes(req):
+            self._cache[h] = None
+            self._cache.move_to_end(h)
+        self._evict_cache()
+
+    def _evict_cache(self) -> None:
+        """Drop least recently used cached blocks until they fit in free memory."""
+        room = max(self.config.num_gpu_blocks - self._used_blocks, 0)
+        while len(self._cache) > room:
+            self._cache.popitem(last=False)
+
+    def _allocate(self, req: _Request, num_tokens: int) -> bool:
+        """Grow `req`'s KV blocks to hold `num_tokens` more tokens."""
+        needed = math.ceil((req.num_computed + num_tokens) / self.config.block_size) - req.blocks
+        if needed <= 0:
+            return True
+        if self._used_blocks + needed > self.config.num_gpu_blocks:
+            return False
+        req.blocks += needed
+        self._used_blocks += needed
+        self._evict_cache()
+        return True
+
+    def _release(self, req: _Request) -> None:
+        """Free `req`'s blocks and its hold on an adapter slot."""
+        self._used_blocks -= req.blocks
+        req.blocks = 0
+        if req.lora is not None:
+            self._active_loras[req.lora] -= 1
+            if not self._active_loras[req.lora]:
+                del self._active_loras[req.lora]
+
+    def _adapter_fits(self, lora: str, step_loras: set[str]) -> bool:
+        """Whether a step can take a request for `lora` without exceeding max_loras."""
+        if lora in step_loras or lora in self._active_loras:
+            return True
+        return len(step_loras | self._active_loras.keys()) < self.config.max_loras
+
+    def _activate_adapter(self, lora: str, step_loras: set[str]) -> int:
+        """
+        Put `lora` in a GPU slot for this step, evicting the least recently
+        used idle adapter if the slots are full.
+
+        Returns:
+            Number of adapter swaps it cost (0 or 1)
+        """
+        step_loras.add(lora)
+        self._active_loras[lora] = self._active_loras.get(lora, 0) + 1
+        if lora in self._lora_slots:
+            self._lora_slots.move_to_end(lora)
+            return 0
+        for name in list(self._lora_slots):
+            if len(self._lora_slots) < self.config.max_loras:
+                break
+            if name not in self._active_loras and name not in step_loras:
+                del self._lora_slots[name]
+        self._lora_slots[lora] = None
+        return 1
+
+    def _preempt(self) -> None:
+        """Send the newest running request back to the front of the queue to be recomputed."""
+        victim = self._running.pop()
+        self._release(victim)
+        victim.num_computed = 0
+        victim.cached = False
+        victim.state = "waiting"
+        self._waiting.appendleft(victim)
+        self._counters["num_preemptions"] += 1
+
+    def _schedule(self) -> tuple[list[tuple[_Request, int]], int, int, int, int]:
+        """
+        Pick the requests and token counts of the next step.
+
+        Returns:
+            (batch of (request, tokens), prefill tokens, decoding requests,
+            distinct adapters, adapter swaps)
+        """
+        cfg = self.config
+        B = cfg.block_size
+        budget = cfg.max_num_batched_tokens
+        batch: list[tuple[_Request, int]] = []
+        step_loras: set[str] = set()
+        prefill_tokens = decodes = swaps = 0
+
+        def admit(req: _Request) -> bool:
+            """Move a waiting request into the batch if it fits."""
+            nonlocal budget, prefill_tokens, swaps
+            hits = self._cached_blocks(req)
+            n = req.seq_len - hits * B
+            if n > budget:
+                if cfg.chunked_prefill:
+                    n = budget
+                elif batch:
+                    return False  # Without chunking a prompt is prefilled whole, alone if need be
+            if req.lora is not None and not self._adapter_fits(req.lora, step_loras):
+                return False
+            for h in self._block_hashes(req)[:hits]:
+                self._cache.move_to_end(h)  # Most recently used, so the allocation below keeps them
+            req.num_computed = hits * B
+            if not self._allocate(req, n):
+                req.num_computed = 0
+                return False
+            if req.lora is not None:
+                swaps += self._activate_adapter(req.lora, step_loras)
+            if not req.generated:
+                self._counters["prefix_cache_queries"] += len(req.tokens)
+                self._counters["prefix_cache_hits"] += hits * B
+            if req.scheduled_at is None:
+                req.scheduled_at = time.perf_counter()
+                self._queue.observe(req.scheduled_at - req.arrival)
+            req.state = "running"
+            self._running.append(req)
+            batch.append((req, n))
+            budget -= n
+            prefill_tokens += n
+            return True
+
+        def admit_waiting() -> None:
+            skipped = []
+            while self._waiting and budget > 0 and len(self._running) < cfg.max_num_seqs:
+                req = self._waiting.popleft()
+                if not admit(req):
+                    skipped.append(req)
+                    if req.lora is None or self._adapter_fits(req.lora, step_loras):
+                        break  # Out of budget or memory: keep FCFS order
+            self._waiting.extendleft(reversed(skipped))
+
+        if not cfg.chunked_prefill and self._waiting:
+            # Without chunked prefill, prompts get steps of their own and decodes wait
+            admit_waiting()
+            if batch:
+                return batch, prefill_tokens, 0, len(step_loras), swaps
+
+        # Running requests first: decodes and the rest of partial prefills
+        i = 0
+        while i < len(self._running) and budget > 0:
+            req = self._running[i]
+            n = min(req.seq_len - req.num_computed, budget)
+            if not self._allocate(req, n):
+                self._preempt()  # Out of KV blocks: the newest request (maybe this one) makes room
+                continue
+            batch.append((req, n))
+            budget -= n
+            if req.generated and n == 1:
+                decodes += 1
+            else:
+                prefill_tokens += n
+            if req.lora is not None:
+                step_loras.add(req.lora)
+            i += 1
+
+        if cfg.chunked_prefill:
+            admit_waiting()
+        return batch, prefill_tokens, decodes, len(step_loras), swaps
+
+    def _step_seconds(self, prefill_tokens: int, decodes: int, adapters: int, swaps: int) -> float:
+        cfg = self.config
+        ms = prefill_tokens * cfg.prefill_ms_per_token + adapters * cfg.lora_ms_per_adapter + swaps * cfg.lora_swap_ms
+        if decodes:
+            ms += cfg.decode_ms_per_token + decodes * cfg.decode_ms_per_seq
+        return self._delay(ms)
+
+    def _emit(self, req: _Request, now: float) -> None:
+        """Sample one output token for `req`."""
+        i = req.generated
+        req.generated += 1
+        self._counters["generation_tokens"] += 1
+        if req.first_token_at is None:
+            req.first_token_at = now
+            self._ttft.observe(now - req.arrival)
+        last = req.generated >= req.max_tokens
+        if req.stream:
+            finish = b'"length"' if last else b"null"
+            req.out.append(b'%s tok%d","logprobs":null,"finish_reason":%s}]}\n\n' % (req.head, i, finish))
+        else:
+            req.out.append(f" tok{i}")
+        if last:
+            req.state = "done"
+            self._release(req)
+            self._finished["length"] += 1
+            self._e2e.observe(now - req.arrival)
+            if req.generated > 1:
+                self._tpot.observe((now - req.first_token_at) / (req.generated - 1))
+            req.ready.set()
+        elif req.stream and (i == 0 or len(req.out) >= self.config.stream_interval):
+            req.ready.set()
+
+    def _finish_step(self, batch: list[tuple[_Request, int]]) -> None:
+        now = time.perf_counter()
+        for req, n in batch:
+            if req.aborted or req.state != "running":
+                continue
+            req.num_computed += n
+            if req.num_computed >= len(req.tokens) and not req.cached:
+                self._cache_prompt(req)
+            if req.num_computed == req.seq_len:
+                self._emit(req, now)
+        self._running = [req for req in self._running if req.state == "running"]
+
+    def _reap_aborted(self) -> None:
+        """Drop aborted requests from the batch."""
+        for req in self._running:
+            if req.aborted:
+                req.state = "done"
+                self._release(req)
+                self._finished["abort"] += 1
+        self._running = [req for req in self._running if req.state == "running"]
+        self._aborted_running = 0
+
+    async def _engine_loop(self) -> None:
+        while True:
+            if self._aborted_running:
+                self._reap_aborted()
+            if self._sleep_level or not (self._waiting or self._running):
+                self._kick.clear()
+                await self._kick.wait()
+                continue
+            batch, prefill_tokens, decodes, adapters, swaps = self._schedule()
+            if not batch:
+                self._kick.clear()
+                await self._kick.wait()  # Blocked until something finishes or is aborted
+                continue
+            await asyncio.sleep(self._step_seconds(prefill_tokens, decodes, adapters, swaps))
+            self.steps += 1
+            self._finish_step(batch)
+
+    def _enqueue(self, req: _Request) -> None:
+        self._arriving -= 1
+        if req.aborted:
+            req.state = "done"
+            self._finished["abort"] += 1
+            return
+        req.state = "waiting"
+        self._waiting.append(req)
+        self._kick.set()
+
+    def _submit(self, req: _Request) -> None:
+        self._counters["prompt_tokens"] += len(req.tokens)
+        self._arriving += 1
+        asyncio.get_running_loop().call_later(self._delay(self.config.base_ttft_ms), self._enqueue, req)
+
+    def _abort(self, req: _Request) -> None:
+        """Client went away: free the request as vLLM does on disconnect."""
+        if req.state == "done" or req.aborted:
+            return
+        req.aborted = True
+        if req.state == "waiting":
+            self._waiting.remove(req)
+            req.state = "done"
+            self._finished["abort"] += 1
+        elif req.state == "running":
+            self._aborted_running += 1
+            self._kick.set()
+
+    # -- handlers ------------------------------------------------------------
+
+    async def _health(self, request: web.Request) -> web.Response:
+        return web.Response(text="")
+
+    async def _models(self, request: web.Request) -> web.Response:
+        cfg = self.config
+        created = int(time.time())
+        data = [
+            {"id": cfg.model, "object": "model", "created": created, "owned_by": "vllm", "root": cfg.model,
+             "parent": None, "max_model_len": cfg.max_model_len}
+        ]
+        for name, path in self._adapters.items():
+            data.append(
+                {"id": name, "object": "model", "created": created, "owned_by": "vllm", "root": path,
+                 "parent": cfg.model, "max_model_len": None}
+            )
+        return web.json_response({"object": "list", "data": data})
+
+    async def _tokenize(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        tokens = fake_tokenize(body.get("prompt", ""))
+        return web.json_response({"tokens": tokens, "count": len(tokens), "max_model_len": self.config.max_model_len})
+
+    async def _reset_prefix_cache(self, request: web.Request) -> web.Response:
+        self._cache.clear()
+        return web.Response(text="")
+
+    async def _sleep(self, request: web.Request) -> web.Response:
+        level = int(request.query.get("level", 1))
+        if level not in (1, 2):
+            return _error(400, f"Invalid sleep level {level}", "BadRequestError")
+        if not self._sleep_level:
+            self._sleep_level = level  # The engine pauses after its current step
+            await asyncio.sleep(self._delay(self.config.sleep_ms))
+            self._cache.clear()
+        return web.Response(text="")
+
+    async def _wake_up(self, request: web.Request) -> web.Response:
+        if self._sleep_level:
+            cfg = self.config
+            await asyncio.sleep(self._delay(cfg.wake_ms if self._sleep_level == 1 else cfg.wake_level2_ms))
+            self._sleep_level = 0
+            self._kick.set()
+        return web.Response(text="")
+
+    async def _is_sleeping(self, request: web.Request) -> web.Response:
+        return web.json_response({"is_sleeping": bool(self._sleep_level)})
+
+    async def _collective_rpc(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        if body.get("method") == "reload_weights":
+            await asyncio.sleep(self._delay(self.config.reload_weights_ms))
+        return web.json_response({"results": [None]})
+
+    async def _load_lora(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        name, path = body.get("lora_name"), body.get("lora_path")
+        if not name or not path:
+            return _error(400, "Both 'lora_name' and 'lora_path' must be provided.", "BadRequestError")
+        if name in self._adapters and not body.get("load_inplace"):
+            return _error(400, f"The lora adapter '{name}' has already been loaded.", "InvalidUserInput")
+        await asyncio.sleep(self._delay(self.config.lora_load_ms))
+        self._adapters[name] = path
+        if name not in self._active_loras:
+            self._lora_slots.pop(name, None)  # Replaced weights must be moved to the GPU again
+        return web.Response(text=f"Success: LoRA adapter '{name}' added successfully.")
+
+    async def _unload_lora(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        name = body.get("lora_name")
+        if name not in self._adapters:
+            return _error(404, f"The lora adapter '{name}' cannot be found.", "NotFoundError")
+        del self._adapters[name]
+        if name not in self._active_loras:
+            self._lora_slots.pop(name, None)
+        return web.Response(text=f"Success: LoRA adapter '{name}' removed successfully.")
+
+    async def _completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        prompt = body.get("prompt", "")
+        max_tokens = body.get("max_tokens", 16)
+        if max_tokens is not None and (type(max_tokens) is not int or max_tokens < 1):
+            return _error(400, f"max_tokens must be an integer >= 1, got {max_tokens!r}.", "BadRequestError")
+        model = body.get("model") or self.config.model
+        if model != self.config.model and model not in self._adapters:
+            return _error(404, f"The model `{model}` does not exist.", "NotFoundError")
+        tokens = fake_tokenize(prompt)
+        if max_tokens is None:  # Like vLLM: generate until the context is full
+            max_tokens = self.config.max_model_len - len(tokens)
+            if max_tokens < 1:
+                return _error(
+                    400,
+                    f"This model's maximum context length is {self.config.max_model_len} tokens, "
+                    f"but the prompt has {len(tokens)} tokens.",
+                    "BadRequestError",
+                )
+        if math.ceil((len(tokens) + max_tokens) / self.config.block_size) > self.config.num_gpu_blocks:
+            return _error(400, "The prompt does not fit in the KV cache.", "BadRequestError")
+
+        request_id = next(self._ids)
+        created = int(time.time())
+        stream = bool(body.get("stream"))
+        head = b'data: {"id":"cmpl-%d","object":"text_completion","created":%d,"model":%s,"choices":[{"index":0,"text":"' % (
+            request_id, created, json.dumps(model).encode()
+        )
+        req = _Request(request_id, tokens, max_tokens, None if model == self.config.model else model, stream, head)
+        self._submit(req)
+
+        if not stream:
+            texts = []
+            try:
+                while req.state != "done":
+                    await req.ready.wait()
+                    req.ready.clear()
+                    texts += req.out
+                    req.out.clear()
+            finally:
+                self._abort(req)
+            return web.json_response(
+                {
+                    "id": f"cmpl-{request_id}",
+                    "object": "text_completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "text": "".join(texts), "logprobs": None, "finish_reason": "length"}],
+                    "usage": {
+                        "prompt_tokens": len(tokens),
+                        "completion_tokens": max_tokens,
+                        "total_tokens": len(tokens) + max_tokens,
+                    },
+                }
+            )
+
+        resp = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        try:
+            await resp.prepare(request)
+            while True:
+                await req.ready.wait()
+                req.ready.clear()
+                data = b"".join(req.out)  # Everything produced since the last write goes out at once
+                req.out.clear()
+                if req.state == "done":
+                    await resp.write_eof(data + b"data: [DONE]\n\n")
+                    break
+                await resp.write(data)
+        except ConnectionResetError:
+            pass  # Client went away
+        finally:
+            self._abort(req)
+        return resp
+
+    async def _metrics(self, request: web.Request) -> web.Response:
+        cfg = self.config
+        labels = f'engine="0",model_name="{cfg.model}"'
+        lines = self._ttft.lines("vllm:time_to_first_token_seconds", labels)
+        lines += self._e2e.lines("vllm:e2e_request_latency_seconds", labels)
+        lines += self._queue.lines("vllm:request_queue_time_seconds", labels)
+        lines += self._tpot.lines("vllm:time_per_output_token_seconds", labels)
+        waiting_loras = {req.lora for req in self._waiting if req.lora is not None}
+        lines += [
+            "# TYPE vllm:num_requests_running gauge",
+            f"vllm:num_requests_running{{{labels}}} {float(len(self._running))}",
+            "# TYPE vllm:num_requests_waiting gauge",
+            f"vllm:num_requests_waiting{{{labels}}} {float(len(self._waiting) + self._arriving)}",
+            "# TYPE vllm:kv_cache_usage_perc gauge",
+            f"vllm:kv_cache_usage_perc{{{labels}}} {min(self._used_blocks / cfg.num_gpu_blocks, 1.0)}",
+            "# TYPE vllm:engine_sleep_state gauge",
+        ]
+        for level, state in SLEEP_STATES.items():
+            lines.append(f'vllm:engine_sleep_state{{{labels},sleep_state="{state}"}} {float(self._sleep_level == level)}')
+        lines += [
+            "# TYPE vllm:lora_requests_info gauge",
+            f'vllm:lora_requests_info{{max_lora="{cfg.max_loras}",'
+            f'running_lora_adapters="{",".join(sorted(self._active_loras))}",'
+            f'waiting_lora_adapters="{",".join(sorted(waiting_loras))}"}} {time.time()}',
+            "# TYPE vllm:request_success counter",
+        ]
+        for reason, value in self._finished.items():
+            lines.append(f'vllm:request_success_total{{{labels},finished_reason="{reason}"}} {float(value)}')
+        for name, value in self._counters.items():
+            lines.append(f"# TYPE vllm:{name} counter")
+            lines.append(f"vllm:{name}_total{{{labels}}} {float(value)}")
+        return web.Response(text="\n".join(lines) + "\n", content_type="text/plain")
+
+    # -- lifecycle -----------------------------------------------------------
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/health", self._health)
+        app.router.add_get("/v1/models", self._models)
+        app.router.add_get("/metrics", self._metrics)
+        app.router.add_post("/tokenize", self._tokenize)
+        app.router.add_post("/reset_prefix_cache", self._reset_prefix_cache)
+        app.router.add_post("/v1/completions", self._completions)
+        app.router.add_post("/sleep", self._sleep)
+        app.router.add_post("/wake_up", self._wake_up)
+        app.router.add_get("/is_sleeping", self._is_sleeping)
+        app.router.add_post("/collective_rpc", self._collective_rpc)
+        app.router.add_post("/v1/load_lora_adapter", self._load_lora)
+        app.router.add_post("/v1/unload_lora_adapter", self._unload_lora)
+        return app
+
+    async def _start(self) -> None:
+        self._kick = asyncio.Event()
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port, backlog=4096, reuse_port=self.reuse_port).start()
+        self._engine_task = asyncio.create_task(self._engine_loop())
+
+    async def _stop(self) -> None:
+        await self._runner.cleanup()
+        self._engine_task.cancel()
+
+    def start(self) -> "FakeVLLM":
+        """Serve in a background thread; returns once the port is listening."""
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-vllm", daemon=True)
+        self._thread.start()
+        asyncio.run_coroutine_threadsafe(self._start(), self._loop).result(timeout=10)
+        return self
+
+    def stop(self) -> None:
+        """Shut the server down and join its thread."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._stop(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+
+    def __enter__(self) -> "FakeVLLM":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+@contextlib.contextmanager
+def fake_server(url: str, enabled: bool = True, **config) -> Iterator[FakeVLLM | None]:
+    """
+    Serve a FakeVLLM at `url` for the duration of the block, for a harness's --fake flag.
+
+    Harnesses don't store runs against the fake server in the result store:
+    its numbers describe the fake's latency model, not a deployment.
+
+    Args:
+        url: Where the harness will connect (host and port are served)
+        enabled: Serve nothing and yield None when False, so callers can
+            write `with fake_server(args.url, args.fake, ...):`
+        **config: FakeVLLMConfig fields
+
+    Yields:
+        The running server, or None when not enabled
+    """
+    if not enabled:
+        yield None
+        return
+    parsed = urlparse(url)
+    with FakeVLLM(FakeVLLMConfig(**config), parsed.hostname, parsed.port or 8000) as server:
+        yield server
+
+
+def _serve(config: FakeVLLMConfig, host: str, port: int, reuse_port: bool) -> None:
+    """Run one server until interrupted (a --workers process)."""
+    server = FakeVLLM(config, host, port, reuse_port=reuse_port).start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    import argparse
+    import multiprocessing
+    import signal
+
+    parser = argparse.ArgumentParser(description="Fake vLLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--model", default=FakeVLLMConfig.model)
+    parser.add_argument("--no-prefix-caching", action="store_true", help="Disable the prefix cache")
+    parser.add_argument("--no-chunked-prefill", action="store_true", help="Prefill prompts in one step")
+    parser.add_argument("--max-num-batched-tokens", type=int, default=FakeVLLMConfig.max_num_batched_tokens)
+    parser.add_argument("--max-num-seqs", type=int, default=FakeVLLMConfig.max_num_seqs)
+    parser.add_argument("--num-gpu-blocks", type=int, default=FakeVLLMConfig.num_gpu_blocks)
+    parser.add_argument("--max-loras", type=int, default=FakeVLLMConfig.max_loras)
+    parser.add_argument("--lora-modules", nargs="*", default=[], metavar="NAME=PATH", help="Adapters loaded at start")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=FakeVLLMConfig.prefill_ms_per_token)
+    parser.add_argument("--decode-ms-per-token", type=float, default=FakeVLLMConfig.decode_ms_per_token)
+    parser.add_argument("--time-scale", type=float, default=1.0, help="Multiply all latencies (0 = no waiting)")
+    parser.add_argument("--stream-interval", type=int, default=1, help="Tokens per SSE write after the first")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Server processes sharing the port, each with its own engine"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = FakeVLLMConfig(
+        model=args.model,
+        prefix_caching=not args.no_prefix_caching,
+        chunked_prefill=not args.no_chunked_prefill,
+        max_num_batched_tokens=args.max_num_batched_tokens,
+        max_num_seqs=args.max_num_seqs,
+        num_gpu_blocks=args.num_gpu_blocks,
+        max_loras=args.max_loras,
+        lora_modules=dict(spec.partition("=")[::2] for spec in args.lora_modules),
+        prefill_ms_per_token=args.prefill_ms_per_token,
+        decode_ms_per_token=args.decode_ms_per_token,
+        time_scale=args.time_scale,
+        stream_interval=args.stream_interval,
+        seed=args.seed,
+    )
+    signal.signal(signal.SIGTERM, signal.default_int_handler)  # Exit cleanly so the workers are stopped too
+    reuse_port = args.workers > 1
+    workers = [
+        multiprocessing.Process(
+            target=_serve, args=(replace(config, seed=config.seed + i), args.host, args.port, True), daemon=True
+        )
+        for i in range(1, args.workers)
+    ]
+    for worker in workers:
+        worker.start()
+    suffix = f" with {args.workers} workers" if workers else ""
+    print(f"Fake vLLM serving {config.model} on http://{args.host}:{args.port}{suffix} (Ctrl+C to stop)")
+    _serve(config, args.host, args.port, reuse_port)
@@ -0,0 +1,396 @@
+"""
+Background GPU memory sampling.
+
+get_gpu_memory_mb() starts a new nvidia-smi process per call (tens of
+milliseconds), reads only the first GPU, and only sees the instants it is
+called at. GPUMemorySampler instead keeps one long-lived source open and
+samples every GPU continuously into a fixed-size ring buffer, so a
+benchmark can ask for the peak, minimum or full series of any phase after
+the fact.
+
+Sources (all return per-GPU (used_mb, total_mb)):
+- NVMLBackend: in-process NVML queries (needs nvidia-ml-py, optional)
+- NvidiaSmiBackend: one `nvidia-smi -lms` process streaming readings
+- FakeBackend: reads readings from a file, for running without a GPU
+
+make_backend("auto") picks NVML, then nvidia-smi, and returns None when
+neither is available.
+"""
+
+import shutil
+import subprocess
+import threading
+import time
+from array import array
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+
+try:
+    import pynvml
+except ImportError:  # Optional: falls back to nvidia-smi
+    pynvml = None
+
+Reading = list[tuple[float, float]]  # Per GPU: (used_mb, total_mb)
+
+
+class NVMLBackend:
+    """Reads memory of every GPU through NVML."""
+
+    def __init__(self):
+        if pynvml is None:
+            raise RuntimeError("NVML backend needs nvidia-ml-py (pip install nvidia-ml-py)")
+        pynvml.nvmlInit()
+        self._handles = [
+            pynvml.nvmlDeviceGetHandleByIndex(i) for i in range(pynvml.nvmlDeviceGetCount())
+        ]
+
+    def read(self) -> Reading | None:
+        reading = []
+        for handle in self._handles:
+            info = pynvml.nvmlDeviceGetMemoryInfo(handle)
+            reading.append((info.used / 2**20, info.total / 2**20))
+        return reading
+
+    def close(self) -> None:
+        pynvml.nvmlShutdown()
+
+
+class NvidiaSmiBackend:
+    """
+    Keeps one `nvidia-smi --loop-ms` process running and parses its output.
+
+    nvidia-smi prints one CSV line per GPU every interval; a reader thread
+    keeps the latest line per GPU, and read() returns those.
+    """
+
+    def __init__(self, interval_ms: int = 50):
+        self._proc = subprocess.Popen(
+            [
+                "nvidia-smi",
+                "--query-gpu=index,memory.used,memory.total",
+                "--format=csv,noheader,nounits",
+                f"-lms={interval_ms}",
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        )
+        self._latest: dict[int, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._pump, name="nvidia-smi-reader", daemon=True)
+        self._thread.start()
+
+    def _pump(self) -> None:
+        for line in self._proc.stdout:
+            try:
+                index, used, total = (part.strip() for part in line.split(","))
+                value = (float(used), float(total))
+            except ValueError:
+                continue
+            with self._lock:
+                self._latest[int(index)] = value
+
+    def read(self) -> Reading | None:
+        with self._lock:
+            if not self._latest:
+                return None
+            return [self._latest[i] for i in sorted(self._latest)]
+
+    def close(self) -> None:
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+
+
+class FakeBackend:
+    """
+    Reads GPU memory from a text file, for tests and GPU-less runs.
+
+    The file holds one "used_mb,total_mb" line per GPU (the same format as
+    `nvidia-smi --query-gpu=memory.used,memory.total --format=csv,noheader,nounits`).
+    Rewrite it while sampling to simulate memory changing.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> Reading | None:
+        try:
+            with open(self.path) as f:
+                lines = [line for line in f.read().splitlines() if line.strip()]
+            return [tuple(float(part) for part in line.split(",")[:2]) for line in lines]
+        except (OSError, ValueError):
+            return None
+
+    def close(self) -> None:
+        pass
+
+
+def make_backend(spec: str = "auto", interval_ms: int = 50):
+    """
+    Create a memory source from a spec string.
+
+    Args:
+        spec: "auto", "nvml", "nvidia-smi" or "fake:PATH"
+        interval_ms: Streaming interval for nvidia-smi
+
+    Returns:
+        A backend, or None for "auto" when no GPU source is available.
+    """
+    if spec.startswith("fake:"):
+        return FakeBackend(spec[len("fake:") :])
+    if spec == "nvml":
+        return NVMLBackend()
+    if spec == "nvidia-smi":
+        return NvidiaSmiBackend(interval_ms)
+    if spec != "auto":
+        raise ValueError(f"Unknown GPU memory backend: {spec}")
+    if pynvml is not None:
+        try:
+            return NVMLBackend()
+        except pynvml.NVMLError:
+            pass
+    if shutil.which("nvidia-smi"):
+        return NvidiaSmiBackend(interval_ms)
+    return None
+
+
+@dataclass
+class MemoryPhase:
+    """Wall-clock span of a benchmark phase."""
+
+    name: str
+    start: float
+    end: float | None = None
+
+
+class GPUMemorySampler:
+    """
+    Continuous multi-GPU memory sampler with a ring buffer.
+
+    Timestamps are time.time(), the same clock MetricsSampler uses, so
+    memory and server-metric series of a phase line up.
+
+    Usage:
+        with GPUMemorySampler(interval=0.05) as mem:
+            with mem.phase("sleeping"):
+                router.sleep()
+                mem.wait_stable()
+        print(mem.phase_report("sleeping"))
+    """
+
+    def __init__(self, backend="auto", interval: float = 0.05, capacity: int = 65536):
+        """
+        Args:
+            backend: Backend instance or spec for make_backend()
+            interval: Seconds between samples
+            capacity: Samples kept per GPU before the oldest are overwritten
+        """
+        self.backend = make_backend(backend, int(interval * 1000)) if isinstance(backend, str) else backend
+        self.interval = interval
+        self.capacity = capacity
+        self.phases: dict[str, MemoryPhase] = {}
+        self.num_gpus = 0
+        self.total_mb: list[float] = []
+        self._times = array("d", bytes(8 * capacity))
+        self._used: list[array] = []
+        self._head = 0  # Next slot to write
+        self._count = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def available(self) -> bool:
+        """Whether a GPU memory source was found."""
+        return self.backend is not None
+
+    def sample(self) -> Reading | None:
+        """Take one reading now and append it to the buffer."""
+        if self.backend is None:
+            return None
+        reading = self.backend.read()
+        if not reading:
+            return None
+        now = time.time()
+        with self._lock:
+            if len(reading) != self.num_gpus:
+                self._resize(len(reading))
+            self.total_mb = [total for _, total in reading]
+            slot = self._head
+            self._times[slot] = now
+            for gpu, (used, _) in enumerate(reading):
+                self._used[gpu][slot] = used
+            self._head = (slot + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+        return reading
+
+    def _resize(self, num_gpus: int) -> None:
+        """(Re)allocate per-GPU buffers; drops history if the GPU count changes."""
+        self.num_gpus = num_gpus
+        self._used = [array("d", bytes(8 * self.capacity)) for _ in range(num_gpus)]
+        self._head = self._count = 0
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            self.sample()
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def start(self) -> "GPUMemorySampler":
+        """Start background sampling (no-op without a backend)."""
+        if self._thread is None and self.backend is not None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="gpu-memory-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop sampling and close the backend."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self.backend is not None:
+            self.backend.close()
+
+    def __enter__(self) -> "GPUMemorySampler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[MemoryPhase]:
+        """Mark a benchmark phase; samples taken during it can be queried by name."""
+        window = MemoryPhase(name=name, start=time.time())
+        self.phases[name] = window
+        self.sample()
+        try:
+            yield window
+        finally:
+            self.sample()
+            window.end = time.time()
+
+    def series(
+        self, gpu: int | None = None, name: str | None = None
+    ) -> list[tuple[float, float]]:
+        """
+        (timestamp, used_mb) samples in time order.
+
+        Args:
+            gpu: GPU index, or None for the sum over all GPUs
+            name: Limit to a phase
+        """
+        with self._lock:
+            count, head = self._count, self._head
+            order = [(head - count + i) % self.capacity for i in range(count)]
+            times = [self._times[i] for i in order]
+            if gpu is None:
+                values = [sum(buf[i] for buf in self._used) for i in order]
+            else:
+                values = [self._used[gpu][i] for i in order]
+        samples = list(zip(times, values))
+        if name is not None:
+            window = self.phases[name]
+            end = window.end if window.end is not None else float("inf")
+            samples = [(t, v) for t, v in samples if window.start <= t <= end]
+        return samples
+
+    def peak_mb(self, name: str | None = None, gpu: int | None = None) -> float | None:
+        values = [v for _, v in self.series(gpu, name)]
+        return max(values) if values else None
+
+    def min_mb(self, name: str | None = None, gpu: int | None = None) -> float | None:
+        values = [v for _, v in self.series(gpu, name)]
+        return min(values) if values else None
+
+    def latest(self, gpu: int = 0) -> dict | None:
+        """Most recent reading of one GPU, shaped like get_gpu_memory_mb()."""
+        with self._lock:
+            if not self._count or gpu >= self.num_gpus:
+                return None
+            used = self._used[gpu][(self._head - 1) % self.capacity]
+            total = self.total_mb[gpu]
+        return {"used_mb": int(used), "total_mb": int(total), "free_mb": int(total - used)}
+
+    def wait_stable(
+        self,
+        window_s: float = 0.3,
+        tolerance_mb: float = 32.0,
+        timeout_s: float = 10.0,
+        gpu: int = 0,
+    ) -> dict | None:
+        """
+        Block until memory stops changing, then return the latest reading.
+
+        Replaces fixed sleeps after sleep/wake: returns as soon as every
+        sample in the last `window_s` is within `tolerance_mb` of each other
+        (or after `timeout_s`).
+        """
+        if self.backend is None:
+            return None
+        deadline = time.time() + timeout_s
+        started = time.time()
+        while time.time() < deadline:
+            if self._thread is None:
+                self.sample()
+            now = time.time()
+            recent = [v for t, v in self.series(gpu) if t >= max(now - window_s, started)]
+            if now - started >= window_s and recent and max(recent) - min(recent) <= tolerance_mb:
+                break
+            time.sleep(self.interval)
+        return self.latest(gpu)
+
+    def phase_report(self, name: str) -> dict:
+        """Peak/min/start/end memory of a phase, total and per GPU."""
+        report = {}
+        for gpu, label in [(None, "total")] + [(i, f"gpu{i}") for i in range(self.num_gpus)]:
+            values = [v for _, v in self.series(gpu, name)]
+            if values:
+                report[f"{label}_peak_mb"] = max(values)
+                report[f"{label}_min_mb"] = min(values)
+                report[f"{label}_start_mb"] = values[0]
+                report[f"{label}_end_mb"] = values[-1]
+        if report:
+            report["samples"] = len(self.series(0, name))
+        return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+    import tempfile
+
+    parser = argparse.ArgumentParser(description="Sample GPU memory")
+    parser.add_argument("--backend", default="auto", help="auto, nvml, nvidia-smi or fake:PATH")
+    parser.add_argument("--interval", type=float, default=0.05, help="Seconds between samples")
+    parser.add_argument("--seconds", type=float, default=2.0, help="How long to sample")
+    args = parser.parse_args()
+
+    mem = GPUMemorySampler(args.backend, interval=args.interval)
+    fake_path = None
+    if not mem.available:
+        # No GPU here: demonstrate with a fake source that drops by 5GB mid-run
+        fd, fake_path = tempfile.mkstemp(suffix=".csv")
+        os.close(fd)
+        with open(fake_path, "w") as f:
+            f.write("7200,8192\n")
+        mem = GPUMemorySampler(FakeBackend(fake_path), interval=args.interval)
+        print(f"No GPU source found; using a fake source at {fake_path}")
+
+    with mem:
+        with mem.phase("run"):
+            time.sleep(args.seconds / 2)
+            if fake_path:
+                with open(fake_path, "w") as f:
+                    f.write("1930,8192\n")
+            time.sleep(args.seconds / 2)
+            settled = mem.wait_stable()
+    print(f"GPUs: {mem.num_gpus}, settled reading: {settled}")
+    print(f"Phase report: {mem.phase_report('run')}")
+    if fake_path:
+        os.unlink(fake_path)
@@ -0,0 +1,238 @@
+"""
+Fixed-memory latency histogram with bounded-error percentiles.
+
+Values are counted in logarithmically sized buckets (the same idea as HDR
+histograms and DDSketch): bucket i covers (gamma^(i-1), gamma^i] with
+gamma = (1 + e) / (1 - e), so any reported percentile is within a relative
+error `e` of the true value. Memory is fixed by the value range and the
+error bound (about 1,100 counters for 1us..1h at 1%), no matter how many
+values are recorded.
+
+- record() is O(1): one log, one array increment
+- quantile() walks the buckets once
+- merge() adds counters, so per-worker or per-process histograms can be
+  combined exactly; to_bytes()/from_bytes() move them across processes
+"""
+
+import math
+import struct
+from array import array
+from typing import Iterable
+
+DEFAULT_PERCENTILES = (50, 90, 99, 99.9)
+
+_HEADER = struct.Struct("<dddQdddd")
+
+
+class LatencyHistogram:
+    """Mergeable log-bucketed histogram of non-negative values (e.g. ms)."""
+
+    def __init__(
+        self,
+        relative_error: float = 0.01,
+        min_value: float = 0.001,
+        max_value: float = 3_600_000.0,
+    ):
+        """
+        Args:
+            relative_error: Max relative error of reported percentiles (0.01 = 1%)
+            min_value: Smallest distinguishable value; anything <= this counts as 0
+            max_value: Largest tracked value; anything above is clamped to it
+        """
+        if not 0 < relative_error < 1:
+            raise ValueError(f"relative_error must be in (0, 1), got {relative_error}")
+        if not 0 < min_value < max_value:
+            raise ValueError("need 0 < min_value < max_value")
+        self.relative_error = relative_error
+        self.min_value = min_value
+        self.max_value = max_value
+        self._gamma = (1 + relative_error) / (1 - relative_error)
+        self._inv_log_gamma = 1 / math.log(self._gamma)
+        self._offset = math.ceil(math.log(min_value) * self._inv_log_gamma)
+        num_buckets = math.ceil(math.log(max_value) * self._inv_log_gamma) - self._offset + 2
+        # Bucket 0 holds values <= min_value
+        self._counts = array("Q", bytes(8 * num_buckets))
+        self.count = 0
+        self.total = 0.0
+        self._sum_sq = 0.0
+        self._min = math.inf
+        self._max = -math.inf
+
+    def _index(self, value: float) -> int:
+        if value <= self.min_value:
+            return 0
+        if value >= self.max_value:
+            return len(self._counts) - 1
+        return math.ceil(math.log(value) * self._inv_log_gamma) - self._offset + 1
+
+    def _bucket_value(self, index: int) -> float:
+        """Representative value of a bucket (within relative_error of any member)."""
+        if index == 0:
+            return 0.0
+        upper = self._gamma ** (index + self._offset - 1)
+        return 2 * upper / (self._gamma + 1)
+
+    def record(self, value: float) -> None:
+        """Record one value."""
+        self._counts[self._index(value)] += 1
+        self.count += 1
+        self.total += value
+        self._sum_sq += value * value
+        if value < self._min:
+            self._min = value
+        if value > self._max:
+            self._max = value
+
+    def record_many(self, values: Iterable[float]) -> None:
+        """Record every value from an iterable."""
+        for value in values:
+            self.record(value)
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """Add another histogram's counts into this one. Returns self."""
+        if (
+            other.relative_error != self.relative_error
+            or other.min_value != self.min_value
+            or other.max_value != self.max_value
+        ):
+            raise ValueError("Cannot merge histograms with different configurations")
+        counts = self._counts
+        for i, c in enumerate(other._counts):
+            if c:
+                counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self._sum_sq += other._sum_sq
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        return self
+
+    @property
+    def min(self) -> float | None:
+        return self._min if self.count else None
+
+    @property
+    def max(self) -> float | None:
+        return self._max if self.count else None
+
+    @property
+    def mean(self) -> float | None:
+        return self.total / self.count if self.count else None
+
+    @property
+    def stdev(self) -> float | None:
+        """Sample standard deviation (exact, from running sums)."""
+        if self.count < 2:
+            return None
+        variance = (self._sum_sq - self.total * self.total / self.count) / (self.count - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    def quantile(self, q: float) -> float | None:
+        """Value at quantile q in [0, 1] (nearest rank, within relative_error)."""
+        if not self.count:
+            return None
+        if not 0 <= q <= 1:
+            raise ValueError(f"quantile must be in [0, 1], got {q}")
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for i, c in enumerate(self._counts):
+            seen += c
+            if seen >= rank:
+                # Never report outside the observed range
+                return min(max(self._bucket_value(i), self._min), self._max)
+        return self._max
+
+    def percentile(self, p: float) -> float | None:
+        """Value at percentile p in [0, 100]."""
+        return self.quantile(p / 100)
+
+    def summary(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> dict:
+        """Count, min, max, mean, stdev and the requested percentiles as a dict."""
+        result = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.mean,
+            "stdev": self.stdev,
+        }
+        for p in percentiles:
+            result[f"p{p:g}"] = self.percentile(p)
+        return result
+
+    def to_bytes(self) -> bytes:
+        """Serialize for sending to another process (see from_bytes)."""
+        header = _HEADER.pack(
+            self.relative_error,
+            self.min_value,
+            self.max_value,
+            self.count,
+            self.total,
+            self._sum_sq,
+            self._min,
+            self._max,
+        )
+        return header + self._counts.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "LatencyHistogram":
+        """Rebuild a histogram serialized with to_bytes()."""
+        fields = _HEADER.unpack_from(data)
+        hist = cls(relative_error=fields[0], min_value=fields[1], max_value=fields[2])
+        hist.count, hist.total, hist._sum_sq, hist._min, hist._max = fields[3:]
+        counts = array("Q")
+        counts.frombytes(data[_HEADER.size :])
+        if len(counts) != len(hist._counts):
+            raise ValueError("Serialized histogram has an unexpected bucket count")
+        hist._counts = counts
+        return hist
+
+
+def histogram_of(values: Iterable[float], **kwargs) -> LatencyHistogram:
+    """Build a histogram from an iterable of values."""
+    hist = LatencyHistogram(**kwargs)
+    hist.record_many(values)
+    return hist
+
+
+def print_latency_summary(
+    title: str,
+    hist: LatencyHistogram,
+    unit: str = "ms",
+    percentiles: Iterable[float] = DEFAULT_PERCENTILES,
+) -> None:
+    """Print the standard results block used by every benchmark."""
+    print(f"\n{title} ({hist.count} samples):")
+    if not hist.count:
+        return
+    print(f"  Min:    {hist.min:.1f}{unit}")
+    for p in percentiles:
+        label = f"p{p:g}:"
+        print(f"  {label:<7} {hist.percentile(p):.1f}{unit}")
+    print(f"  Max:    {hist.max:.1f}{unit}")
+    print(f"  Mean:   {hist.mean:.1f}{unit}")
+    if hist.stdev is not None:
+        print(f"  Stdev:  {hist.stdev:.1f}{unit}")
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Accuracy and speed check against exact percentiles
+    values = [random.lognormvariate(3, 1) for _ in range(1_000_000)]
+    hist = LatencyHistogram()
+    start = time.perf_counter()
+    hist.record_many(values)
+    elapsed = time.perf_counter() - start
+    print(f"Recorded {hist.count} values in {elapsed:.2f}s ({elapsed / hist.count * 1e9:.0f}ns each)")
+
+    exact = sorted(values)
+    for p in DEFAULT_PERCENTILES:
+        true = exact[max(0, math.ceil(p / 100 * len(exact)) - 1)]
+        approx = hist.percentile(p)
+        print(f"  p{p:<5g} exact {true:9.3f}  histogram {approx:9.3f}  err {abs(approx - true) / true:.3%}")
+
+    # Merging two halves gives the same answer as one histogram
+    a, b = histogram_of(values[::2]), histogram_of(values[1::2])
+    merged = LatencyHistogram.from_bytes(a.merge(b).to_bytes())
+    print(f"Merged p99: {merged.percentile(99):.3f} (single: {hist.percentile(99):.3f})")
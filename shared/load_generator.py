@@ -0,0 +1,239 @@
+"""
+Open-loop load generation for vLLM benchmarks.
+
+A closed-loop client waits for responses before sending more, so it can
+never offer more load than the server absorbs and hides queueing delay.
+The helpers here send requests on a fixed arrival schedule instead,
+independent of when earlier requests finish.
+
+Schedules are lists of send offsets in seconds from the start of the run:
+- constant: evenly spaced at a fixed rate
+- poisson: exponential inter-arrival times (memoryless traffic)
+- bursty: groups of requests arriving together, bursts Poisson-spaced
+- trace: replayed timestamps from a recorded workload
+"""
+
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Sequence
+
+from .histogram import LatencyHistogram
+
+ARRIVAL_KINDS = ("constant", "poisson", "bursty", "trace")
+
+
+def constant_schedule(rate: float, count: int) -> list[float]:
+    """Evenly spaced arrivals at `rate` requests per second."""
+    if rate <= 0:
+        raise ValueError(f"rate must be positive, got {rate}")
+    return [i / rate for i in range(count)]
+
+
+def poisson_schedule(rate: float, count: int, seed: int | None = None) -> list[float]:
+    """Poisson arrivals with mean `rate` requests per second."""
+    if rate <= 0:
+        raise ValueError(f"rate must be positive, got {rate}")
+    rng = random.Random(seed)
+    offsets = []
+    t = 0.0
+    for _ in range(count):
+        offsets.append(t)
+        t += rng.expovariate(rate)
+    return offsets
+
+
+def bursty_schedule(
+    rate: float, count: int, burst_size: int = 10, seed: int | None = None
+) -> list[float]:
+    """
+    Bursts of `burst_size` simultaneous arrivals.
+
+    Burst start times are Poisson-spaced so the long-run average stays at
+    `rate` requests per second.
+    """
+    if rate <= 0:
+        raise ValueError(f"rate must be positive, got {rate}")
+    if burst_size < 1:
+        raise ValueError(f"burst_size must be >= 1, got {burst_size}")
+    rng = random.Random(seed)
+    burst_rate = rate / burst_size
+    offsets = []
+    t = 0.0
+    while len(offsets) < count:
+        offsets.extend([t] * min(burst_size, count - len(offsets)))
+        t += rng.expovariate(burst_rate)
+    return offsets
+
+
+def trace_schedule(timestamps: Sequence[float], speedup: float = 1.0) -> list[float]:
+    """
+    Replay recorded arrival timestamps.
+
+    Timestamps are shifted so the first arrival is at 0 and divided by
+    `speedup` (2.0 replays the trace twice as fast).
+    """
+    if not timestamps:
+        return []
+    if speedup <= 0:
+        raise ValueError(f"speedup must be positive, got {speedup}")
+    ordered = sorted(timestamps)
+    first = ordered[0]
+    return [(ts - first) / speedup for ts in ordered]
+
+
+def load_trace_timestamps(path: str, field: str = "timestamp") -> list[float]:
+    """Read arrival timestamps (seconds) from a JSONL file, one record per line."""
+    timestamps = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                timestamps.append(float(json.loads(line)[field]))
+    return timestamps
+
+
+def make_schedule(
+    kind: str,
+    count: int,
+    rate: float | None = None,
+    burst_size: int = 10,
+    trace_path: str | None = None,
+    speedup: float = 1.0,
+    seed: int | None = None,
+) -> list[float]:
+    """
+    Build a schedule by name; see ARRIVAL_KINDS.
+
+    A trace must hold at least `count` timestamps; only the first `count`
+    arrivals are used.
+    """
+    if kind == "trace":
+        if not trace_path:
+            raise ValueError("trace arrivals need a trace_path")
+        timestamps = load_trace_timestamps(trace_path)
+        if len(timestamps) < count:
+            raise ValueError(f"{trace_path} has {len(timestamps)} timestamps, fewer than the {count} requests to send")
+        return trace_schedule(timestamps, speedup)[:count]
+    if rate is None:
+        raise ValueError(f"{kind} arrivals need a rate")
+    if kind == "constant":
+        return constant_schedule(rate, count)
+    if kind == "poisson":
+        return poisson_schedule(rate, count, seed)
+    if kind == "bursty":
+        return bursty_schedule(rate, count, burst_size, seed)
+    raise ValueError(f"Unknown arrival kind: {kind}")
+
+
+@dataclass
+class SendRecord:
+    """Timing of one open-loop request."""
+
+    index: int
+    scheduled_s: float  # Intended send offset from run start
+    sent_s: float = 0.0  # Actual send offset from run start
+    done_s: float = 0.0  # Completion offset from run start
+    result: Any = None
+    error: str | None = None
+
+    @property
+    def lag_ms(self) -> float:
+        """How late the request was sent relative to its schedule."""
+        return (self.sent_s - self.scheduled_s) * 1000
+
+    @property
+    def latency_ms(self) -> float:
+        """Time from actual send to completion."""
+        return (self.done_s - self.sent_s) * 1000
+
+
+async def run_open_loop(
+    schedule: Sequence[float],
+    send: Callable[[int], Awaitable[Any]],
+    max_in_flight: int | None = None,
+) -> list[SendRecord]:
+    """
+    Send requests on `schedule` regardless of when earlier ones finish.
+
+    Args:
+        schedule: Send offsets in seconds (non-decreasing)
+        send: Coroutine factory called with the request index
+        max_in_flight: Optional cap on outstanding requests. When the cap is
+            hit, sends fall behind schedule and that shows up as lag.
+
+    Returns:
+        One SendRecord per scheduled request, in schedule order.
+    """
+    records = [SendRecord(index=i, scheduled_s=offset) for i, offset in enumerate(schedule)]
+    limit = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+    clock = time.perf_counter
+    start = clock()
+
+    async def fire(record: SendRecord):
+        try:
+            record.result = await send(record.index)
+        except Exception as e:
+            record.error = f"{type(e).__name__}: {e}"
+        finally:
+            record.done_s = clock() - start
+            if limit:
+                limit.release()
+
+    tasks = []
+    for record in records:
+        delay = record.scheduled_s - (clock() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if limit:
+            await limit.acquire()
+        record.sent_s = clock() - start
+        tasks.append(asyncio.create_task(fire(record)))
+
+    await asyncio.gather(*tasks)
+    return records
+
+
+def summarize_send_lag(records: list[SendRecord]) -> dict:
+    """
+    Summarize how faithfully the offered load followed the schedule.
+
+    Returns a dict with offered/achieved send rates and lag percentiles.
+    A large lag means the generator, not the server, limited the load.
+    """
+    if not records:
+        return {}
+    lags = LatencyHistogram()
+    for r in records:
+        # Sends can wake a few microseconds early; count those as on time
+        lags.record(max(r.lag_ms, 0.0))
+    span = records[-1].scheduled_s - records[0].scheduled_s
+    sent_span = max(r.sent_s for r in records) - min(r.sent_s for r in records)
+
+    return {
+        "requests": len(records),
+        "errors": sum(1 for r in records if r.error),
+        "offered_rps": (len(records) - 1) / span if span > 0 else None,
+        "achieved_rps": (len(records) - 1) / sent_span if sent_span > 0 else None,
+        "lag_p50_ms": lags.percentile(50),
+        "lag_p99_ms": lags.percentile(99),
+        "lag_max_ms": lags.max,
+    }
+
+
+if __name__ == "__main__":
+    # Drive a no-op coroutine to show generator accuracy on this host
+    async def _noop(_index: int) -> None:
+        await asyncio.sleep(0.05)
+
+    for kind in ("constant", "poisson", "bursty"):
+        schedule = make_schedule(kind, count=500, rate=200, seed=0)
+        records = asyncio.run(run_open_loop(schedule, _noop))
+        summary = summarize_send_lag(records)
+        print(
+            f"{kind:>8}: offered {summary['offered_rps']:.0f} rps, "
+            f"achieved {summary['achieved_rps']:.0f} rps, "
+            f"lag p50 {summary['lag_p50_ms']:.2f}ms p99 {summary['lag_p99_ms']:.2f}ms"
+        )
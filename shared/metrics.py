@@ -2,11 +2,15 @@
 Metrics utilities for measuring vLLM performance.
 """
 
+import asyncio
+import bisect
 import subprocess
+import threading
 import time
-from contextlib import contextmanager
-from dataclasses import dataclass
-from typing import Iterator
+from array import array
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Iterator
 
 import requests
 from prometheus_client.parser import text_string_to_metric_families
@@ -59,8 +63,9 @@ def get_vllm_metrics(base_url: str = "http://localhost:8000") -> dict | None:
         - ttft_avg_ms: Average time to first token (ms)
         - tpot_avg_ms: Average time per output token (ms)
         - e2e_latency_avg_ms: Average end-to-end request latency (ms)
-        - requests_total: Total requests processed
-        - tokens_total: Total tokens generated
+        - requests_success: Total requests finished
+        - prefix_cache_hits / prefix_cache_queries: Prompt tokens found in /
+          looked up in the prefix cache, and prefix_cache_hit_rate
     """
     try:
         resp = requests.get(f"{base_url}/metrics", timeout=5)
@@ -84,8 +89,11 @@ def _parse_prometheus_metrics(text: str) -> dict:
         "vllm:num_requests_running": "requests_running",
         "vllm:num_requests_waiting": "requests_waiting",
     }
+    # Matched on sample names: the parser strips "_total" from family names
     counter_metrics = {
         "vllm:request_success_total": "requests_success",
+        "vllm:prefix_cache_hits_total": "prefix_cache_hits",
+        "vllm:prefix_cache_queries_total": "prefix_cache_queries",
     }
 
     for family in text_string_to_metric_families(text):
@@ -112,19 +120,352 @@ def _parse_prometheus_metrics(text: str) -> dict:
             for sample in family.samples:
                 metrics[key] = int(sample.value)
 
-        # Handle counters
-        elif name in counter_metrics:
-            key = counter_metrics[name]
+        # Handle counters, summed over label sets
+        else:
             for sample in family.samples:
-                metrics[key] = int(sample.value)
+                key = counter_metrics.get(sample.name)
+                if key:
+                    metrics[key] = metrics.get(key, 0) + int(sample.value)
+
+    if metrics.get("prefix_cache_queries"):
+        metrics["prefix_cache_hit_rate"] = metrics.get("prefix_cache_hits", 0) / metrics["prefix_cache_queries"]
 
     return metrics
 
 
+# vLLM metric families kept by the sampler, mapped to short keys
+SAMPLED_HISTOGRAMS = {
+    "vllm:time_to_first_token_seconds": "ttft",
+    "vllm:time_per_output_token_seconds": "tpot",
+    "vllm:e2e_request_latency_seconds": "e2e_latency",
+    "vllm:request_queue_time_seconds": "queue_time",
+}
+SAMPLED_GAUGES = {
+    "vllm:num_requests_running": "requests_running",
+    "vllm:num_requests_waiting": "requests_waiting",
+    "vllm:kv_cache_usage_perc": "kv_cache_usage",
+    "vllm:gpu_cache_usage_perc": "kv_cache_usage",
+}
+SAMPLED_COUNTERS = {
+    "vllm:request_success_total": "requests_success",
+    "vllm:prompt_tokens_total": "prompt_tokens",
+    "vllm:generation_tokens_total": "generation_tokens",
+    "vllm:prefix_cache_hits_total": "prefix_cache_hits",  # Prompt tokens served from the prefix cache
+    "vllm:prefix_cache_queries_total": "prefix_cache_queries",  # Prompt tokens looked up
+}
+
+
+@dataclass
+class BucketHistogram:
+    """
+    Raw cumulative bucket counts of one Prometheus histogram.
+
+    Label sets (engine, model_name, ...) are summed together.
+    """
+
+    bounds: list[float]  # Bucket upper bounds ("le"), ascending, last is +Inf
+    counts: list[float]  # Cumulative counts per bound
+    sum: float = 0.0
+    count: float = 0.0
+
+    def delta(self, earlier: "BucketHistogram") -> "BucketHistogram":
+        """Observations recorded between `earlier` and this snapshot."""
+        if earlier.bounds != self.bounds:
+            raise ValueError("Cannot diff histograms with different buckets")
+        return BucketHistogram(
+            bounds=self.bounds,
+            counts=[a - b for a, b in zip(self.counts, earlier.counts)],
+            sum=self.sum - earlier.sum,
+            count=self.count - earlier.count,
+        )
+
+    def quantile(self, q: float) -> float | None:
+        """
+        Estimate quantile q in [0, 1], interpolating linearly within a bucket.
+
+        Same estimate as PromQL's histogram_quantile(). Values in the +Inf
+        bucket are reported as the highest finite bound.
+        """
+        if self.count <= 0 or not self.counts:
+            return None
+        rank = q * self.counts[-1]
+        i = bisect.bisect_left(self.counts, rank)
+        if i >= len(self.bounds) - 1:
+            return self.bounds[-2] if len(self.bounds) > 1 else None
+        lower = self.bounds[i - 1] if i > 0 else 0.0
+        below = self.counts[i - 1] if i > 0 else 0.0
+        in_bucket = self.counts[i] - below
+        if in_bucket <= 0:
+            return self.bounds[i]
+        return lower + (self.bounds[i] - lower) * (rank - below) / in_bucket
+
+    @property
+    def mean(self) -> float | None:
+        return self.sum / self.count if self.count > 0 else None
+
+
+@dataclass
+class MetricsSnapshot:
+    """One scrape of /metrics: raw histograms, gauges and counters."""
+
+    timestamp: float
+    histograms: dict[str, BucketHistogram] = field(default_factory=dict)
+    gauges: dict[str, float] = field(default_factory=dict)
+    counters: dict[str, float] = field(default_factory=dict)
+
+    def delta(self, earlier: "MetricsSnapshot") -> "MetricsSnapshot":
+        """
+        Histogram and counter increases since `earlier`.
+
+        Gauges are point-in-time values, so the later snapshot's are kept.
+        """
+        return MetricsSnapshot(
+            timestamp=self.timestamp,
+            histograms={
+                key: hist.delta(earlier.histograms[key])
+                for key, hist in self.histograms.items()
+                if key in earlier.histograms
+            },
+            gauges=dict(self.gauges),
+            counters={
+                key: value - earlier.counters.get(key, 0.0) for key, value in self.counters.items()
+            },
+        )
+
+
+def parse_metrics_snapshot(text: str, timestamp: float | None = None) -> MetricsSnapshot:
+    """Parse a /metrics payload into a MetricsSnapshot with raw bucket counts."""
+    snapshot = MetricsSnapshot(timestamp=time.time() if timestamp is None else timestamp)
+    buckets: dict[str, dict[float, float]] = {}
+
+    for family in text_string_to_metric_families(text):
+        name = family.name
+        if name in SAMPLED_HISTOGRAMS:
+            key = SAMPLED_HISTOGRAMS[name]
+            per_bound = buckets.setdefault(key, {})
+            hist = snapshot.histograms.setdefault(key, BucketHistogram(bounds=[], counts=[]))
+            for sample in family.samples:
+                if sample.name.endswith("_bucket"):
+                    bound = float(sample.labels["le"])
+                    per_bound[bound] = per_bound.get(bound, 0.0) + sample.value
+                elif sample.name.endswith("_sum"):
+                    hist.sum += sample.value
+                elif sample.name.endswith("_count"):
+                    hist.count += sample.value
+        elif name in SAMPLED_GAUGES:
+            key = SAMPLED_GAUGES[name]
+            snapshot.gauges[key] = sum(sample.value for sample in family.samples)
+        else:
+            for sample in family.samples:
+                key = SAMPLED_COUNTERS.get(sample.name)
+                if key:
+                    snapshot.counters[key] = snapshot.counters.get(key, 0.0) + sample.value
+
+    for key, per_bound in buckets.items():
+        bounds = sorted(per_bound)
+        snapshot.histograms[key].bounds = bounds
+        snapshot.histograms[key].counts = [per_bound[b] for b in bounds]
+
+    return snapshot
+
+
+@dataclass
+class PhaseWindow:
+    """Server metrics captured at the start and end of a benchmark phase."""
+
+    name: str
+    start: MetricsSnapshot | None
+    end: MetricsSnapshot | None = None
+
+
+class MetricsSampler:
+    """
+    Background scraper for vLLM's /metrics endpoint.
+
+    Polls at a fixed interval (parsing with the low-allocation
+    VLLMMetricsParser) and keeps gauge time series
+    (running/waiting requests, KV cache usage) in compact arrays. Benchmark
+    phases take a scrape at their start and end, so histogram percentiles
+    and counters can be computed from the exact delta of that phase instead
+    of from cumulative server totals that include warm-up and earlier runs.
+
+    Usage:
+        with MetricsSampler(base_url, interval=0.1) as sampler:
+            with sampler.phase("high_reuse"):
+                run_requests()
+        print(sampler.phase_report("high_reuse"))
+
+    Inside a coroutine use `async with sampler.async_phase(name)`, which
+    scrapes in a worker thread instead of blocking the event loop.
+    """
+
+    def __init__(self, base_url: str = "http://localhost:8000", interval: float = 0.5):
+        self.base_url = base_url.rstrip("/")
+        self.interval = interval
+        self.phases: dict[str, PhaseWindow] = {}
+        self.series_time = array("d")
+        self.series: dict[str, array] = {key: array("d") for key in set(SAMPLED_GAUGES.values())}
+        self.errors = 0
+        # Imported here: prom_parser builds on the snapshot types in this module
+        from .prom_parser import VLLMMetricsParser
+
+        self._parser = VLLMMetricsParser()
+        self._session = requests.Session()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def scrape(self) -> MetricsSnapshot | None:
+        """Scrape /metrics once and append its gauges to the time series."""
+        try:
+            resp = self._session.get(f"{self.base_url}/metrics", timeout=5)
+            resp.raise_for_status()
+        except requests.RequestException:
+            self.errors += 1
+            return None
+        snapshot = self._parser.parse(resp.content)
+        with self._lock:
+            self.series_time.append(snapshot.timestamp)
+            for key, values in self.series.items():
+                values.append(snapshot.gauges.get(key, 0.0))
+        return snapshot
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            self.scrape()
+            self._stop.wait(max(0.0, self.interval - (time.perf_counter() - started)))
+
+    def start(self) -> "MetricsSampler":
+        """Start background polling."""
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop background polling."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self) -> "MetricsSampler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[PhaseWindow]:
+        """
+        Bracket a benchmark phase with scrapes at its start and end.
+
+        If either scrape fails the phase has no report, but the benchmark
+        itself still runs.
+        """
+        window = PhaseWindow(name=name, start=self.scrape())
+        self.phases[name] = window
+        try:
+            yield window
+        finally:
+            window.end = self.scrape()
+
+    @asynccontextmanager
+    async def async_phase(self, name: str) -> AsyncIterator[PhaseWindow]:
+        """phase() for async benchmarks: the scrapes don't stall streams in flight."""
+        window = PhaseWindow(name=name, start=await asyncio.to_thread(self.scrape))
+        self.phases[name] = window
+        try:
+            yield window
+        finally:
+            window.end = await asyncio.to_thread(self.scrape)
+
+    def phase_delta(self, name: str) -> MetricsSnapshot | None:
+        """Exact histogram/counter increase during a phase."""
+        window = self.phases.get(name)
+        if window is None or window.start is None or window.end is None:
+            return None
+        return window.end.delta(window.start)
+
+    def gauge_series(self, key: str, name: str | None = None) -> list[tuple[float, float]]:
+        """(timestamp, value) samples of a gauge, optionally limited to a phase."""
+        with self._lock:
+            times = list(self.series_time)
+            values = list(self.series[key])
+        if name is not None:
+            window = self.phases[name]
+            if window.start is None:
+                return []
+            t0 = window.start.timestamp
+            t1 = window.end.timestamp if window.end else float("inf")
+            return [(t, v) for t, v in zip(times, values) if t0 <= t <= t1]
+        return list(zip(times, values))
+
+    def phase_report(self, name: str, quantiles: tuple[float, ...] = (0.5, 0.9, 0.99)) -> dict:
+        """
+        Server-side summary of a phase.
+
+        Returns a flat dict with request/token counts (plus
+        'prefix_cache_hit_rate' when the server reports prefix cache
+        queries), per-histogram mean and percentiles in ms (e.g.
+        'ttft_p99_ms'), and peak/mean gauge values.
+        """
+        delta = self.phase_delta(name)
+        if delta is None:
+            return {}
+        report = {key: value for key, value in delta.counters.items()}
+        if report.get("prefix_cache_queries"):
+            report["prefix_cache_hit_rate"] = report.get("prefix_cache_hits", 0.0) / report["prefix_cache_queries"]
+        for key, hist in delta.histograms.items():
+            report[f"{key}_count"] = hist.count
+            if hist.mean is not None:
+                report[f"{key}_avg_ms"] = hist.mean * 1000
+            for q in quantiles:
+                value = hist.quantile(q)
+                if value is not None:
+                    report[f"{key}_p{q * 100:g}_ms"] = value * 1000
+        for key in self.series:
+            values = [v for _, v in self.gauge_series(key, name)]
+            if values:
+                report[f"{key}_max"] = max(values)
+                report[f"{key}_mean"] = sum(values) / len(values)
+        return report
+
+
+def print_phase_report(title: str, report: dict) -> None:
+    """Print the server-side block of a phase report."""
+    print(f"\n{title} (server-side, this phase only):")
+    if not report:
+        print("  not available")
+        return
+    print(f"  Requests: {report.get('ttft_count', 0):.0f}")
+    for key, label in (("ttft", "TTFT"), ("tpot", "TPOT"), ("e2e_latency", "E2E")):
+        if f"{key}_p50_ms" in report:
+            print(
+                f"  {label:<5} p50 {report[f'{key}_p50_ms']:.1f}ms, "
+                f"p90 {report[f'{key}_p90_ms']:.1f}ms, p99 {report[f'{key}_p99_ms']:.1f}ms"
+            )
+    if "prefix_cache_hit_rate" in report:
+        print(
+            f"  Prefix cache hit rate {report['prefix_cache_hit_rate']:.1%} "
+            f"({report['prefix_cache_hits']:.0f} of {report['prefix_cache_queries']:.0f} prompt tokens)"
+        )
+    if "requests_running_max" in report:
+        print(
+            f"  Running max {report['requests_running_max']:.0f}, "
+            f"waiting max {report['requests_waiting_max']:.0f}"
+        )
+
+
 def get_gpu_memory_mb() -> dict | None:
     """
     Get GPU memory usage via nvidia-smi.
 
+    Starts a new nvidia-smi process and reads only the first GPU; for
+    continuous or multi-GPU measurement use gpu_memory.GPUMemorySampler.
+
     Returns:
         Dict with 'used_mb', 'total_mb', 'free_mb' or None if unavailable.
     """
@@ -0,0 +1,375 @@
+"""
+A/B orchestrator - Run an experiment's compose variants and compare them.
+
+Comparing APC on vs off or chunked prefill on vs off used to mean bringing
+each variant up by hand, running the benchmark, tearing it down, and
+copying numbers into report.md. The orchestrator automates the loop:
+
+    for each round:                       (variant order alternates: AB, BA, ...)
+        for each variant:
+            compose up -> wait for /health -> run one trial -> compose down
+
+Alternating the order per round spreads slow drift (thermals, background
+load) over both variants. Each trial calls the experiment's own
+run_benchmark() and keeps the numbers it returns; the report gives every
+metric's mean with a 95% confidence interval (Student's t) and the
+difference between variants with a Welch confidence interval.
+
+The stub backend replaces Docker and vLLM with shared/fake_vllm.py, so the
+whole pipeline runs on a laptop:
+
+    python -m shared.orchestrator prefix_caching --trials 5
+    python -m shared.orchestrator chunked_prefill --backend stub --trials 3
+"""
+
+import asyncio
+import contextlib
+import importlib.util
+import io
+import json
+import math
+import os
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+
+import requests
+
+from .fake_vllm import FakeVLLM, FakeVLLMConfig
+from .stats import diff_ci, mean_ci
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class Variant:
+    """One configuration of an experiment."""
+
+    name: str
+    compose_file: str  # Relative to the experiment directory
+    fake: dict = field(default_factory=dict)  # FakeVLLMConfig overrides for the stub backend
+    environment: dict = field(default_factory=dict)  # Extra variables for compose interpolation
+
+
+@dataclass
+class Metric:
+    """A number returned by the experiment's run_benchmark()."""
+
+    key: str
+    label: str
+    lower_is_better: bool = True
+
+
+@dataclass
+class Experiment:
+    """An experiment with paired variants and a trial function."""
+
+    name: str
+    directory: str  # Relative to the repo root
+    variants: list[Variant]
+    metrics: list[Metric]
+    trial: Callable[[object, str, dict], dict]  # (benchmark module, url, options) -> results
+
+
+def _prefix_caching_trial(module, url: str, options: dict) -> dict:
+    from .vllm_client import VLLMClient
+
+    return module.run_benchmark(
+        VLLMClient(base_url=url),
+        num_prompts=options.get("prompts", 10),
+        max_tokens=options.get("max_tokens", 20),
+    )
+
+
+def _chunked_prefill_trial(module, url: str, options: dict) -> dict:
+    from .vllm_client import AsyncVLLMClient
+
+    async def run():
+        async with AsyncVLLMClient(base_url=url) as client:
+            return await module.run_benchmark(
+                client,
+                num_short=options.get("short", 10),
+                num_long=options.get("long", 3),
+                max_tokens=options.get("max_tokens", 10),
+            )
+
+    return asyncio.run(run())
+
+
+EXPERIMENTS = {
+    "prefix_caching": Experiment(
+        name="prefix_caching",
+        directory="experiments/02_prefix_caching",
+        variants=[
+            Variant("apc_on", "docker-compose.yml", {"prefix_caching": True}),
+            Variant("apc_off", "docker-compose.no-cache.yml", {"prefix_caching": False}),
+        ],
+        metrics=[
+            Metric("high_reuse_ttft_ms", "High-reuse TTFT mean (ms)"),
+            Metric("high_reuse_ttft_p99_ms", "High-reuse TTFT p99 (ms)"),
+            Metric("no_reuse_ttft_ms", "No-reuse TTFT mean (ms)"),
+            Metric("no_reuse_ttft_p99_ms", "No-reuse TTFT p99 (ms)"),
+        ],
+        trial=_prefix_caching_trial,
+    ),
+    "chunked_prefill": Experiment(
+        name="chunked_prefill",
+        directory="experiments/03_chunked_prefill",
+        variants=[
+            Variant("chunked", "docker-compose.yml", {"chunked_prefill": True}),
+            Variant("no_chunk", "docker-compose.no-chunk.yml", {"chunked_prefill": False}),
+        ],
+        metrics=[
+            Metric("short_ttft_mean_ms", "Short TTFT mean (ms)"),
+            Metric("short_ttft_p99_ms", "Short TTFT p99 (ms)"),
+            Metric("long_ttft_mean_ms", "Long TTFT mean (ms)"),
+            Metric("tpot_mean_ms", "TPOT mean (ms)"),
+            Metric("max_stall_ms", "Longest decode stall (ms)"),
+        ],
+        trial=_chunked_prefill_trial,
+    ),
+}
+
+
+class ComposeBackend:
+    """Brings variants up and down with docker compose."""
+
+    def __init__(self, env_file: str = os.path.join(REPO_ROOT, ".env"), timeout_s: float = 900.0):
+        self.env_file = env_file
+        self.timeout_s = timeout_s
+
+    def _compose(self, experiment: Experiment, variant: Variant, *args: str) -> None:
+        path = os.path.join(REPO_ROOT, experiment.directory, variant.compose_file)
+        cmd = ["docker", "compose", "--env-file", self.env_file, "-f", path, *args]
+        env = {**os.environ, **variant.environment}
+        subprocess.run(cmd, check=True, capture_output=True, timeout=self.timeout_s, env=env)
+
+    def up(self, experiment: Experiment, variant: Variant) -> None:
+        self._compose(experiment, variant, "up", "-d")
+
+    def down(self, experiment: Experiment, variant: Variant) -> None:
+        self._compose(experiment, variant, "down", "--remove-orphans")
+
+
+class StubBackend:
+    """Serves each variant with an in-process FakeVLLM instead of a container."""
+
+    def __init__(self, port: int = 8000, seed: int = 0):
+        self.port = port
+        self.seed = seed
+        self._server: FakeVLLM | None = None
+        self._starts = 0
+
+    def up(self, experiment: Experiment, variant: Variant) -> None:
+        # A fresh seed per bring-up, like run-to-run noise on real hardware
+        config = FakeVLLMConfig(seed=self.seed + self._starts, **variant.fake)
+        self._starts += 1
+        self._server = FakeVLLM(config, port=self.port).start()
+
+    def down(self, experiment: Experiment, variant: Variant) -> None:
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+
+
+def wait_healthy(url: str, timeout_s: float = 600.0, interval_s: float = 1.0) -> float | None:
+    """
+    Poll /health until it succeeds.
+
+    Returns:
+        Seconds until healthy, or None on timeout.
+    """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout_s:
+        try:
+            if requests.get(f"{url}/health", timeout=5).status_code == 200:
+                return time.perf_counter() - start
+        except requests.RequestException:
+            pass
+        time.sleep(interval_s)
+    return None
+
+
+def load_benchmark(experiment: Experiment):
+    """Import an experiment's benchmark.py (its directory goes on sys.path for sibling imports)."""
+    directory = os.path.join(REPO_ROOT, experiment.directory)
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+    spec = importlib.util.spec_from_file_location(
+        f"{experiment.name}_benchmark", os.path.join(directory, "benchmark.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def run_ab(
+    experiment: Experiment,
+    backend,
+    url: str = "http://localhost:8000",
+    trials: int = 5,
+    options: dict | None = None,
+    health_timeout_s: float = 600.0,
+    verbose: bool = False,
+) -> dict:
+    """
+    Run interleaved trials of every variant.
+
+    Args:
+        experiment: What to run (see EXPERIMENTS)
+        backend: ComposeBackend or StubBackend
+        url: Where the variant serves once up
+        trials: Trials per variant
+        options: Passed to the experiment's trial function (prompt counts, ...)
+        health_timeout_s: Give up on a bring-up after this long
+        verbose: Show the benchmark's own output
+
+    Returns:
+        Dict with 'samples' (variant -> metric -> values per trial),
+        'startup_s' (variant -> seconds to healthy) and 'failures'.
+    """
+    module = load_benchmark(experiment)
+    samples = {v.name: {m.key: [] for m in experiment.metrics} for v in experiment.variants}
+    startup = {v.name: [] for v in experiment.variants}
+    failures = []
+
+    for round_index in range(trials):
+        order = experiment.variants if round_index % 2 == 0 else experiment.variants[::-1]
+        for variant in order:
+            label = f"[{round_index + 1}/{trials}] {variant.name}"
+            print(f"{label}: starting...", flush=True)
+            try:
+                backend.up(experiment, variant)
+                ready = wait_healthy(url, health_timeout_s)
+                if ready is None:
+                    failures.append(f"{label}: not healthy after {health_timeout_s:.0f}s")
+                    print(f"{label}: FAILED (not healthy)")
+                    continue
+                startup[variant.name].append(ready)
+                output = None if verbose else io.StringIO()
+                with contextlib.redirect_stdout(output) if output else contextlib.nullcontext():
+                    result = experiment.trial(module, url, options or {})
+                if not result:
+                    failures.append(f"{label}: benchmark returned no results")
+                    print(f"{label}: FAILED (no results)")
+                    continue
+                for metric in experiment.metrics:
+                    value = result.get(metric.key)
+                    if value is not None:
+                        samples[variant.name][metric.key].append(value)
+                print(f"{label}: done (healthy after {ready:.1f}s)")
+            except Exception as e:
+                # A failed bring-up or trial costs one trial, not the whole comparison
+                failures.append(f"{label}: {type(e).__name__}: {e}")
+                print(f"{label}: FAILED ({type(e).__name__}: {e})")
+            finally:
+                try:
+                    backend.down(experiment, variant)
+                except Exception as e:
+                    print(f"{label}: teardown failed ({type(e).__name__}: {e})")
+
+    return {"samples": samples, "startup_s": startup, "failures": failures}
+
+
+def _fmt(mean: float, half: float) -> str:
+    return f"{mean:.1f} ± {half:.1f}" if math.isfinite(half) else f"{mean:.1f}"
+
+
+def comparison_table(experiment: Experiment, results: dict) -> str:
+    """
+    Markdown table comparing the first variant (baseline) with each other one.
+
+    Cells are mean ± 95% CI half-width. A difference is significant when
+    its confidence interval excludes zero.
+    """
+    samples = results["samples"]
+    base = experiment.variants[0].name
+    lines = []
+    for other in experiment.variants[1:]:
+        name = other.name
+        lines += [
+            f"| Metric | {base} | {name} | Δ ({name} − {base}) | Δ % | Significant |",
+            "|--------|" + "-" * (len(base) + 2) + "|" + "-" * (len(name) + 2) + "|----|-----|-------------|",
+        ]
+        for metric in experiment.metrics:
+            a, b = samples[base][metric.key], samples[name][metric.key]
+            if not a or not b:
+                lines.append(f"| {metric.label} | - | - | - | - | - |")
+                continue
+            diff, half = diff_ci(a, b)
+            base_mean = statistics.fmean(a)
+            pct = f"{diff / base_mean * 100:+.1f}%" if base_mean else "-"
+            if math.isfinite(half) and abs(diff) > half:
+                better = (diff < 0) == metric.lower_is_better
+                verdict = f"**yes** ({name} {'better' if better else 'worse'})"
+            else:
+                verdict = "no"
+            lines.append(
+                f"| {metric.label} | {_fmt(*mean_ci(a))} | {_fmt(*mean_ci(b))} | "
+                f"{diff:+.1f} ± {half:.1f} | {pct} | {verdict} |"
+            )
+        lines.append("")
+    trials = ", ".join(f"{v.name}: {len(results['startup_s'][v.name])}" for v in experiment.variants)
+    lines.append(f"Trials per variant ({trials}), interleaved; values are mean ± 95% CI.")
+    if results["failures"]:
+        lines.append("")
+        lines.append("Failed trials:")
+        lines += [f"- {f}" for f in results["failures"]]
+    return "\n".join(lines) + "\n"
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="A/B orchestrator for paired compose variants")
+    parser.add_argument("experiment", choices=sorted(EXPERIMENTS), help="Experiment to compare")
+    parser.add_argument("--backend", choices=["compose", "stub"], default="compose", help="compose or stub")
+    parser.add_argument("--trials", type=int, default=5, help="Trials per variant")
+    parser.add_argument("--url", default="http://localhost:8000", help="Where variants serve")
+    parser.add_argument("--env-file", default=os.path.join(REPO_ROOT, ".env"), help="Compose env file")
+    parser.add_argument("--health-timeout", type=float, default=600.0, help="Seconds to wait for /health")
+    parser.add_argument("--prompts", type=int, default=10, help="Prompts per scenario (prefix_caching)")
+    parser.add_argument("--short", type=int, default=10, help="Short prompts (chunked_prefill)")
+    parser.add_argument("--long", type=int, default=3, help="Long prompts (chunked_prefill)")
+    parser.add_argument("--output", help="Markdown report path (default: <experiment>/ab_report.md)")
+    parser.add_argument("--json", metavar="PATH", help="Also write raw samples as JSON")
+    parser.add_argument("--verbose", action="store_true", help="Show benchmark output")
+    args = parser.parse_args()
+
+    experiment = EXPERIMENTS[args.experiment]
+    if args.backend == "stub":
+        port = int(args.url.rsplit(":", 1)[1].split("/")[0])
+        backend = StubBackend(port=port)
+    else:
+        backend = ComposeBackend(env_file=args.env_file)
+
+    print("=" * 70)
+    print(f"A/B: {experiment.name} ({' vs '.join(v.name for v in experiment.variants)}, {args.backend})")
+    print("=" * 70)
+    results = run_ab(
+        experiment,
+        backend,
+        url=args.url,
+        trials=args.trials,
+        options={"prompts": args.prompts, "short": args.short, "long": args.long},
+        health_timeout_s=args.health_timeout,
+        verbose=args.verbose,
+    )
+
+    title = f"## A/B: {experiment.name} ({args.backend} backend)\n\n"
+    table = title + comparison_table(experiment, results)
+    print("\n" + table)
+    output = args.output or os.path.join(REPO_ROOT, experiment.directory, "ab_report.md")
+    with open(output, "w") as f:
+        f.write(table)
+    print(f"Report written to {output}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
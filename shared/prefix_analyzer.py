@@ -0,0 +1,410 @@
+"""
+Prefix-sharing analysis for large prompt corpora.
+
+vLLM's automatic prefix caching (APC) stores the KV cache in blocks of
+`block_size` tokens and looks each full block up by a hash chained through
+all the blocks before it. Two prompts can share a cached block only if
+they agree on every token up to the end of that block, so the set of
+chained block hashes *is* a prefix trie with one node per block.
+
+This module builds that trie for a whole corpus with numpy instead of a
+Python dict-of-dicts:
+- all token IDs live in one flat array, with per-prompt offsets
+- chained hashes are computed one block position at a time, vectorized
+  across every prompt that is long enough (so the Python loop runs
+  max_blocks times, not once per block)
+- trie statistics come from sorting each depth's hashes, and prompts
+  whose node is unshared are dropped before the next depth
+
+From that it reports the theoretical APC hit rate (unbounded cache,
+corpus order), clusters of prompts that share a first block with their
+common depth, and the prefixes that would save the most prefill tokens.
+A million prompts of a few hundred tokens take seconds.
+"""
+
+import json
+from dataclasses import dataclass, field
+from itertools import chain
+from typing import Sequence
+
+import numpy as np
+
+DEFAULT_BLOCK_SIZE = 16
+
+_SEED = np.uint64(0x9E3779B97F4A7C15)
+_CHAIN = np.uint64(0xFF51AFD7ED558CCD)
+
+
+def _mix(x: np.ndarray) -> np.ndarray:
+    """splitmix64 finalizer, applied elementwise (uint64 arithmetic wraps)."""
+    x = x ^ (x >> np.uint64(30))
+    x = x * np.uint64(0xBF58476D1CE4E5B9)
+    x = x ^ (x >> np.uint64(27))
+    x = x * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def pack_token_ids(sequences: Sequence[Sequence[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Pack token ID sequences into (lengths, flat) arrays.
+
+    Returns:
+        lengths: int64 array of per-prompt token counts
+        flat: int32 array of all token IDs, prompt after prompt
+    """
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    flat = np.fromiter(chain.from_iterable(sequences), dtype=np.int32, count=int(lengths.sum()))
+    return lengths, flat
+
+
+class _BlockHasher:
+    """Chained block hashes of a packed corpus, advanced one block position at a time."""
+
+    def __init__(self, lengths: np.ndarray, flat: np.ndarray, block_size: int):
+        self.block_size = block_size
+        self.token_offsets = np.zeros(len(lengths), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=self.token_offsets[1:])
+        self.num_blocks = lengths // block_size
+        # Row i is flat[i:i + block_size]; indexing rows copies whole blocks
+        # without building a (n, block_size) index array
+        self._windows = (
+            np.lib.stride_tricks.sliding_window_view(flat, block_size)
+            if len(flat) >= block_size
+            else None
+        )
+        self._weights = _mix(np.arange(1, block_size + 1, dtype=np.uint64)) | np.uint64(1)
+        self._state = np.full(len(lengths), _SEED, dtype=np.uint64)
+
+    def step(self, active: np.ndarray, j: int) -> np.ndarray:
+        """
+        Hash block j of the prompts in `active`.
+
+        Every prompt must have been stepped through blocks 0..j-1 first.
+        """
+        rows = self._windows[self.token_offsets[active] + j * self.block_size]
+        content = (rows.astype(np.uint64) * self._weights).sum(axis=1, dtype=np.uint64)
+        hashes = _mix(self._state[active] * _CHAIN ^ content)
+        self._state[active] = hashes
+        return hashes
+
+
+def block_hashes(
+    lengths: np.ndarray, flat: np.ndarray, block_size: int = DEFAULT_BLOCK_SIZE
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Chained hash of every full block of every prompt.
+
+    Args:
+        lengths: Per-prompt token counts
+        flat: All token IDs, prompt after prompt (int32 keeps the gathers small)
+        block_size: Tokens per KV block
+
+    Returns:
+        hashes: uint64 block hashes, prompt-major (all blocks of prompt 0,
+            then prompt 1, ...); equal hashes mean equal prefixes
+        block_offsets: index of each prompt's first block in `hashes`
+            (length num_prompts + 1)
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    hasher = _BlockHasher(lengths, flat, block_size)
+    block_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(hasher.num_blocks, out=block_offsets[1:])
+    hashes = np.empty(int(block_offsets[-1]), dtype=np.uint64)
+    for j in range(int(hasher.num_blocks.max(initial=0))):
+        # Prompts with a block j, in index order so the gather walks memory forwards
+        active = np.flatnonzero(hasher.num_blocks > j)
+        hashes[block_offsets[active] + j] = hasher.step(active, j)
+    return hashes, block_offsets
+
+
+@dataclass
+class PrefixAnalysis:
+    """Corpus-level prefix sharing statistics."""
+
+    block_size: int
+    num_prompts: int
+    total_tokens: int
+    total_blocks: int
+    unique_blocks: int
+    apc_hit_rate: float  # Cached prompt tokens / all prompt tokens
+    block_hit_rate: float  # Cached full blocks / all full blocks
+    clusters: list[dict] = field(default_factory=list)
+    top_prefixes: list[dict] = field(default_factory=list)
+
+    def to_dict(self) -> dict:
+        return {
+            "block_size": self.block_size,
+            "num_prompts": self.num_prompts,
+            "total_tokens": self.total_tokens,
+            "total_blocks": self.total_blocks,
+            "unique_blocks": self.unique_blocks,
+            "apc_hit_rate": self.apc_hit_rate,
+            "block_hit_rate": self.block_hit_rate,
+            "clusters": self.clusters,
+            "top_prefixes": self.top_prefixes,
+        }
+
+
+def analyze_prefixes(
+    lengths: np.ndarray,
+    flat: np.ndarray,
+    block_size: int = DEFAULT_BLOCK_SIZE,
+    top: int = 10,
+) -> PrefixAnalysis:
+    """
+    Analyze prefix sharing in a packed corpus (see pack_token_ids()).
+
+    Walks the trie one depth at a time. At each depth the chained hashes of
+    the prompts still on a shared path are sorted to find the trie nodes;
+    a prompt whose node has no other member is dropped, since all its
+    deeper blocks are unique too. Only shared paths are ever sorted.
+
+    The hit rate assumes an unbounded cache and prompts arriving in corpus
+    order: the first prompt to reach a trie node computes that block and
+    every later one reuses it.
+
+    Args:
+        lengths: Per-prompt token counts
+        flat: All token IDs, prompt after prompt (int32 or int64)
+        block_size: KV cache block size in tokens
+        top: Clusters and prefixes to report
+
+    Returns:
+        PrefixAnalysis with hit rates, the `top` largest clusters (prompts
+        sharing a first block, with the depth all of them share) and the
+        `top` prefixes by prefill tokens saved.
+    """
+    lengths = np.asarray(lengths, dtype=np.int64)
+    hasher = _BlockHasher(lengths, flat, block_size)
+    num_blocks = hasher.num_blocks
+    total_blocks = int(num_blocks.sum())
+    total_tokens = int(lengths.sum())
+    result = PrefixAnalysis(
+        block_size=block_size,
+        num_prompts=len(lengths),
+        total_tokens=total_tokens,
+        total_blocks=total_blocks,
+        unique_blocks=total_blocks,
+        apc_hit_rate=0.0,
+        block_hit_rate=0.0,
+    )
+    if not total_blocks:
+        return result
+
+    n = len(lengths)
+    cluster = np.zeros(n, dtype=np.int64)  # Depth-1 node of each prompt
+    shared_depth = np.zeros(n, dtype=np.int64)  # Deepest node shared by its whole cluster
+    reuse_depth = np.zeros(n, dtype=np.int64)  # Deepest node shared with any other prompt
+    prev_node = np.zeros(n, dtype=np.int64)
+    prev_count = np.zeros(n, dtype=np.int64)
+    prefixes = []  # (counts, depth, example) arrays of maximal shared nodes
+    hits = 0
+
+    def keep_maximal(counts, examples, depth, narrows):
+        mask = narrows & (counts > 1)
+        if mask.any():
+            prefixes.append((counts[mask], np.full(mask.sum(), depth), examples[mask]))
+
+    active = np.flatnonzero(num_blocks > 0)
+    j = 0
+    while len(active):
+        hashes = hasher.step(active, j)
+        ordered = np.sort(hashes)
+        is_new = np.empty(len(ordered), dtype=bool)
+        is_new[0] = True
+        np.not_equal(ordered[1:], ordered[:-1], out=is_new[1:])
+        nodes = ordered[is_new]
+        node_counts = np.diff(np.append(np.flatnonzero(is_new), len(ordered)))
+        node = np.searchsorted(nodes, hashes)
+        count = node_counts[node]
+        hits += len(hashes) - len(nodes)
+        # First member of each node (assign in reverse so the earliest wins)
+        examples = np.empty(len(nodes), dtype=np.int64)
+        examples[node[::-1]] = active[::-1]
+
+        if j == 0:
+            cluster[active] = node
+            cluster_sizes, cluster_examples = node_counts, examples
+            cluster_saved = np.zeros(len(nodes))
+        node_cluster = np.empty(len(nodes), dtype=np.int64)
+        node_cluster[node] = cluster[active]
+        repeated = node_counts > 1
+        cluster_saved += np.bincount(
+            node_cluster[repeated], weights=node_counts[repeated] - 1, minlength=len(cluster_sizes)
+        )
+        shared_depth[active[count == cluster_sizes[cluster[active]]]] = j + 1
+        reuse_depth[active[count > 1]] = j + 1
+
+        if j > 0:
+            # A previous node whose members all moved to one child is not maximal
+            continued = count == prev_count[active]
+            narrows = np.ones(len(prev_counts), dtype=bool)
+            narrows[prev_node[active[continued]]] = False
+            keep_maximal(prev_counts, prev_examples, j, narrows)
+        prev_node[active] = node
+        prev_count[active] = count
+        prev_counts, prev_examples = node_counts, examples
+
+        j += 1
+        active = active[(count > 1) & (num_blocks[active] > j)]
+    keep_maximal(prev_counts, prev_examples, j, np.ones(len(prev_counts), dtype=bool))
+
+    result.unique_blocks = total_blocks - hits
+    result.block_hit_rate = hits / total_blocks
+    result.apc_hit_rate = hits * block_size / total_tokens
+
+    cluster_deepest = np.zeros(len(cluster_sizes), dtype=np.int64)
+    has_blocks = num_blocks > 0
+    np.maximum.at(cluster_deepest, cluster[has_blocks], reuse_depth[has_blocks])
+    roots = np.flatnonzero(cluster_sizes > 1)
+    for root in roots[np.argsort(-cluster_sizes[roots], kind="stable")][:top]:
+        depth = int(shared_depth[cluster_examples[root]])
+        result.clusters.append(
+            {
+                "prompts": int(cluster_sizes[root]),
+                "shared_depth_blocks": depth,
+                "shared_depth_tokens": depth * block_size,
+                "max_depth_blocks": int(cluster_deepest[root]),
+                "tokens_saved": int(cluster_saved[root]) * block_size,
+                "example_prompt": int(cluster_examples[root]),
+            }
+        )
+
+    if prefixes:
+        counts, depths, examples = (np.concatenate(parts) for parts in zip(*prefixes))
+        saved = (counts - 1) * depths * block_size
+        for i in np.argsort(-saved, kind="stable")[:top]:
+            result.top_prefixes.append(
+                {
+                    "prompts": int(counts[i]),
+                    "depth_blocks": int(depths[i]),
+                    "depth_tokens": int(depths[i]) * block_size,
+                    "tokens_saved": int(saved[i]),
+                    "example_prompt": int(examples[i]),
+                }
+            )
+    return result
+
+
+def analyze_token_ids(
+    sequences: Sequence[Sequence[int]], block_size: int = DEFAULT_BLOCK_SIZE, top: int = 10
+) -> PrefixAnalysis:
+    """analyze_prefixes() for a list of token ID sequences."""
+    lengths, flat = pack_token_ids(sequences)
+    return analyze_prefixes(lengths, flat, block_size, top)
+
+
+def load_corpus(path: str, field: str = "prompt") -> list[str]:
+    """Read prompts from a JSONL file, one record per line."""
+    prompts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                prompts.append(json.loads(line)[field])
+    return prompts
+
+
+def synthesize_corpus(
+    num_prompts: int = 1_000_000,
+    num_system_prompts: int = 200,
+    system_tokens: tuple[int, int] = (64, 512),
+    suffix_tokens: tuple[int, int] = (8, 128),
+    zipf_s: float = 1.1,
+    vocab: int = 150_000,
+    seed: int = 0,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Packed token IDs for a synthetic corpus: Zipf-popular system prompts
+    followed by unique suffixes. Returns (lengths, flat).
+    """
+    rng = np.random.default_rng(seed)
+    sys_lengths = rng.integers(*system_tokens, size=num_system_prompts)
+    sys_tokens = [rng.integers(0, vocab, size=n) for n in sys_lengths]
+    weights = 1.0 / np.arange(1, num_system_prompts + 1) ** zipf_s
+    choice = rng.choice(num_system_prompts, size=num_prompts, p=weights / weights.sum())
+    suffix_lengths = rng.integers(*suffix_tokens, size=num_prompts)
+    lengths = sys_lengths[choice] + suffix_lengths
+
+    flat = rng.integers(0, vocab, size=int(lengths.sum()), dtype=np.int32)
+    offsets = np.zeros(num_prompts, dtype=np.int64)
+    np.cumsum(lengths[:-1], out=offsets[1:])
+    for k in range(num_system_prompts):
+        idx = np.flatnonzero(choice == k)
+        if len(idx):
+            n = sys_lengths[k]
+            flat[offsets[idx][:, None] + np.arange(n)] = sys_tokens[k]
+    return lengths, flat
+
+
+def print_prefix_analysis(
+    title: str, result: PrefixAnalysis, prompts: Sequence[str] | None = None
+) -> None:
+    """Print a PrefixAnalysis; `prompts` adds a preview of each example prompt."""
+    print(f"\n{title}:")
+    print(f"  Prompts:        {result.num_prompts:,} ({result.total_tokens:,} tokens)")
+    print(
+        f"  Full blocks:    {result.total_blocks:,} of {result.block_size} tokens, "
+        f"{result.unique_blocks:,} distinct"
+    )
+    print(f"  APC hit rate:   {result.apc_hit_rate:.1%} of prompt tokens (unbounded cache)")
+
+    def preview(index: int) -> str:
+        if prompts is None:
+            return f"prompt #{index}"
+        text = prompts[index].replace("\n", " ")
+        return repr(text[:60] + ("..." if len(text) > 60 else ""))
+
+    if result.clusters:
+        print(f"\n  {'Cluster size':>12} {'Shared':>8} {'Deepest':>8} {'Saved tok':>10}  Example")
+        for c in result.clusters:
+            print(
+                f"  {c['prompts']:>12,} {c['shared_depth_tokens']:>8} "
+                f"{c['max_depth_blocks'] * result.block_size:>8} {c['tokens_saved']:>10,}  "
+                f"{preview(c['example_prompt'])}"
+            )
+    if result.top_prefixes:
+        print(f"\n  Top reusable prefixes:")
+        print(f"  {'Prompts':>12} {'Depth':>8} {'Saved tok':>10}  Example")
+        for p in result.top_prefixes:
+            print(
+                f"  {p['prompts']:>12,} {p['depth_tokens']:>8} {p['tokens_saved']:>10,}  "
+                f"{preview(p['example_prompt'])}"
+            )
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from .tokens import get_token_counter
+
+    parser = argparse.ArgumentParser(description="Analyze prefix sharing in a prompt corpus")
+    parser.add_argument("corpus", nargs="?", help="JSONL file of prompts (default: synthetic)")
+    parser.add_argument("--field", default="prompt", help="JSON field holding the prompt text")
+    parser.add_argument("--url", default="http://localhost:8000", help="vLLM server for /tokenize")
+    parser.add_argument("--block-size", type=int, default=DEFAULT_BLOCK_SIZE, help="KV block size")
+    parser.add_argument("--top", type=int, default=10, help="Clusters/prefixes to show")
+    parser.add_argument("--synthetic", type=int, default=1_000_000, help="Synthetic corpus size")
+    parser.add_argument("--json", metavar="PATH", help="Also write the analysis as JSON")
+    args = parser.parse_args()
+
+    prompts = None
+    start = time.perf_counter()
+    if args.corpus:
+        prompts = load_corpus(args.corpus, args.field)
+        counter = get_token_counter(base_url=args.url, block_size=args.block_size)
+        lengths, flat = pack_token_ids(counter.encode_batch(prompts))
+        print(f"Tokenized {len(prompts):,} prompts ({counter.backend}) in {time.perf_counter() - start:.2f}s")
+    else:
+        lengths, flat = synthesize_corpus(args.synthetic)
+        print(f"Synthesized {len(lengths):,} prompts in {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    analysis = analyze_prefixes(lengths, flat, args.block_size, args.top)
+    print(f"Analyzed in {time.perf_counter() - start:.2f}s")
+    print_prefix_analysis(args.corpus or "Synthetic corpus", analysis, prompts)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(analysis.to_dict(), f, indent=2)
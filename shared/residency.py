@@ -0,0 +1,269 @@
+"""
+Residency Manager - Keep a bounded set of resources loaded for concurrent requests.
+
+Some resources only fit a few at a time: sleep-mode backends within a GPU
+memory budget (experiment 1), LoRA adapters within a server's --max-loras
+slots (experiment 4). Requests name the resource they need; the manager
+loads it on a miss and unloads idle ones to make room. Subclasses say how
+to load and unload one resource and which idle one to evict first.
+
+A resident moves UNLOADED -> LOADING -> LOADED -> UNLOADING -> UNLOADED.
+A failed load goes back to UNLOADED and fails the requests waiting for it;
+a failed unload goes back to LOADED.
+
+Capacity is counted twice. Planned use (LOADED + LOADING) decides what may
+start loading, so concurrent acquires don't overcommit. Physical use
+(LOADED + UNLOADING + loads actually sent) gates the load call itself, so
+it waits until an eviction has really freed its share.
+"""
+
+import asyncio
+import enum
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+
+
+class ResidentState(enum.Enum):
+    UNLOADED = "unloaded"
+    LOADING = "loading"
+    LOADED = "loaded"
+    UNLOADING = "unloading"
+
+
+@dataclass(kw_only=True)
+class Resident:
+    """Manager-side bookkeeping for one resource."""
+
+    name: str
+    cost: int = 1  # Capacity used while loaded
+    state: ResidentState = ResidentState.UNLOADED
+    in_flight: int = 0
+    last_used: float = 0.0
+    uses: int = 0  # Requests so far, including ones still waiting
+    loading: bool = False  # Load call sent; the resource may already hold its capacity
+    load_failed_at: float = 0.0
+    stats: dict = field(
+        default_factory=lambda: {
+            "requests": 0,
+            "hits": 0,
+            "queued": 0,
+            "queued_ms": 0.0,
+            "loads": 0,
+            "unloads": 0,
+            "load_ms": 0.0,
+        }
+    )
+
+
+class ResidencyManager:
+    """
+    Loads residents on demand and evicts idle ones to stay within `capacity`.
+
+    All state changes happen under one asyncio.Condition. Concurrent
+    requests for a missing resident share a single load and are released
+    together when it finishes. A resident with requests in flight is never
+    evicted. Subclasses implement _load() and _unload(); the defaults evict
+    the least recently used idle resident first.
+    """
+
+    def __init__(self, capacity: int, queue_timeout_s: float = 120.0):
+        """
+        Args:
+            capacity: Total cost of residents that may be loaded at once
+            queue_timeout_s: Longest acquire() waits for its resident to load
+        """
+        self.capacity = capacity
+        self.queue_timeout_s = queue_timeout_s
+        self.residents: dict[str, Resident] = {}
+        self._changed = asyncio.Condition()
+        self._tasks: set[asyncio.Task] = set()
+
+    async def _load(self, resident: Resident) -> bool:
+        """Load `resident`; True on success. Exceptions count as failure."""
+        raise NotImplementedError
+
+    async def _unload(self, resident: Resident) -> bool:
+        """Unload `resident`; True on success. Exceptions count as failure."""
+        raise NotImplementedError
+
+    def _eviction_order(self, resident: Resident) -> tuple:
+        """Sort key over idle loaded residents: the smallest is evicted first."""
+        return (resident.last_used,)
+
+    def _load_failed(self, resident: Resident) -> Exception:
+        """Raised by acquire() when the load it waited for failed."""
+        return RuntimeError(f"Failed to load {resident.name}")
+
+    def _timed_out(self, resident: Resident) -> Exception:
+        """Raised by acquire() after queue_timeout_s."""
+        return TimeoutError(f"Timed out waiting for {resident.name} to load")
+
+    def planned(self) -> int:
+        """Capacity of residents that are, or are about to be, loaded."""
+        return sum(
+            r.cost for r in self.residents.values() if r.state in (ResidentState.LOADED, ResidentState.LOADING)
+        )
+
+    def physical(self) -> int:
+        """Capacity actually held right now."""
+        return sum(
+            r.cost
+            for r in self.residents.values()
+            if r.state in (ResidentState.LOADED, ResidentState.UNLOADING) or r.loading
+        )
+
+    def _plan_eviction(self, needed: int) -> list[Resident] | None:
+        """
+        Pick idle loaded residents to evict so `needed` more capacity fits.
+
+        Returns the victims (possibly empty), or None if not enough idle
+        capacity can be freed right now.
+        """
+        free = self.capacity - self.planned()
+        victims = []
+        idle = sorted(
+            (r for r in self.residents.values() if r.state is ResidentState.LOADED and r.in_flight == 0),
+            key=self._eviction_order,
+        )
+        for resident in idle:
+            if free >= needed:
+                break
+            victims.append(resident)
+            free += resident.cost
+        return victims if free >= needed else None
+
+    async def evict_to_capacity(self) -> None:
+        """Evict idle residents until the loaded ones fit (e.g. after reading a server's state)."""
+        async with self._changed:
+            victims = self._plan_eviction(needed=0) or []
+            for victim in victims:
+                victim.state = ResidentState.UNLOADING
+        for victim in victims:
+            await self._evict(victim)
+
+    async def acquire(self, name: str) -> Resident:
+        """
+        Wait until resident `name` is loaded and mark one request in flight on it.
+
+        Raises KeyError for unknown names, _load_failed() if the load fails
+        and _timed_out() if it is not loaded within queue_timeout_s.
+        """
+        resident = self.residents[name]
+        enqueued = time.monotonic()
+        deadline = enqueued + self.queue_timeout_s
+        queued = False
+
+        async with self._changed:
+            resident.uses += 1
+            while True:
+                if resident.state is ResidentState.LOADED:
+                    resident.in_flight += 1
+                    resident.last_used = time.monotonic()
+                    resident.stats["requests"] += 1
+                    if queued:
+                        resident.stats["queued"] += 1
+                        resident.stats["queued_ms"] += (resident.last_used - enqueued) * 1000
+                    else:
+                        resident.stats["hits"] += 1
+                    return resident
+                if resident.load_failed_at > enqueued:
+                    raise self._load_failed(resident)
+                if resident.state is ResidentState.UNLOADED:
+                    victims = self._plan_eviction(resident.cost)
+                    if victims is not None:
+                        for victim in victims:
+                            victim.state = ResidentState.UNLOADING
+                        resident.state = ResidentState.LOADING
+                        self._spawn(self._swap_in(resident, victims))
+
+                queued = True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise self._timed_out(resident)
+                try:
+                    await asyncio.wait_for(self._changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, resident: Resident) -> None:
+        """Mark one request on `resident` finished."""
+        async with self._changed:
+            resident.in_flight -= 1
+            resident.last_used = time.monotonic()
+            self._changed.notify_all()
+
+    @asynccontextmanager
+    async def use(self, name: str):
+        """`async with manager.use(name):` holds resident `name` loaded for the block."""
+        resident = await self.acquire(name)
+        try:
+            yield resident
+        finally:
+            await self.release(resident)
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _evict(self, resident: Resident) -> bool:
+        """Unload an UNLOADING resident; on failure it is assumed still loaded."""
+        try:
+            ok = await self._unload(resident)
+        except Exception:
+            ok = False
+        async with self._changed:
+            resident.state = ResidentState.UNLOADED if ok else ResidentState.LOADED
+            if ok:
+                resident.stats["unloads"] += 1
+            self._changed.notify_all()
+        return ok
+
+    async def _swap_in(self, resident: Resident, victims: list[Resident]) -> None:
+        """
+        Evict the victims, then load `resident` once its capacity is really free.
+
+        Runs as a detached task. Whatever fails (a victim that stays loaded,
+        capacity that never frees up, a load that errors), `resident` ends
+        up LOADED or back to UNLOADED with load_failed_at set, so waiters
+        fail fast and the next acquire plans again.
+        """
+        ok = False
+        try:
+            evicted = await asyncio.gather(*(self._evict(victim) for victim in victims))
+            if not all(evicted):
+                return
+            async with self._changed:
+                # Another swap may still be freeing capacity we were promised
+                try:
+                    await asyncio.wait_for(
+                        self._changed.wait_for(lambda: self.physical() + resident.cost <= self.capacity),
+                        self.queue_timeout_s,
+                    )
+                except asyncio.TimeoutError:
+                    return
+                resident.loading = True
+            start = time.perf_counter()
+            try:
+                ok = await self._load(resident)
+            except Exception:
+                ok = False
+            load_ms = (time.perf_counter() - start) * 1000
+        finally:
+            async with self._changed:
+                resident.loading = False
+                if ok:
+                    resident.state = ResidentState.LOADED
+                    resident.last_used = time.monotonic()
+                    resident.stats["loads"] += 1
+                    resident.stats["load_ms"] += load_ms
+                else:
+                    resident.state = ResidentState.UNLOADED
+                    resident.load_failed_at = time.monotonic()
+                self._changed.notify_all()
+
+    async def close(self) -> None:
+        """Cancel loads and evictions still running."""
+        for task in list(self._tasks):
+            task.cancel()
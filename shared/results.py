@@ -0,0 +1,614 @@
+"""
+Result store - Keep every benchmark run in one machine-readable place.
+
+Each run is stored with the same schema, whatever the experiment:
+- config: the benchmark's arguments
+- server: URL, model, vLLM version, image and launch flags
+- git: commit SHA, branch and whether the tree was dirty
+- env: Python, platform, host and GPU
+- aggregates: every number the benchmark returned, flattened to dotted keys
+  (e.g. 'high_reuse_server.ttft_p99_ms')
+- samples: raw per-request values (e.g. every TTFT), stored separately
+
+The store is two append-only JSONL files in results/ (or $VLLM_OPS_RESULTS):
+runs.jsonl holds one small line per run, so listing and comparing runs never
+reads raw samples; samples.jsonl holds the samples, and each run line keeps
+the byte offset of its samples so they load with a single seek.
+
+Query CLI:
+    python -m shared.results list
+    python -m shared.results show RUN
+    python -m shared.results compare BASE RUN
+    python -m shared.results check --baseline server.image=vllm/vllm-openai:v0.14.1
+
+`check` compares the latest run (or --run) against a baseline and exits
+with status 1 when a metric got worse by more than --threshold percent
+(and, for sampled metrics, the Welch confidence interval excludes zero),
+so it can gate an image bump in CI.
+"""
+
+import fnmatch
+import json
+import math
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from urllib.parse import urlparse
+
+import requests
+
+from .stats import diff_ci
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DIR = os.environ.get("VLLM_OPS_RESULTS", os.path.join(REPO_ROOT, "results"))
+SCHEMA_VERSION = 1
+
+# Metric name fragments that tell which direction is better
+HIGHER_IS_BETTER = ("per_s", "hit_rate", "throughput", "freed", "speedup")
+LOWER_IS_BETTER = ("ttft", "tpot", "itl", "e2e", "latency", "stall", "lag", "errors", "_ms", "elapsed_s")
+
+
+@dataclass
+class RunRecord:
+    """One benchmark run (samples are loaded separately, see ResultStore.samples)."""
+
+    run_id: str
+    timestamp: float
+    experiment: str
+    mode: str  # Which benchmark of the experiment, e.g. 'ttft', 'throughput'
+    config: dict
+    server: dict
+    git: dict
+    env: dict
+    aggregates: dict[str, float]
+    sample_counts: dict[str, int] = field(default_factory=dict)
+    samples_offset: int | None = None
+    schema: int = SCHEMA_VERSION
+
+    @property
+    def label(self) -> str:
+        when = time.strftime("%Y-%m-%d %H:%M", time.localtime(self.timestamp))
+        return f"{self.run_id} ({self.experiment}/{self.mode}, {when})"
+
+    def field_value(self, path: str):
+        """Value at a dotted path such as 'env.gpu' or 'aggregates.ttft_ms' (None if missing)."""
+        top, _, rest = path.partition(".")
+        if top == "aggregates":
+            return self.aggregates.get(rest)  # Aggregate keys contain dots themselves
+        value = getattr(self, top, None)
+        for part in rest.split(".") if rest else []:
+            if not isinstance(value, dict):
+                return None
+            value = value.get(part)
+        return value
+
+
+# =============================================================================
+# Run metadata
+# =============================================================================
+
+
+def _run(cmd: list[str], timeout: float = 5.0) -> str | None:
+    try:
+        out = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, cwd=REPO_ROOT)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() if out.returncode == 0 else None
+
+
+def git_info() -> dict:
+    """Commit SHA, branch and dirty flag of the working tree (empty outside git)."""
+    sha = _run(["git", "rev-parse", "HEAD"])
+    if sha is None:
+        return {}
+    status = _run(["git", "status", "--porcelain", "--untracked-files=no"])
+    return {
+        "sha": sha,
+        "branch": _run(["git", "rev-parse", "--abbrev-ref", "HEAD"]),
+        "dirty": bool(status),
+    }
+
+
+def collect_environment() -> dict:
+    """Python, platform, host and GPU of the machine running the benchmark."""
+    env = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "hostname": socket.gethostname(),
+    }
+    gpu = _run(["nvidia-smi", "--query-gpu=name,driver_version,memory.total", "--format=csv,noheader"])
+    if gpu:
+        name, driver, memory = (part.strip() for part in gpu.splitlines()[0].split(","))
+        env.update({"gpu": name, "gpu_count": len(gpu.splitlines()), "driver": driver, "gpu_memory": memory})
+    return env
+
+
+def load_env_file(path: str = os.path.join(REPO_ROOT, ".env")) -> dict:
+    """KEY=VALUE pairs of a docker compose env file (empty if missing)."""
+    values = {}
+    if os.path.exists(path):
+        with open(path) as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#") and "=" in line:
+                    key, value = line.split("=", 1)
+                    values[key.strip()] = value.strip().strip("\"'")
+    return values
+
+
+def _expand(text: str, variables: dict) -> str:
+    """Substitute ${VAR} and ${VAR:-default}; unknown variables are left as written."""
+
+    def sub(m: re.Match) -> str:
+        if m.group(1) in variables:
+            return variables[m.group(1)]
+        return m.group(2) if m.group(2) is not None else m.group(0)
+
+    return re.sub(r"\$\{(\w+)(?::?-([^}]*))?\}", sub, text)
+
+
+def compose_service(compose_file: str, env_file: str = os.path.join(REPO_ROOT, ".env")) -> dict:
+    """
+    Image and command of the vllm service in a compose file.
+
+    Reads the `image:` and `command:` entries directly (no YAML dependency),
+    following `include:` for whatever the file doesn't override, and expands
+    ${VAR} from the env file and the environment.
+
+    Returns:
+        Dict with 'image' and 'flags' (either may be missing)
+    """
+    variables = {**load_env_file(env_file), **os.environ}
+    service: dict = {}
+    includes = []
+    section = None
+    with open(compose_file) as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            indent = len(line) - len(line.lstrip())
+            if indent == 0:
+                section = "include" if stripped == "include:" else None
+            elif section == "include" and stripped.startswith("- "):
+                includes.append(stripped[2:].strip())
+            elif stripped.startswith("image:"):
+                service["image"] = _expand(stripped.split(":", 1)[1].strip(), variables)
+            elif stripped == "command:":
+                service["flags"] = []
+                section = ("command", indent)
+            elif isinstance(section, tuple):
+                if indent > section[1] and stripped.startswith("- "):
+                    service["flags"].append(_expand(stripped[2:].strip(), variables))
+                else:
+                    section = None
+    for include in includes:
+        path = os.path.join(os.path.dirname(compose_file), include)
+        if os.path.exists(path):
+            for key, value in compose_service(path, env_file).items():
+                service.setdefault(key, value)
+    return service
+
+
+def _container_service(port: int) -> dict:
+    """Image and command of the running container publishing `port` (docker, best effort)."""
+    container = _run(["docker", "ps", "-q", "--filter", f"publish={port}"])
+    if not container:
+        return {}
+    inspect = _run(
+        ["docker", "inspect", "--format", "{{json .Config.Cmd}}|{{.Config.Image}}", container.split()[0]]
+    )
+    if not inspect:
+        return {}
+    cmd, image = inspect.rsplit("|", 1)
+    return {"image": image, "flags": json.loads(cmd) or []}
+
+
+def server_info(base_url: str, compose_file: str | None = None) -> dict:
+    """
+    What the benchmark ran against.
+
+    The model and version come from the server itself. Image and flags come
+    from the running container when docker can see it, else from
+    `compose_file`.
+    """
+    info = {"url": base_url}
+    try:
+        models = requests.get(f"{base_url}/v1/models", timeout=5).json()["data"]
+        info["model"] = models[0]["id"]
+        if models[0].get("max_model_len"):
+            info["max_model_len"] = models[0]["max_model_len"]
+    except (requests.RequestException, ValueError, KeyError, IndexError):
+        pass
+    try:
+        resp = requests.get(f"{base_url}/version", timeout=5)
+        if resp.status_code == 200:
+            info["version"] = resp.json().get("version")
+    except (requests.RequestException, ValueError):
+        pass
+    service = _container_service(urlparse(base_url).port or 80)
+    if not service and compose_file and os.path.exists(compose_file):
+        service = compose_service(compose_file)
+    info.update(service)
+    return info
+
+
+# =============================================================================
+# Flattening
+# =============================================================================
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def flatten_result(result, prefix: str = "") -> tuple[dict[str, float], dict[str, list[float]]]:
+    """
+    Split a benchmark's return value into aggregates and raw samples.
+
+    Numbers become aggregates under dotted keys; nested dicts recurse; lists
+    of dicts are keyed by position. Lists of numbers, and anything under a
+    'samples' key, become samples. Strings, booleans and None are dropped
+    (they belong in the run config).
+    """
+    aggregates: dict[str, float] = {}
+    samples: dict[str, list[float]] = {}
+    items = result.items() if isinstance(result, dict) else enumerate(result)
+    for key, value in items:
+        name = f"{prefix}{key}"
+        if key == "samples" and isinstance(value, dict):
+            for sample_key, values in value.items():
+                samples[f"{prefix}{sample_key}"] = [float(v) for v in values if _is_number(v)]
+        elif _is_number(value):
+            aggregates[name] = float(value)
+        elif isinstance(value, dict) or (isinstance(value, list) and value and isinstance(value[0], dict)):
+            sub_aggregates, sub_samples = flatten_result(value, f"{name}.")
+            aggregates.update(sub_aggregates)
+            samples.update(sub_samples)
+        elif isinstance(value, list) and value and all(_is_number(v) for v in value):
+            samples[name] = [float(v) for v in value]
+    return aggregates, samples
+
+
+# =============================================================================
+# Store
+# =============================================================================
+
+
+class ResultStore:
+    """Append-only run index (runs.jsonl) plus raw samples (samples.jsonl)."""
+
+    def __init__(self, directory: str = DEFAULT_DIR):
+        self.directory = directory
+        self.runs_path = os.path.join(directory, "runs.jsonl")
+        self.samples_path = os.path.join(directory, "samples.jsonl")
+
+    def append(self, record: RunRecord, samples: dict[str, list[float]] | None = None) -> RunRecord:
+        """Store a run; samples go first so the run line can point at them."""
+        os.makedirs(self.directory, exist_ok=True)
+        if samples:
+            with open(self.samples_path, "ab") as f:
+                record.samples_offset = f.tell()
+                f.write((json.dumps({"run_id": record.run_id, "samples": samples}) + "\n").encode())
+            record.sample_counts = {key: len(values) for key, values in samples.items()}
+        with open(self.runs_path, "a") as f:
+            f.write(json.dumps(asdict(record)) + "\n")
+        return record
+
+    def runs(self, experiment: str | None = None, mode: str | None = None) -> list[RunRecord]:
+        """All runs, oldest first, optionally filtered."""
+        if not os.path.exists(self.runs_path):
+            return []
+        records = []
+        with open(self.runs_path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if data.get("schema", SCHEMA_VERSION) > SCHEMA_VERSION:
+                    continue  # Written by a newer version of this module
+                record = RunRecord(**data)
+                if experiment and record.experiment != experiment:
+                    continue
+                if mode and record.mode != mode:
+                    continue
+                records.append(record)
+        return records
+
+    def samples(self, record: RunRecord) -> dict[str, list[float]]:
+        """Raw samples of a run (empty if it has none)."""
+        if record.samples_offset is None:
+            return {}
+        with open(self.samples_path, "rb") as f:
+            f.seek(record.samples_offset)
+            data = json.loads(f.readline())
+        if data.get("run_id") != record.run_id:
+            raise ValueError(f"samples.jsonl does not match runs.jsonl at run {record.run_id}")
+        return data["samples"]
+
+    def get(self, run_id: str) -> RunRecord:
+        """Run by ID or unique ID prefix (also 'latest')."""
+        runs = self.runs()
+        if run_id == "latest":
+            if not runs:
+                raise KeyError("no runs stored")
+            return runs[-1]
+        matches = [r for r in runs if r.run_id.startswith(run_id)]
+        if len(matches) != 1:
+            raise KeyError(f"{len(matches)} runs match {run_id!r}")
+        return matches[0]
+
+    def baseline(self, run: RunRecord, selector: str = "previous") -> RunRecord:
+        """
+        Baseline for `run`, among earlier runs of the same experiment and mode.
+
+        Args:
+            selector: 'previous' (the run before), a run ID prefix, or
+                'path=value' filters joined by ',' (e.g. 'env.gpu=NVIDIA L4,
+                server.image=vllm/vllm-openai:v0.14.1'); the latest match wins
+        """
+        if selector != "previous" and "=" not in selector:
+            return self.get(selector)
+        candidates = [
+            r
+            for r in self.runs(run.experiment, run.mode)
+            if r.timestamp < run.timestamp and r.run_id != run.run_id
+        ]
+        if selector != "previous":
+            for condition in selector.split(","):
+                path, expected = (part.strip() for part in condition.split("=", 1))
+                candidates = [r for r in candidates if str(r.field_value(path)) == expected]
+        if not candidates:
+            raise KeyError(f"no baseline for {run.run_id} matching {selector!r}")
+        return candidates[-1]
+
+
+def new_run_id() -> str:
+    """Sortable, readable run ID: start time plus a random suffix."""
+    return time.strftime("%Y%m%d-%H%M%S") + "-" + uuid.uuid4().hex[:6]
+
+
+def record_run(
+    experiment: str,
+    mode: str,
+    config: dict,
+    result,
+    base_url: str | None = None,
+    compose_file: str | None = None,
+    store: ResultStore | None = None,
+) -> RunRecord | None:
+    """
+    Store a benchmark result with its run metadata.
+
+    Args:
+        experiment: Experiment name, e.g. 'prefix_caching'
+        mode: Which benchmark of the experiment ran
+        config: Benchmark arguments (e.g. vars(args))
+        result: What run_benchmark() returned; see flatten_result()
+        base_url: Server URL, for model/version/flags lookup
+        compose_file: Compose file the server was started from (fallback
+            for image and flags when docker can't see the container)
+        store: Where to store it (default: results/ or $VLLM_OPS_RESULTS)
+
+    Returns:
+        The stored record, or None when there was no result to store
+    """
+    if not result:
+        return None
+    aggregates, samples = flatten_result(result)
+    record = RunRecord(
+        run_id=new_run_id(),
+        timestamp=time.time(),
+        experiment=experiment,
+        mode=mode,
+        config={k: v for k, v in config.items() if isinstance(v, (str, int, float, bool, list, type(None)))},
+        server=server_info(base_url, compose_file) if base_url else {},
+        git=git_info(),
+        env=collect_environment(),
+        aggregates=aggregates,
+    )
+    store = store or ResultStore()
+    store.append(record, samples)
+    print(f"\nSaved run {record.run_id} to {store.directory} (python -m shared.results show {record.run_id})")
+    return record
+
+
+# =============================================================================
+# Comparison
+# =============================================================================
+
+
+def metric_direction(key: str) -> int:
+    """+1 if higher is better, -1 if lower is better, 0 if unknown (not checked)."""
+    name = key.rsplit(".", 1)[-1]
+    if any(part in name for part in HIGHER_IS_BETTER):
+        return 1
+    if name.endswith(("_count", "_max")) or (name.endswith("_mean") and "_ms" not in name):
+        return 0  # Counts and gauges describe the load, not its quality
+    if any(part in name for part in LOWER_IS_BETTER):
+        return -1
+    return 0
+
+
+@dataclass
+class MetricChange:
+    """One metric of a run compared with its baseline."""
+
+    key: str
+    base: float
+    new: float
+    direction: int
+    ci: float | None = None  # 95% half-width of the difference (sampled metrics)
+    n: tuple[int, int] | None = None  # Sample counts (base, new)
+
+    @property
+    def change_pct(self) -> float:
+        if self.base == 0:
+            return 0.0 if self.new == 0 else math.copysign(math.inf, self.new)
+        return (self.new - self.base) / abs(self.base) * 100
+
+    @property
+    def significant(self) -> bool:
+        """True unless samples show the difference is within noise."""
+        return self.ci is None or not math.isfinite(self.ci) or abs(self.new - self.base) > self.ci
+
+    def regressed(self, threshold_pct: float) -> bool:
+        return self.direction != 0 and -self.direction * self.change_pct > threshold_pct and self.significant
+
+
+def compare_runs(
+    base: RunRecord,
+    new: RunRecord,
+    base_samples: dict[str, list[float]] | None = None,
+    new_samples: dict[str, list[float]] | None = None,
+    patterns: list[str] | None = None,
+) -> list[MetricChange]:
+    """
+    Metric-by-metric comparison of two runs.
+
+    Aggregates present in both runs are compared directly; sample series
+    present in both are compared by mean, with a Welch confidence interval.
+
+    Args:
+        patterns: Only compare metrics matching one of these globs
+    """
+    changes = []
+    for key in sorted(base.aggregates.keys() & new.aggregates.keys()):
+        changes.append(MetricChange(key, base.aggregates[key], new.aggregates[key], metric_direction(key)))
+    base_samples, new_samples = base_samples or {}, new_samples or {}
+    for key in sorted(base_samples.keys() & new_samples.keys()):
+        a, b = base_samples[key], new_samples[key]
+        if not a or not b:
+            continue
+        diff, half = diff_ci(a, b)
+        changes.append(
+            MetricChange(
+                f"{key}[samples]",
+                statistics.fmean(a),
+                statistics.fmean(a) + diff,
+                metric_direction(key),
+                ci=half,
+                n=(len(a), len(b)),
+            )
+        )
+    if patterns:
+        changes = [c for c in changes if any(fnmatch.fnmatch(c.key, p) for p in patterns)]
+    return changes
+
+
+def print_comparison(base: RunRecord, new: RunRecord, changes: list[MetricChange], threshold_pct: float) -> int:
+    """Print a comparison table; returns the number of regressions."""
+    print(f"\nBaseline: {base.label}")
+    print(f"Run:      {new.label}")
+    for path in ("server.image", "server.version", "git.sha"):
+        a, b = base.field_value(path), new.field_value(path)
+        if a != b:
+            print(f"  {path}: {a} -> {b}")
+    width = max((len(c.key) for c in changes), default=6)
+    print(f"\n  {'Metric':<{width}} {'Baseline':>11} {'Run':>11} {'Change':>8}  ")
+    regressions = 0
+    for c in changes:
+        flag = ""
+        if c.regressed(threshold_pct):
+            flag = "REGRESSION"
+            regressions += 1
+        elif c.direction and c.direction * c.change_pct > threshold_pct and c.significant:
+            flag = "improved"
+        elif c.ci is not None and not c.significant:
+            flag = "(noise)"
+        print(f"  {c.key:<{width}} {c.base:>11.2f} {c.new:>11.2f} {c.change_pct:>+7.1f}%  {flag}")
+    print(f"\n{regressions} regression(s) beyond {threshold_pct:g}%")
+    return regressions
+
+
+# =============================================================================
+# CLI
+# =============================================================================
+
+
+def _print_run(store: ResultStore, run: RunRecord) -> None:
+    print("=" * 70)
+    print(f"Run {run.label}")
+    print("=" * 70)
+    for title, values in (("Config", run.config), ("Server", run.server), ("Git", run.git), ("Environment", run.env)):
+        print(f"\n{title}:")
+        for key, value in values.items():
+            print(f"  {key}: {value}")
+    print("\nAggregates:")
+    for key, value in run.aggregates.items():
+        print(f"  {key}: {value:.4g}")
+    samples = store.samples(run)
+    if samples:
+        print("\nSamples:")
+        for key, values in samples.items():
+            print(f"  {key}: n={len(values)} mean={statistics.fmean(values):.2f} max={max(values):.2f}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Query stored benchmark runs")
+    parser.add_argument("--dir", default=DEFAULT_DIR, help="Result store directory")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    list_cmd = sub.add_parser("list", help="List runs")
+    list_cmd.add_argument("--experiment")
+    list_cmd.add_argument("--mode")
+    list_cmd.add_argument("--last", type=int, default=20, help="Show the last N runs")
+
+    show_cmd = sub.add_parser("show", help="Show one run")
+    show_cmd.add_argument("run", nargs="?", default="latest")
+
+    for name, help_text in (("compare", "Compare two runs"), ("check", "Check a run for regressions")):
+        cmd = sub.add_parser(name, help=help_text)
+        cmd.add_argument("--threshold", type=float, default=5.0, help="Allowed worsening in percent")
+        cmd.add_argument("--metric", action="append", help="Only metrics matching this glob (repeatable)")
+    compare_cmd = sub.choices["compare"]
+    compare_cmd.add_argument("base")
+    compare_cmd.add_argument("run", nargs="?", default="latest")
+    check_cmd = sub.choices["check"]
+    check_cmd.add_argument("--run", default="latest", help="Run to check (default: latest)")
+    check_cmd.add_argument(
+        "--baseline", default="previous", help="'previous', a run ID, or path=value filters (see ResultStore.baseline)"
+    )
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.dir)
+    try:
+        if args.command == "list":
+            runs = store.runs(args.experiment, args.mode)[-args.last :]
+            print(f"  {'Run':<23} {'Experiment/mode':<28} {'Git':<9} {'Image / version':<34} Metrics")
+            for run in runs:
+                sha = (run.git.get("sha") or "-")[:7] + ("*" if run.git.get("dirty") else "")
+                image = run.server.get("image") or run.server.get("version") or "-"
+                print(
+                    f"  {run.run_id:<23} {run.experiment + '/' + run.mode:<28} {sha:<9} "
+                    f"{image[-34:]:<34} {len(run.aggregates)}"
+                )
+            return 0
+        if args.command == "show":
+            _print_run(store, store.get(args.run))
+            return 0
+        if args.command == "compare":
+            base, new = store.get(args.base), store.get(args.run)
+        else:
+            new = store.get(args.run)
+            base = store.baseline(new, args.baseline)
+    except KeyError as e:
+        print(f"ERROR: {e.args[0]}")
+        return 2
+
+    changes = compare_runs(base, new, store.samples(base), store.samples(new), args.metric)
+    regressions = print_comparison(base, new, changes, args.threshold)
+    return 1 if args.command == "check" and regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
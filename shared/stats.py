@@ -0,0 +1,57 @@
+"""
+Small-sample statistics for comparing benchmark runs.
+
+Benchmarks are repeated a handful of times, so intervals use Student's t
+(from a table; no scipy dependency) rather than the normal approximation.
+"""
+
+import math
+import statistics
+
+# Two-sided 95% critical values of Student's t by degrees of freedom
+_T_95 = {
+    1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+    10: 2.228, 11: 2.201, 12: 2.179, 13: 2.160, 14: 2.145, 15: 2.131, 16: 2.120, 17: 2.110,
+    18: 2.101, 19: 2.093, 20: 2.086, 25: 2.060, 30: 2.042, 40: 2.021, 60: 2.000, 120: 1.980,
+}
+_Z_95 = 1.960
+
+
+def t_critical(df: float) -> float:
+    """Two-sided 95% t critical value, interpolated between table rows."""
+    if df < 1:
+        return float("inf")
+    rows = sorted(_T_95)
+    if df >= rows[-1]:
+        return _Z_95
+    for lo, hi in zip(rows, rows[1:]):
+        if lo <= df <= hi:
+            frac = (df - lo) / (hi - lo)
+            return _T_95[lo] + frac * (_T_95[hi] - _T_95[lo])
+    return _T_95[rows[0]]
+
+
+def mean_ci(values: list[float]) -> tuple[float, float]:
+    """Mean and 95% confidence half-width (inf with fewer than two values)."""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, float("inf")
+    return mean, t_critical(len(values) - 1) * statistics.stdev(values) / math.sqrt(len(values))
+
+
+def diff_ci(a: list[float], b: list[float]) -> tuple[float, float]:
+    """
+    Difference of means (b - a) and its 95% confidence half-width.
+
+    Uses Welch's t with Welch-Satterthwaite degrees of freedom, so the two
+    variants may have different variances.
+    """
+    diff = statistics.fmean(b) - statistics.fmean(a)
+    if len(a) < 2 or len(b) < 2:
+        return diff, float("inf")
+    va, vb = statistics.variance(a) / len(a), statistics.variance(b) / len(b)
+    se = math.sqrt(va + vb)
+    if se == 0:
+        return diff, 0.0
+    df = (va + vb) ** 2 / (va**2 / (len(a) - 1) + vb**2 / (len(b) - 1))
+    return diff, t_critical(df) * se
@@ -0,0 +1,223 @@
+"""
+Token accounting with the served model's tokenizer.
+
+Prompt sizes used to be estimated at 4 characters per token, and shared
+prefixes were measured in characters. Neither matches what vLLM sees:
+prefill cost scales with tokens, and automatic prefix caching reuses whole
+KV blocks of `block_size` tokens. TokenCounter tokenizes with the real
+tokenizer, loaded once per process, and reports lengths and shared
+prefixes in tokens and KV blocks.
+
+Tokenizer sources, tried in order by backend="auto":
+- "transformers": the model's Hugging Face tokenizer, in process (optional
+  dependency; fast tokenizers batch-encode in native code)
+- "server": vLLM's /tokenize endpoint, exact for whatever model is served
+- "approximate": the old 4-characters-per-token estimate, as a last resort;
+  reports mark it with exact=False
+"""
+
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Sequence
+
+import requests
+
+try:
+    from transformers import AutoTokenizer
+except ImportError:  # Optional: falls back to the server's /tokenize
+    AutoTokenizer = None
+
+DEFAULT_BLOCK_SIZE = 16  # vLLM's default KV cache block size
+CHARS_PER_TOKEN = 4
+
+_counters: dict[tuple, "TokenCounter"] = {}
+
+
+class TokenCounter:
+    """Cached tokenization and prefix accounting for one model."""
+
+    def __init__(
+        self,
+        model: str | None = None,
+        base_url: str | None = "http://localhost:8000",
+        backend: str = "auto",
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        cache_size: int = 100_000,
+    ):
+        """
+        Args:
+            model: Model name; defaults to MODEL_NAME like VLLMClient
+            base_url: vLLM server for the "server" backend (None to skip it)
+            backend: "auto", "transformers", "server" or "approximate"
+            block_size: KV cache block size used for block counts
+            cache_size: Prompts whose token IDs are kept (LRU)
+        """
+        self.model = model or os.getenv("MODEL_NAME", "Qwen/Qwen2.5-0.5B-Instruct")
+        self.base_url = base_url.rstrip("/") if base_url else None
+        self.block_size = block_size
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, tuple[int, ...]] = OrderedDict()
+        self._tokenizer = None
+        self._session = requests.Session()
+        self.backend = self._load(backend)
+
+    def _load(self, backend: str) -> str:
+        if backend in ("auto", "transformers") and AutoTokenizer is not None:
+            try:
+                self._tokenizer = AutoTokenizer.from_pretrained(self.model)
+                return "transformers"
+            except (OSError, ValueError) as e:
+                if backend == "transformers":
+                    raise
+                print(f"Tokenizer for {self.model} not loadable ({e}); trying server")
+        elif backend == "transformers":
+            raise RuntimeError("transformers backend needs `pip install transformers`")
+        if backend in ("auto", "server") and self.base_url:
+            try:
+                self._tokenize_remote("ping")
+                return "server"
+            except (requests.RequestException, KeyError, ValueError):
+                if backend == "server":
+                    raise
+        if backend not in ("auto", "approximate"):
+            raise ValueError(f"Tokenizer backend {backend} unavailable")
+        return "approximate"
+
+    @property
+    def exact(self) -> bool:
+        """Whether counts come from the real tokenizer."""
+        return self.backend != "approximate"
+
+    def _tokenize_remote(self, text: str) -> tuple[int, ...]:
+        resp = self._session.post(
+            f"{self.base_url}/tokenize",
+            json={"model": self.model, "prompt": text, "add_special_tokens": False},
+            timeout=30,
+        )
+        resp.raise_for_status()
+        return tuple(resp.json()["tokens"])
+
+    def _tokenize_uncached(self, texts: Sequence[str]) -> list[tuple[int, ...]]:
+        if self.backend == "transformers":
+            encoded = self._tokenizer(list(texts), add_special_tokens=False)["input_ids"]
+            return [tuple(ids) for ids in encoded]
+        if self.backend == "server":
+            if len(texts) == 1:
+                return [self._tokenize_remote(texts[0])]
+            with ThreadPoolExecutor(max_workers=8) as pool:
+                return list(pool.map(self._tokenize_remote, texts))
+        # Approximate: fixed-size character chunks stand in for tokens, so
+        # prefix comparisons still work on IDs (kept in int32 range like real
+        # vocabularies, so they pack into prefix_analyzer arrays)
+        return [
+            tuple(
+                hash(text[i : i + CHARS_PER_TOKEN]) & 0x7FFFFFFF
+                for i in range(0, len(text), CHARS_PER_TOKEN)
+            )
+            for text in texts
+        ]
+
+    def encode_batch(self, texts: Sequence[str]) -> list[tuple[int, ...]]:
+        """Token IDs of many prompts; unseen, distinct prompts are tokenized in one batch."""
+        missing = list(dict.fromkeys(t for t in texts if t not in self._cache))
+        if missing:
+            for text, ids in zip(missing, self._tokenize_uncached(missing)):
+                self._cache[text] = ids
+        result = []
+        for text in texts:
+            ids = self._cache[text]
+            self._cache.move_to_end(text)
+            result.append(ids)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return result
+
+    def encode(self, text: str) -> tuple[int, ...]:
+        """Token IDs of one prompt (cached)."""
+        return self.encode_batch([text])[0]
+
+    def count(self, text: str) -> int:
+        """Number of tokens in one prompt (cached)."""
+        return len(self.encode(text))
+
+    def count_batch(self, texts: Sequence[str]) -> list[int]:
+        """Token counts of many prompts."""
+        return [len(ids) for ids in self.encode_batch(texts)]
+
+    def blocks(self, num_tokens: int) -> int:
+        """Full KV blocks covered by `num_tokens` (only full blocks are cached)."""
+        return num_tokens // self.block_size
+
+    def shared_prefix_tokens(self, texts: Sequence[str]) -> int:
+        """Length in tokens of the prefix shared by all prompts."""
+        encoded = self.encode_batch(texts)
+        if not encoded:
+            return 0
+        first = encoded[0]
+        shared = min(len(ids) for ids in encoded)
+        for ids in encoded[1:]:
+            i = 0
+            while i < shared and ids[i] == first[i]:
+                i += 1
+            shared = i
+        return shared
+
+    def prefix_report(self, texts: Sequence[str]) -> dict:
+        """
+        Token lengths and shared prefix of a set of prompts.
+
+        Returns a dict with prompt count, min/mean/max tokens, shared prefix
+        in tokens and full KV blocks, and the fraction of prompt tokens that
+        a warm prefix cache could skip.
+        """
+        counts = self.count_batch(texts)
+        if not counts:
+            return {"prompts": 0}
+        shared = self.shared_prefix_tokens(texts)
+        shared_blocks = self.blocks(shared)
+        cached_tokens = shared_blocks * self.block_size * (len(counts) - 1)
+        return {
+            "prompts": len(counts),
+            "tokens_min": min(counts),
+            "tokens_mean": sum(counts) / len(counts),
+            "tokens_max": max(counts),
+            "tokens_total": sum(counts),
+            "shared_prefix_tokens": shared,
+            "shared_prefix_blocks": shared_blocks,
+            "block_size": self.block_size,
+            "cacheable_fraction": cached_tokens / sum(counts),
+            "exact": self.exact,
+        }
+
+
+def get_token_counter(
+    model: str | None = None,
+    base_url: str | None = "http://localhost:8000",
+    backend: str = "auto",
+    block_size: int = DEFAULT_BLOCK_SIZE,
+) -> TokenCounter:
+    """Process-wide TokenCounter, so each tokenizer is loaded only once."""
+    key = (model or os.getenv("MODEL_NAME", "Qwen/Qwen2.5-0.5B-Instruct"), base_url, backend, block_size)
+    counter = _counters.get(key)
+    if counter is None:
+        counter = _counters[key] = TokenCounter(model, base_url, backend, block_size)
+    return counter
+
+
+def print_prefix_report(title: str, report: dict) -> None:
+    """Print a prefix_report() block."""
+    approx = "" if report.get("exact", True) else " (approximate: no tokenizer available)"
+    print(f"\n{title}{approx}:")
+    if not report.get("prompts"):
+        print("  no prompts")
+        return
+    print(
+        f"  Prompt tokens: min {report['tokens_min']}, mean {report['tokens_mean']:.0f}, "
+        f"max {report['tokens_max']}"
+    )
+    print(
+        f"  Shared prefix: {report['shared_prefix_tokens']} tokens = "
+        f"{report['shared_prefix_blocks']} full blocks of {report['block_size']}"
+    )
+    print(f"  Cacheable:     {report['cacheable_fraction']:.1%} of prompt tokens")
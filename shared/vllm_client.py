@@ -5,12 +5,18 @@ vLLM exposes an OpenAI-compatible API, so we use the official openai library
 pointed at our local vLLM server.
 """
 
+import asyncio
+import json
 import os
-from typing import Iterator
+import time
+from typing import AsyncIterator, Iterator
 
+import aiohttp
 import requests
 from openai import OpenAI
 
+from .timeline import StreamTimeline
+
 
 class VLLMClient:
     """Client for vLLM's OpenAI-compatible API using the openai library."""
@@ -76,6 +82,7 @@ class VLLMClient:
         prompt: str,
         max_tokens: int = 100,
         temperature: float = 0.7,
+        timeline: StreamTimeline | None = None,
     ) -> Iterator[str]:
         """
         Generate a streaming text completion.
@@ -87,10 +94,13 @@ class VLLMClient:
             prompt: The text prompt to complete
             max_tokens: Maximum tokens to generate
             temperature: Sampling temperature
+            timeline: If given, records the arrival time of every chunk
 
         Yields:
             Individual tokens/chunks as they are generated
         """
+        if timeline is not None:
+            timeline.begin()
         stream = self.client.completions.create(
             model=self.model,
             prompt=prompt,
@@ -98,9 +108,277 @@ class VLLMClient:
             temperature=temperature,
             stream=True,
         )
+        if timeline is None:
+            for chunk in stream:
+                if chunk.choices[0].text:
+                    yield chunk.choices[0].text
+            return
+
+        mark, now = timeline.stamps.append, time.perf_counter
         for chunk in stream:
             if chunk.choices[0].text:
+                mark(now())
                 yield chunk.choices[0].text
+        timeline.finish()
+
+
+class AsyncVLLMClient:
+    """
+    Asyncio client for vLLM's OpenAI-compatible API.
+
+    All calls share a single keep-alive connection pool, so one process can
+    hold thousands of requests in flight without a thread per request.
+    Talks to the HTTP API directly instead of going through the openai
+    library, which keeps per-chunk overhead low when streaming.
+
+    Usage:
+        async with AsyncVLLMClient(pool_size=2048) as client:
+            text = await client.complete("Hello, I am")
+    """
+
+    def __init__(
+        self,
+        base_url: str = "http://localhost:8000",
+        model: str | None = None,
+        pool_size: int = 1024,
+        timeout: float = 300.0,
+    ):
+        """
+        Initialize the client.
+
+        The connection pool is created lazily on first use, because aiohttp
+        sessions must be created inside a running event loop.
+
+        Args:
+            base_url: vLLM server URL (default: http://localhost:8000)
+            model: Model name. If not provided, reads from MODEL_NAME env var.
+            pool_size: Max open connections in the shared pool (0 = unlimited)
+            timeout: Total timeout per request in seconds
+        """
+        self.base_url = base_url.rstrip("/")
+        self.model = model or os.getenv("MODEL_NAME", "Qwen/Qwen2.5-0.5B-Instruct")
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._session: aiohttp.ClientSession | None = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """The shared session (and connection pool), created on first access."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=60,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+        return self._session
+
+    async def close(self) -> None:
+        """Close the connection pool."""
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self) -> "AsyncVLLMClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def health_check(self) -> bool:
+        """
+        Check if the vLLM server is healthy.
+
+        Returns:
+            True if server responds to health check, False otherwise.
+        """
+        try:
+            async with self.session.get(
+                f"{self.base_url}/health", timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, TimeoutError):
+            return False
+
+    async def complete(
+        self,
+        prompt: str,
+        max_tokens: int = 100,
+        temperature: float = 0.7,
+        model: str | None = None,
+    ) -> str:
+        """
+        Generate a text completion.
+
+        Args:
+            prompt: The text prompt to complete
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature (0.0 = deterministic, higher = more random)
+            model: Override the model name (e.g. a LoRA adapter name)
+
+        Returns:
+            The generated text completion
+        """
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+        }
+        async with self.session.post(f"{self.base_url}/v1/completions", json=payload) as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        return data["choices"][0]["text"]
+
+    async def complete_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 100,
+        temperature: float = 0.7,
+        model: str | None = None,
+        timeline: StreamTimeline | None = None,
+        cancel_after: int | None = None,
+        read_delay_s: float = 0.0,
+    ) -> AsyncIterator[str]:
+        """
+        Generate a streaming text completion.
+
+        Parses the server-sent events directly and yields text chunks as
+        they arrive.
+
+        Args:
+            prompt: The text prompt to complete
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature
+            model: Override the model name (e.g. a LoRA adapter name)
+            timeline: If given, records the arrival time of every chunk
+            cancel_after: Close the connection after this many chunks, which
+                vLLM treats as an abort (the request's KV blocks are freed)
+            read_delay_s: Pause after each chunk, like a slow consumer; once
+                the socket buffers fill, the server's writes block
+
+        Yields:
+            Individual tokens/chunks as they are generated
+        """
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "stream": True,
+        }
+        now = time.perf_counter
+        mark = timeline.stamps.append if timeline is not None else None
+        received = 0
+        if timeline is not None:
+            timeline.begin()
+        async with self.session.post(f"{self.base_url}/v1/completions", json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.content:
+                if not line.startswith(b"data: "):
+                    continue
+                data = line[6:].strip()
+                if data == b"[DONE]":
+                    break
+                text = json.loads(data)["choices"][0]["text"]
+                if text:
+                    if mark is not None:
+                        mark(now())
+                    yield text
+                    received += 1
+                    if cancel_after is not None and received >= cancel_after:
+                        resp.close()
+                        break
+                    if read_delay_s:
+                        await asyncio.sleep(read_delay_s)
+        if timeline is not None:
+            timeline.finish()
+
+    async def sleep(self, level: int = 1) -> bool:
+        """
+        Put the model to sleep (requires --enable-sleep-mode).
+
+        Args:
+            level: Sleep level (1 = offload weights to CPU, 2 = discard weights)
+
+        Returns:
+            True if successful, False otherwise.
+        """
+        return await self._post_ok(f"/sleep?level={level}")
+
+    async def wake_up(self) -> bool:
+        """
+        Wake the model from sleep.
+
+        Returns:
+            True if successful, False otherwise.
+        """
+        return await self._post_ok("/wake_up")
+
+    async def is_sleeping(self) -> bool:
+        """Check if the model is currently sleeping."""
+        try:
+            async with self.session.get(
+                f"{self.base_url}/is_sleeping", timeout=aiohttp.ClientTimeout(total=5)
+            ) as resp:
+                if resp.status == 200:
+                    return (await resp.json()).get("is_sleeping", False)
+        except (aiohttp.ClientError, TimeoutError):
+            pass
+        return False
+
+    async def load_lora_adapter(
+        self, lora_name: str, lora_path: str, load_inplace: bool = False
+    ) -> bool:
+        """
+        Load a LoRA adapter (requires VLLM_ALLOW_RUNTIME_LORA_UPDATING=True).
+
+        Args:
+            lora_name: Name clients use as the `model` field
+            lora_path: Adapter path as seen by the server
+            load_inplace: Replace an already loaded adapter of the same name
+
+        Returns:
+            True if successful, False otherwise.
+        """
+        payload = {"lora_name": lora_name, "lora_path": lora_path}
+        if load_inplace:
+            payload["load_inplace"] = True
+        return await self._post_ok("/v1/load_lora_adapter", payload)
+
+    async def unload_lora_adapter(self, lora_name: str) -> bool:
+        """
+        Unload a LoRA adapter.
+
+        Returns:
+            True if successful, False otherwise.
+        """
+        return await self._post_ok("/v1/unload_lora_adapter", {"lora_name": lora_name})
+
+    async def list_models(self) -> list[str]:
+        """List served model and adapter names from /v1/models."""
+        async with self.session.get(f"{self.base_url}/v1/models") as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        return [m["id"] for m in data.get("data", [])]
+
+    async def list_lora_adapters(self) -> dict[str, str]:
+        """Loaded LoRA adapters from /v1/models, as {name: path}."""
+        async with self.session.get(f"{self.base_url}/v1/models") as resp:
+            resp.raise_for_status()
+            data = await resp.json()
+        return {m["id"]: m.get("root", "") for m in data.get("data", []) if m.get("parent")}
+
+    async def _post_ok(self, path: str, payload: dict | None = None) -> bool:
+        """POST to an admin endpoint and report whether it returned 200."""
+        try:
+            async with self.session.post(f"{self.base_url}{path}", json=payload) as resp:
+                return resp.status == 200
+        except (aiohttp.ClientError, TimeoutError):
+            return False
 
 
 if __name__ == "__main__":
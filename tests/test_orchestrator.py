@@ -0,0 +1,66 @@
+"""A/B orchestrator against the stub backend (no Docker, no GPU)."""
+
+import dataclasses
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from shared.orchestrator import EXPERIMENTS, StubBackend, comparison_table, run_ab
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_run_ab_stub_two_variants():
+    experiment = EXPERIMENTS["prefix_caching"]
+    port = _free_port()
+    results = run_ab(
+        experiment,
+        StubBackend(port=port),
+        url=f"http://127.0.0.1:{port}",
+        trials=2,
+        options={"prompts": 4, "max_tokens": 4},
+        health_timeout_s=10,
+    )
+
+    assert results["failures"] == []
+    for variant in experiment.variants:
+        assert len(results["startup_s"][variant.name]) == 2
+        for metric in experiment.metrics:
+            assert len(results["samples"][variant.name][metric.key]) == 2
+
+    table = comparison_table(experiment, results)
+    assert "| Metric | apc_on | apc_off |" in table
+    assert "Trials per variant (apc_on: 2, apc_off: 2)" in table
+    # Two trials give a finite CI on every metric, so every cell is "mean ± half-width"
+    rows = [line for line in table.splitlines() if line.startswith("| ") and "±" in line]
+    assert len(rows) == len(experiment.metrics)
+    for row in rows:
+        base, other, diff = row.split("|")[2:5]
+        assert "±" in base and "±" in other and "±" in diff
+
+
+def test_run_ab_tears_down_after_a_failed_trial():
+    def broken_trial(module, url, options):
+        raise RuntimeError("benchmark crashed")
+
+    experiment = dataclasses.replace(EXPERIMENTS["prefix_caching"], trial=broken_trial)
+    port = _free_port()
+
+    class CountingBackend(StubBackend):
+        downs = 0
+
+        def down(self, experiment, variant):
+            CountingBackend.downs += 1
+            super().down(experiment, variant)
+
+    results = run_ab(experiment, CountingBackend(port=port), url=f"http://127.0.0.1:{port}", trials=1)
+
+    assert CountingBackend.downs == 2
+    assert len(results["failures"]) == 2
+    assert all("RuntimeError: benchmark crashed" in f for f in results["failures"])
+    assert "Failed trials:" in comparison_table(experiment, results)